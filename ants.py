@@ -1,9 +1,7 @@
-import random
 import time
 
 import sim
 import colors
-import visualizer
 
 
 class AntSimulator(sim.ParticleSimulator):
@@ -12,18 +10,24 @@ class AntSimulator(sim.ParticleSimulator):
     ANT_LAYER = "ANTS"
     DEAD_ANT_LAYER = "DEAD_ANTS"
 
-    def __init__(self, w, h, initial_spawn_chance=0.01, split_chance=0.01, trail_strength=48):
-        sim.ParticleSimulator.__init__(self, w, h)
+    ANTS_ALIVE = "ANTS_ALIVE"
+
+    def __init__(self, w, h, initial_spawn_chance=0.01, split_chance=0.01, trail_strength=48, layer_storage=None,
+                 rand_seed=None):
+        sim.ParticleSimulator.__init__(self, w, h, rand_seed=rand_seed, layer_storage=layer_storage)
 
         self.initial_spawn_chance = initial_spawn_chance
         self.split_chance = split_chance
         self.trail_strength = trail_strength
 
         self.add_layer(AntSimulator.ANT_LAYER, min_val=0,
-                       initializer_funct=lambda xy: 1 if random.random() < self.initial_spawn_chance else 0)
+                       flat_initializer_funct=sim.get_flat_random_initializer(self.initial_spawn_chance,
+                                                                                rand=self.rand))
         self.add_layer(AntSimulator.TRAIL_LAYER, min_val=0, max_val=trail_strength, default_val=0)
         self.add_layer(AntSimulator.DEAD_ANT_LAYER, min_val=0, default_val=0)
 
+        self.add_reduction(AntSimulator.ANTS_ALIVE, AntSimulator.ANT_LAYER, "sum", cell_local=False)  # moves
+
     def get_color_for_render(self, xy):
         if self.get_value(AntSimulator.ANT_LAYER, xy) > 0:
             return colors.BLACK
@@ -40,10 +44,7 @@ class AntSimulator(sim.ParticleSimulator):
             return base_color
 
     def num_ants_alive(self):
-        count = 0
-        for xy in self.all_points():
-            count += self.get_value(AntSimulator.ANT_LAYER, xy)
-        return count
+        return self.get_reduction(AntSimulator.ANTS_ALIVE)
 
     def update_layers(self, xy, t, write_buffers):
         ant_layer = self.get_layer(AntSimulator.ANT_LAYER)
@@ -52,11 +53,12 @@ class AntSimulator(sim.ParticleSimulator):
 
         ant_val = ant_layer.get_value(xy)
         if ant_val > 0:
-            for _ in range(0, ant_val):
-                neighbors = ant_layer.get_neighbors(xy, include_diagonals=True, shuffled=True)
+            for _ in range(0, int(ant_val)):
+                neighbors = ant_layer.get_neighbors(xy, include_diagonals=True)
+                self.rand.shuffle(neighbors)
                 neighbors = [n for n in neighbors if trail_layer.get_value(n) == 0 and dead_layer.get_value(n) == 0]
 
-                if len(neighbors) >= 2 and random.random() < self.split_chance:
+                if len(neighbors) >= 2 and self.rand.random() < self.split_chance:
                     # we can split
                     write_buffers[AntSimulator.ANT_LAYER].add_value(neighbors[0], 1)
                     write_buffers[AntSimulator.ANT_LAYER].add_value(neighbors[1], 1)
@@ -96,7 +98,18 @@ def do_simul_async(w, h, n):
                 ant_sim.request_simulation_async()
 
 
+async def do_simul_asyncio(w, h, n):
+    ant_sim = AntSimulator(w, h)
+
+    def print_progress(pcnt):
+        print("step {}:\t{:.1%} done".format(ant_sim.get_timestep(), pcnt))
+
+    async for frame in ant_sim.frames(max_steps=n, on_progress=print_progress):
+        print("step {}:\tfinished with {} ants alive.\n".format(frame.timestep, ant_sim.num_ants_alive()))
+
+
 if __name__ == "__main__":
+    import visualizer
     display = visualizer.SimulationDisplay(lambda: AntSimulator(64, 48), name="Ants")
     display.start()
 
@@ -1,9 +1,7 @@
-import random
 import math
 
 import sim
 import colors
-import visualizer
 
 
 class BlobSimulator(sim.ParticleSimulator):
@@ -12,8 +10,10 @@ class BlobSimulator(sim.ParticleSimulator):
     FITNESS_CALC_LAYER = "fitness"
     SCENT_LAYER = "scent"
 
-    def __init__(self, w, h, intial_spawn_rate=0.1, inital_boundary_percent=0.25):
-        sim.ParticleSimulator.__init__(self, w, h)
+    BLOB_COUNT = "blob_count"
+
+    def __init__(self, w, h, intial_spawn_rate=0.1, inital_boundary_percent=0.25, layer_storage=None, rand_seed=None):
+        sim.ParticleSimulator.__init__(self, w, h, rand_seed=rand_seed, layer_storage=layer_storage)
 
         self.ortho_weight = 2
         self.diag_weight = 1
@@ -25,17 +25,29 @@ class BlobSimulator(sim.ParticleSimulator):
 
         self._diffusion_rate = -1
 
-        def initializer(xy):
-            if (w * inital_boundary_percent <= xy[0] <= w * (1 - inital_boundary_percent) and
-                    h * inital_boundary_percent <= xy[1] <= h * (1 - inital_boundary_percent)):
-                return 1 if random.random() < intial_spawn_rate else 0
-            else:
-                return 0
-
-        self.add_layer(BlobSimulator.BLOB_LAYER, min_val=0, max_val=10, initializer_funct=initializer)
-        self.add_layer(BlobSimulator.FITNESS_CALC_LAYER, default_val=-1, out_of_bounds_val=0, min_val=-1)
+        # incremental mode keeps the blob part of each cell's fitness between steps, and only drops it for the cells
+        # around blobs that moved. See incremental_fitness.
+        self._incremental_fitness = False
+        self._fitness_bases = {}        # column-major index -> blob part of the cell's fitness, see _calc_fitness
+        self._moved_cells = []          # cells whose blob values changed during the last step
+
+        def initializer(w, h):
+            res = []
+            for x in range(0, w):
+                if w * inital_boundary_percent <= x <= w * (1 - inital_boundary_percent):
+                    res.extend(1 if (h * inital_boundary_percent <= y <= h * (1 - inital_boundary_percent) and
+                                     self.rand.random() < intial_spawn_rate) else 0 for y in range(0, h))
+                else:
+                    res.extend([0] * h)
+            return res
+
+        self.add_layer(BlobSimulator.BLOB_LAYER, min_val=0, max_val=10, flat_initializer_funct=initializer)
+        self.add_layer(BlobSimulator.FITNESS_CALC_LAYER, default_val=-1, out_of_bounds_val=0, min_val=-1,
+                       is_scratch=True)
         self.add_layer(BlobSimulator.SCENT_LAYER, default_val=0, min_val=0)
 
+        self.add_reduction(BlobSimulator.BLOB_COUNT, BlobSimulator.BLOB_LAYER, "sum", cell_local=False)  # moves
+
     def is_done(self):
         return self.get_timestep() > self.cooling_time
 
@@ -56,10 +68,34 @@ class BlobSimulator(sim.ParticleSimulator):
         else:
             return base_color
 
+    @property
+    def incremental_fitness(self):
+        """
+        If True, the blob part of each cell's fitness (which depends on its neighbors) is kept between steps, and only
+            recomputed around blobs that moved, instead of being recomputed for every cell looked at each step. The
+            scent part is always read fresh, so the results are the same either way.
+        """
+        return self._incremental_fitness
+
+    @incremental_fitness.setter
+    def incremental_fitness(self, val):
+        if val != self._incremental_fitness:
+            # moves aren't tracked while it's off, so whatever was kept is out of date
+            self.request_full_fitness_recompute()
+        self._incremental_fitness = val
+
     def _fitness_at(self, xy, t, write_buffers, minus_2_if_blocked=True):
         if minus_2_if_blocked and self.get_value(BlobSimulator.BLOB_LAYER, xy) > 0:
             return -2
 
+        if self._incremental_fitness:
+            idx = xy[0] * self.h + xy[1]
+            base = self._fitness_bases.get(idx)
+            if base is None:
+                base = self._calc_fitness_base(xy)
+                self._fitness_bases[idx] = base
+            return self._add_scent_fitness(base, xy)
+
         cur_val = write_buffers[BlobSimulator.FITNESS_CALC_LAYER].get_value(xy)
         if cur_val != -1:
             return cur_val
@@ -69,6 +105,10 @@ class BlobSimulator(sim.ParticleSimulator):
             return new_val
 
     def _calc_fitness(self, xy, t):
+        return self._add_scent_fitness(self._calc_fitness_base(xy), xy)
+
+    def _calc_fitness_base(self, xy):
+        """:return: the part of the cell's fitness that comes from the blobs around it"""
         blob_layer = self.get_layer(BlobSimulator.BLOB_LAYER)
         fitness = blob_layer.sum_neighbor_values(xy, func=lambda v: self.ortho_weight * v,
                                                  include_ortho=True, include_diagonals=False)
@@ -78,25 +118,39 @@ class BlobSimulator(sim.ParticleSimulator):
 
         if fitness > 0:
             fitness = math.sqrt(fitness)
+        return fitness
 
-        if blob_layer.get_value(xy) == 0:
+    def _add_scent_fitness(self, fitness, xy):
+        if self.get_value(BlobSimulator.BLOB_LAYER, xy) == 0:
             fitness += self.get_value(BlobSimulator.SCENT_LAYER, xy)
         else:
             fitness += self.get_value(BlobSimulator.SCENT_LAYER, xy) / 4  # not sure why
 
         return fitness
 
+    def request_full_fitness_recompute(self):
+        """makes incremental mode forget the fitness it's kept. Needed after editing the blob layer directly."""
+        self._fitness_bases = {}
+        self._moved_cells = []
+
+    def _forget_moved_fitness(self):
+        for xy in self._moved_cells:
+            for x in range(max(0, xy[0] - 1), min(self.w, xy[0] + 2)):
+                for y in range(max(0, xy[1] - 1), min(self.h, xy[1] + 2)):
+                    self._fitness_bases.pop(x * self.h + y, None)
+        self._moved_cells = []
+
     def pre_update(self, t):
-        self.get_layer(BlobSimulator.FITNESS_CALC_LAYER).fill_not_threadsafe(-1)
+        if self._incremental_fitness:
+            self._forget_moved_fitness()
+        if not self._incremental_fitness or self._kernel is not None:
+            self.get_layer(BlobSimulator.FITNESS_CALC_LAYER).fill_not_threadsafe(-1)
 
         cooling_scale = (1 - (t / self.cooling_time) ** (1 / self.cooling_time_pow))
         self._diffusion_rate = max(0, self.scent_base_diffusion_rate * cooling_scale)
 
     def count_blobs(self):
-        count = 0
-        for xy in self.all_points():
-            count += self.get_value(BlobSimulator.BLOB_LAYER, xy)
-        return count
+        return self.get_reduction(BlobSimulator.BLOB_COUNT)
 
     def update_layers(self, xy, t, write_buffers):
         scent_layer = self.get_layer(BlobSimulator.SCENT_LAYER)
@@ -111,6 +165,9 @@ class BlobSimulator(sim.ParticleSimulator):
             write_buffers[BlobSimulator.SCENT_LAYER].add_value(xy, self._diffusion_rate * self.blob_scent_weight)
 
         blob_layer = self.get_layer(BlobSimulator.BLOB_LAYER)
+        if blob_layer.get_value(xy) == 0:
+            return
+
         my_fitness = self._fitness_at(xy, t, write_buffers, minus_2_if_blocked=False)
 
         neighbors_with_fitness = []
@@ -118,9 +175,6 @@ class BlobSimulator(sim.ParticleSimulator):
 
         available_neighbors = []
 
-        if blob_layer.get_value(xy) == 0:
-            return
-
         for n in blob_layer.get_neighbors(xy, include_ortho=True, include_diagonals=False):
             n_fitness = self._fitness_at(n, t, write_buffers) - self.ortho_weight
             if n_fitness != -2:
@@ -139,15 +193,19 @@ class BlobSimulator(sim.ParticleSimulator):
 
         if len(neighbors_with_fitness) > 0:
             # move to a better neighbor
-            new_xy = random.choices(population=neighbors_with_fitness, weights=neighbor_fitnesses, k=1)[0]
+            new_xy = self.rand.choices(population=neighbors_with_fitness, weights=neighbor_fitnesses, k=1)[0]
             write_buffers[BlobSimulator.BLOB_LAYER].add_value(xy, -1)
             write_buffers[BlobSimulator.BLOB_LAYER].add_value(new_xy, 1)
+            if self._incremental_fitness:
+                self._moved_cells.extend((xy, new_xy))
 
         elif my_fitness == 0 and len(available_neighbors) > 0:
             # rand walk
-            new_xy = random.choice(available_neighbors)
+            new_xy = self.rand.choice(available_neighbors)
             write_buffers[BlobSimulator.BLOB_LAYER].add_value(xy, -1)
             write_buffers[BlobSimulator.BLOB_LAYER].add_value(new_xy, 1)
+            if self._incremental_fitness:
+                self._moved_cells.extend((xy, new_xy))
 
         else:
             pass
@@ -162,5 +220,6 @@ def get_simulator():
 
 
 if __name__ == "__main__":
+    import visualizer
     display = visualizer.SimulationDisplay(get_simulator, name="Blobs")
     display.start()
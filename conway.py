@@ -1,8 +1,5 @@
-import random
-
 import sim
 import colors
-import visualizer
 
 
 class ConwaySimulator(sim.ParticleSimulator):
@@ -15,9 +12,11 @@ class ConwaySimulator(sim.ParticleSimulator):
                  die_counts_diagonal=(),
                  spawn_counts_diagonal=(),
                  die_counts_ortho=(),
-                 spawn_counts_ortho=()):
+                 spawn_counts_ortho=(),
+                 layer_storage=None,
+                 rand_seed=None):
 
-        sim.ParticleSimulator.__init__(self, w, h)
+        sim.ParticleSimulator.__init__(self, w, h, rand_seed=rand_seed, layer_storage=layer_storage)
 
         self.initial_spawn_rate = initial_spawn_rate
 
@@ -31,7 +30,7 @@ class ConwaySimulator(sim.ParticleSimulator):
         self.spawn_counts_ortho = spawn_counts_ortho
 
         self.add_layer(ConwaySimulator.BLOB_LAYER, min_val=0, max_val=1,
-                       initializer_funct=lambda xy: 1 if random.random() < initial_spawn_rate else 0)
+                       flat_initializer_funct=sim.get_flat_random_initializer(initial_spawn_rate, rand=self.rand))
 
     def get_color_for_render(self, xy):
         if self.get_value(ConwaySimulator.BLOB_LAYER, xy) > 0:
@@ -60,6 +59,7 @@ class ConwaySimulator(sim.ParticleSimulator):
 
 
 if __name__ == "__main__":
+    import visualizer
 
     total_spawn = ()
     total_die = (0, 1, 3,)
@@ -0,0 +1,240 @@
+"""
+High resolution output of a finished inkblot, without simulating at high resolution. The ink & dried ink layers are
+    upsampled with bicubic interpolation for raster output, and traced with marching squares for vector (SVG) output.
+"""
+import pathlib
+
+import inkblot
+import pngfile
+
+
+def _get_inkblot_sim(simulation):
+    return simulation.get_active_simulator()
+
+
+def get_ink_fields(simulation):
+    """
+    :param simulation: an InkblotSimulator, or a pipeline whose active stage is one
+    :return: (w, h, ink values, dried ink values), the values as column-major lists covering the full image (so
+        mirrored, for symmetric simulations)
+    """
+    simulation = _get_inkblot_sim(simulation)
+    w, h = simulation.get_size()
+
+    res = []
+    for key in (inkblot.INK, inkblot.DRIED_INK):
+        vals = simulation.get_layer(key).get_flat_values()
+        if simulation.symmetric:
+            half_h = simulation.h
+            cols = [vals[x * half_h:(x + 1) * half_h] for x in range(0, simulation.w)]
+            vals = [val for col in cols + cols[::-1] for val in col]
+        res.append(vals)
+
+    return w, h, res[0], res[1]
+
+
+def _get_taps(src_len, dest_len):
+    """:return: for each destination index, the 4 (source index, Catmull-Rom weight) pairs it's made from"""
+    res = []
+    for i in range(0, dest_len):
+        u = (i + 0.5) * src_len / dest_len - 0.5  # pixel centers line up
+        base = int(u // 1)
+        t = u - base
+        weights = (((-t + 2) * t - 1) * t / 2,
+                   ((3 * t - 5) * t * t + 2) / 2,
+                   ((-3 * t + 4) * t + 1) * t / 2,
+                   (t - 1) * t * t / 2)
+        res.append(tuple((min(src_len - 1, max(0, base + k - 1)), weights[k]) for k in range(0, 4)))
+    return res
+
+
+def upsample(vals, w, h, scale, min_val=0):
+    """
+    :param vals: column-major list of w * h values
+    :param scale: integer factor to scale by
+    :param min_val: the interpolation can overshoot, values are clamped to at least this (None to not clamp)
+    :return: (new w, new h, column-major list of the upsampled values)
+    """
+    new_w, new_h = w * scale, h * scale
+    taps_y = _get_taps(h, new_h)
+    taps_x = _get_taps(w, new_w)
+
+    # separable, so first stretch each column...
+    cols = []
+    for x in range(0, w):
+        col = vals[x * h:(x + 1) * h]
+        cols.append([col[i0] * w0 + col[i1] * w1 + col[i2] * w2 + col[i3] * w3
+                     for (i0, w0), (i1, w1), (i2, w2), (i3, w3) in taps_y])
+
+    # ...then blend the stretched columns together
+    res = []
+    for (i0, w0), (i1, w1), (i2, w2), (i3, w3) in taps_x:
+        new_col = [a * w0 + b * w1 + c * w2 + d * w3 for a, b, c, d in zip(cols[i0], cols[i1], cols[i2], cols[i3])]
+        if min_val is not None:
+            new_col = [max(min_val, val) for val in new_col]
+        res.extend(new_col)
+
+    return new_w, new_h, res
+
+
+def render_rgb(simulation, scale=4):
+    """:return: (w, h, row-major RGB bytes) of the inkblot, upsampled by scale"""
+    w, h, ink_vals, dried_vals = get_ink_fields(simulation)
+    new_w, new_h, ink_vals = upsample(ink_vals, w, h, scale)
+    _, _, dried_vals = upsample(dried_vals, w, h, scale)
+
+    max_val_for_render = _get_inkblot_sim(simulation).max_val_for_render
+
+    rgb = bytearray(new_w * new_h * 3)
+    colors_cache = {}
+    for x in range(0, new_w):
+        for y in range(0, new_h):
+            # most of the image is blank or saturated, so colors repeat a lot once rounded
+            key = (round(ink_vals[x * new_h + y], 3), round(dried_vals[x * new_h + y], 3))
+            if key not in colors_cache:
+                colors_cache[key] = bytes(inkblot.get_ink_color(key[0], key[1], max_val_for_render))
+            idx = (y * new_w + x) * 3
+            rgb[idx:idx + 3] = colors_cache[key]
+
+    return new_w, new_h, bytes(rgb)
+
+
+def write_png(simulation, filepath, scale=4, compression=6):
+    w, h, rgb = render_rgb(simulation, scale=scale)
+    pngfile.write_rgb(filepath, w, h, rgb, compression=compression)
+
+
+# marching squares. Corner bits are 1 = top left, 2 = top right, 4 = bottom right, 8 = bottom left, and each case
+# maps to the pairs of cell edges (0 = top, 1 = right, 2 = bottom, 3 = left) the contour crosses. Saddles (5 & 10)
+# are resolved by the cell's average, see get_contours.
+_SEGMENTS = {
+    1: ((3, 0),), 2: ((0, 1),), 3: ((3, 1),), 4: ((1, 2),), 6: ((0, 2),), 7: ((3, 2),),
+    8: ((2, 3),), 9: ((0, 2),), 11: ((1, 2),), 12: ((3, 1),), 13: ((0, 1),), 14: ((3, 0),),
+}
+_SADDLE_SEGMENTS = {
+    # case -> (segments if the center is inside, segments if it's outside)
+    5: (((0, 1), (2, 3)), ((3, 0), (1, 2))),
+    10: (((3, 0), (1, 2)), ((0, 1), (2, 3))),
+}
+
+
+def get_contours(vals, w, h, level):
+    """
+    :param vals: column-major list of w * h values
+    :return: list of closed contours around the areas where the values are >= level. Each is a list of (x, y)
+        points, in cell coordinates (so the center of cell (0, 0) is at (0, 0)).
+    """
+    # pad with a border of "outside" cells, so contours touching the edge still close
+    def get(x, y):
+        if 1 <= x <= w and 1 <= y <= h:
+            return vals[(x - 1) * h + y - 1]
+        else:
+            return level - 1
+
+    def get_edge(x, y, edge_idx):
+        """edges are identified by their first corner and direction, so neighboring cells agree on them"""
+        if edge_idx == 0:
+            return x, y, False
+        elif edge_idx == 1:
+            return x + 1, y, True
+        elif edge_idx == 2:
+            return x, y + 1, False
+        else:
+            return x, y, True
+
+    links = {}  # edge -> edges the contour continues to
+    for x in range(0, w + 1):
+        for y in range(0, h + 1):
+            corners = (get(x, y), get(x + 1, y), get(x + 1, y + 1), get(x, y + 1))
+            case = sum(1 << i for i in range(0, 4) if corners[i] >= level)
+            if case in _SEGMENTS:
+                segments = _SEGMENTS[case]
+            elif case in _SADDLE_SEGMENTS:
+                segments = _SADDLE_SEGMENTS[case][0 if sum(corners) / 4 >= level else 1]
+            else:
+                continue
+
+            for e1, e2 in segments:
+                edge1 = get_edge(x, y, e1)
+                edge2 = get_edge(x, y, e2)
+                links.setdefault(edge1, []).append(edge2)
+                links.setdefault(edge2, []).append(edge1)
+
+    def get_point(edge):
+        ex, ey, is_vertical = edge
+        a = get(ex, ey)
+        b = get(ex, ey + 1) if is_vertical else get(ex + 1, ey)
+        t = (level - a) / (b - a)
+        return (ex - 1, ey - 1 + t) if is_vertical else (ex - 1 + t, ey - 1)
+
+    res = []
+    while len(links) > 0:
+        start = next(iter(links))
+        contour = [get_point(start)]
+        prev, cur = None, start
+        while True:
+            nexts = links.pop(cur)
+            nxt = nexts[0] if nexts[0] != prev or len(nexts) == 1 else nexts[1]
+            if nxt == start or nxt not in links:
+                break
+            contour.append(get_point(nxt))
+            prev, cur = cur, nxt
+        res.append(contour)
+
+    return res
+
+
+def to_svg(simulation, scale=4, levels=(0.1, 0.4, 0.7)):
+    """
+    :param scale: size of the image relative to the simulation. Only affects the svg's default size.
+    :param levels: ink amounts to draw contours at, as fractions of the simulation's max_val_for_render (where the
+        ink is fully black). Each one is filled with a translucent black, so they stack up into shades.
+    :return: the svg document, as a string
+    """
+    w, h, ink_vals, dried_vals = get_ink_fields(simulation)
+    total_vals = [a + b for a, b in zip(ink_vals, dried_vals)]
+    max_val_for_render = _get_inkblot_sim(simulation).max_val_for_render
+
+    lines = ['<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}" viewBox="0 0 {} {}">'.format(
+                 w * scale, h * scale, w, h),
+             '<rect width="{}" height="{}" fill="white"/>'.format(w, h)]
+
+    for level in levels:
+        path = []
+        for contour in get_contours(total_vals, w, h, level * max_val_for_render):
+            # + 0.5 to go from cell coordinates to image coordinates
+            path.append("M" + " L".join("{:.3f} {:.3f}".format(px + 0.5, py + 0.5) for px, py in contour) + " Z")
+        if len(path) > 0:
+            lines.append('<path fill="black" fill-opacity="{:.3f}" fill-rule="evenodd" d="{}"/>'.format(
+                1 / len(levels), " ".join(path)))
+
+    lines.append("</svg>")
+    return "\n".join(lines) + "\n"
+
+
+def write_svg(simulation, filepath, scale=4, levels=(0.1, 0.4, 0.7)):
+    with open(str(filepath), "w") as f:
+        f.write(to_svg(simulation, scale=scale, levels=levels))
+
+
+def export(simulation, output_dir, name="inkblot", scale=4, levels=(0.1, 0.4, 0.7)):
+    """writes name.png and name.svg of the (finished) inkblot to output_dir"""
+    output_dir = pathlib.Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    png_path = pathlib.Path(output_dir, name + ".png")
+    print("INFO: writing {}".format(png_path))
+    write_png(simulation, png_path, scale=scale)
+
+    svg_path = pathlib.Path(output_dir, name + ".svg")
+    print("INFO: writing {}".format(svg_path))
+    write_svg(simulation, svg_path, scale=scale, levels=levels)
+
+
+if __name__ == "__main__":
+    import rorschach
+
+    pipe = rorschach.get_pipeline()
+    for _ in pipe.run():
+        pass
+    export(pipe, "output/export/", scale=8)
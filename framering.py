@@ -0,0 +1,273 @@
+"""
+Runs a simulation in its own process, publishing rendered frames into a ring of slots in shared memory. Any number of
+    viewers (see visualizer.SharedFrameDisplay) or recorders (see record_frames) can attach to the ring by name and
+    read the latest frame, without sharing a GIL with the simulation or slowing it down.
+
+Layout of the shared memory: a header, then n_slots slots, each a slot header followed by slot_capacity bytes of
+    row-major RGB. Every slot header starts with a sequence number, which is odd while the slot is being written, so
+    readers can tell when a copy they made was torn and retry (a seqlock).
+"""
+import multiprocessing
+import multiprocessing.resource_tracker as resource_tracker
+import multiprocessing.shared_memory as shared_memory
+import pathlib
+import struct
+import sys
+import time
+
+import pngfile
+import worker
+
+_MAGIC = b"RFRM"
+_HEADER = struct.Struct("<4sIIIQ")      # magic, n_slots, slot_capacity, is_done, latest frame number
+_HEADER_SIZE = 32
+_SLOT_HEADER = struct.Struct("<QIIQ")   # sequence number, w, h, timestep
+_SLOT_HEADER_SIZE = 32
+
+_READ_ATTEMPTS = 8
+
+
+class SharedFrame:
+
+    def __init__(self, number, timestep, size, rgb):
+        self.number = number        # how many frames had been published, including this one
+        self.timestep = timestep
+        self.size = size
+        self.rgb = rgb              # row-major RGB bytes, see sim.Frame.get_rgb
+
+    def __repr__(self):
+        return "SharedFrame(number={}, timestep={}, size={})".format(self.number, self.timestep, self.size)
+
+
+class FrameRing:
+    """
+    A ring of frame slots in shared memory, with one writer. Use FrameRing.create in the process that owns it and
+        FrameRing.attach everywhere else.
+    """
+
+    def __init__(self, shm, is_owner):
+        self._shm = shm
+        self._buf = shm.buf
+        self._is_owner = is_owner
+
+        magic, self.n_slots, self.slot_capacity, _, _ = _HEADER.unpack_from(self._buf, 0)
+        if magic != _MAGIC:
+            raise ValueError("shared memory {} doesn't hold a frame ring".format(shm.name))
+
+        self._last_written = self._get_latest_number()
+
+    @staticmethod
+    def create(max_size, n_slots=3, name=None):
+        """
+        :param max_size: (w, h) of the largest frame that will be published
+        :param n_slots: at least 2, so the newest frame can be read while the next one is written
+        """
+        if n_slots < 2:
+            raise ValueError("need at least 2 slots, got {}".format(n_slots))
+        slot_capacity = max_size[0] * max_size[1] * 3
+        shm = shared_memory.SharedMemory(name=name, create=True,
+                                         size=_HEADER_SIZE + n_slots * (_SLOT_HEADER_SIZE + slot_capacity))
+        shm.buf[0:len(shm.buf)] = bytes(len(shm.buf))
+        _HEADER.pack_into(shm.buf, 0, _MAGIC, n_slots, slot_capacity, 0, 0)
+        return FrameRing(shm, True)
+
+    @staticmethod
+    def attach(name):
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+            # otherwise the resource tracker unlinks it when this process exits, out from under everyone else
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return FrameRing(shm, False)
+
+    def get_name(self):
+        return self._shm.name
+
+    def close(self):
+        """detaches from the ring. The owner also frees it, so it should close last."""
+        self._buf.release()
+        self._shm.close()
+        if self._is_owner:
+            if sys.version_info < (3, 13):
+                # attaching from a child process can unregister it from the tracker this process shares, see attach
+                resource_tracker.register(self._shm._name, "shared_memory")
+            self._shm.unlink()
+
+    def _get_slot_offset(self, number):
+        return _HEADER_SIZE + ((number - 1) % self.n_slots) * (_SLOT_HEADER_SIZE + self.slot_capacity)
+
+    def _get_latest_number(self):
+        return _HEADER.unpack_from(self._buf, 0)[4]
+
+    def is_done(self):
+        """:return: whether the writer has marked the simulation as done"""
+        return _HEADER.unpack_from(self._buf, 0)[3] != 0
+
+    def set_done(self, val=True):
+        struct.pack_into("<I", self._buf, 12, 1 if val else 0)
+
+    def publish(self, size, timestep, rgb):
+        """writes a frame into the next slot. Only one process may publish to a ring."""
+        w, h = size
+        if len(rgb) != w * h * 3:
+            raise ValueError("expected {} bytes of RGB, got {}".format(w * h * 3, len(rgb)))
+        if len(rgb) > self.slot_capacity:
+            raise ValueError("frame of size {} doesn't fit in the ring's slots ({} bytes)".format(
+                size, self.slot_capacity))
+
+        number = self._last_written + 1
+        offset = self._get_slot_offset(number)
+        data_offset = offset + _SLOT_HEADER_SIZE
+
+        _SLOT_HEADER.pack_into(self._buf, offset, 2 * number - 1, w, h, timestep)
+        self._buf[data_offset:data_offset + len(rgb)] = rgb
+        struct.pack_into("<Q", self._buf, offset, 2 * number)
+
+        struct.pack_into("<Q", self._buf, 16, number)
+        self._last_written = number
+
+    def read_latest(self, after=0):
+        """
+        :param after: a frame number, to only return frames newer than it
+        :return: a copy of the most recently published SharedFrame, or None if there isn't one (newer than after)
+        """
+        for _ in range(0, _READ_ATTEMPTS):
+            number = self._get_latest_number()
+            if number == 0 or number <= after:
+                return None
+
+            offset = self._get_slot_offset(number)
+            seq, w, h, timestep = _SLOT_HEADER.unpack_from(self._buf, offset)
+            if seq != 2 * number:
+                continue    # already being overwritten, the writer has lapped the ring
+
+            data_offset = offset + _SLOT_HEADER_SIZE
+            rgb = bytes(self._buf[data_offset:data_offset + w * h * 3])
+
+            if struct.unpack_from("<Q", self._buf, offset)[0] == seq:
+                return SharedFrame(number, timestep, (w, h), rgb)
+
+        return None
+
+    def wait_for_frame(self, after=0, timeout=None, poll_interval=0.005):
+        """
+        :return: the latest SharedFrame newer than after, or None if there wasn't one within timeout seconds (or the
+            simulation finished without publishing one)
+        """
+        start_time = time.time()
+        while True:
+            done = self.is_done()   # checked first, so a frame published just before finishing isn't missed
+            frame = self.read_latest(after=after)
+            if frame is not None or done:
+                return frame
+            if timeout is not None and time.time() - start_time >= timeout:
+                return None
+            time.sleep(poll_interval)
+
+
+def _run_simulation(simulation_provider, ring_name, publish_every):
+    ring = FrameRing.attach(ring_name)
+    try:
+        simulation = simulation_provider()
+        sim_worker = worker.SimulationWorker(simulation, publish_every=publish_every, render=True)
+        sim_worker.add_frame_listener(lambda frame: ring.publish(frame.size, frame.timestep, frame.get_rgb()))
+
+        sim_worker.start()
+        sim_worker.run_until_done()
+        try:
+            sim_worker.wait_until_idle()
+        finally:
+            sim_worker.stop()
+    finally:
+        # so viewers and recorders stop waiting, even if the simulation failed
+        ring.set_done()
+        ring.close()
+
+
+class SimulationProcess:
+    """
+    Runs simulation_provider() to completion in a separate process, publishing its frames to a FrameRing. The
+        provider must be picklable (e.g. a module level function like rorschach.get_pipeline).
+    """
+
+    def __init__(self, simulation_provider, max_size, n_slots=3, publish_every=1):
+        """
+        :param max_size: (w, h) of the largest frame the simulation will produce
+        :param publish_every: publish a frame after every k steps, see worker.SimulationWorker
+        """
+        self.simulation_provider = simulation_provider
+        self.ring = FrameRing.create(max_size, n_slots=n_slots)
+        self._process = multiprocessing.Process(target=_run_simulation,
+                                                args=(simulation_provider, self.ring.get_name(), publish_every),
+                                                daemon=True)
+
+    def start(self):
+        self._process.start()
+        return self
+
+    def get_ring_name(self):
+        return self.ring.get_name()
+
+    def is_alive(self):
+        return self._process.is_alive()
+
+    def join(self, timeout=None):
+        self._process.join(timeout)
+
+    def stop(self):
+        """kills the simulation if it's still running, and frees the ring"""
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process.join()
+        self.ring.close()
+
+
+def record_frames(ring_name, output_dir, output_format="png", compression=6):
+    """
+    Writes every frame it sees published to the ring to output_dir, until the simulation is done. Frames published
+        while one is being written are skipped.
+    :param output_format: "png", "palette" or "greyscale", see visualizer.SimulationDisplay.record_output
+    """
+    if output_format not in ("png", "palette", "greyscale"):
+        raise ValueError("unknown output format: {}".format(output_format))
+
+    ring = FrameRing.attach(ring_name)
+    output_dir = pathlib.Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    last_number = 0
+    last_timestep = -1
+    while True:
+        frame = ring.wait_for_frame(after=last_number)
+        if frame is None:
+            break
+        last_number = frame.number
+        if frame.timestep == last_timestep:
+            continue
+        last_timestep = frame.timestep
+
+        w, h = frame.size
+        filepath = pathlib.Path(output_dir, "output_{}.png".format(str(frame.timestep).zfill(4)))
+        print("INFO: writing {}".format(filepath))
+        if output_format == "png":
+            pngfile.write_rgb(filepath, w, h, frame.rgb, compression=compression)
+        elif output_format == "palette":
+            if not pngfile.write_palette(filepath, w, h, frame.rgb, compression=compression):
+                print("WARN: {} has more than 256 colors, wrote it as RGB".format(filepath))
+        else:
+            pngfile.write_greyscale(filepath, w, h, pngfile.rgb_to_greyscale(frame.rgb), compression=compression)
+
+    ring.close()
+
+
+if __name__ == "__main__":
+    import rorschach
+    import visualizer
+
+    max_size = (rorschach.w * rorschach.upscale, rorschach.h * rorschach.upscale)
+    sim_process = SimulationProcess(rorschach.get_pipeline, max_size).start()
+    try:
+        visualizer.SharedFrameDisplay(sim_process.get_ring_name(), name="Rorschach").start()
+    finally:
+        sim_process.stop()
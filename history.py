@@ -0,0 +1,178 @@
+import array
+import copy
+import zlib
+
+import sim
+
+
+class RunHistory:
+    """
+    Records the layers of a ParticleSimulator (or the active stage of a SimulationPipeline) at every timestep, as
+        periodic keyframes plus zlib-compressed deltas (just the cells that changed). Any recorded timestep can then
+        be reconstructed from the nearest keyframe and at most keyframe_interval - 1 deltas, and a whole run can be
+        re-rendered (at a different size or with different colors) without re-simulating it.
+
+    Values are stored as 64-bit floats, so reconstructed layers hold floats even where the simulation used ints.
+    """
+
+    def __init__(self, simulation, keyframe_interval=25, compression=6):
+        self.simulation = simulation
+        self.keyframe_interval = keyframe_interval
+        self.compression = compression
+
+        self._stages = []           # the simulators the recorded states came from
+        self._layer_settings = []   # for each stage, layer_key -> the kwargs to remake the layer with, see record
+        self._entries = []          # list of (timestep, stage_idx, is_keyframe, {layer_key: compressed data})
+        self._entry_idx_for_timestep = {}
+
+        self._last_stage = None
+        self._last_values = None    # layer_key -> flat values, as of the last recorded entry
+        self._entries_since_keyframe = 0
+
+    def _get_stage(self):
+        # a pipeline's stages are the simulators it moves through
+        return self.simulation.get_active_simulator()
+
+    def record(self):
+        """records the simulation's current state"""
+        stage = self._get_stage()
+        t = self.simulation.get_timestep()
+
+        frame = stage.get_frame()
+        values = {key: frame.get_layer(key).get_flat_values(clamp=False) for key in frame.get_layer_keys()}
+
+        if stage is not self._last_stage:
+            self._stages.append(stage)
+            self._layer_settings.append({})
+            self._last_stage = stage
+
+        # kept rather than read from the stage later, since by then it may have handed its layers on (see adopt_layer)
+        layer_settings = self._layer_settings[-1]
+        for key in values:
+            if key not in layer_settings:
+                layer = stage.get_layer(key)
+                layer_settings[key] = {"default_val": layer._default_val, "min_val": layer._min_val,
+                                       "max_val": layer._max_val, "out_of_bounds_val": layer._oob_val}
+
+        is_keyframe = (self._last_values is None or
+                       self._entries_since_keyframe + 1 >= self.keyframe_interval or
+                       self._entries[-1][1] != len(self._stages) - 1 or
+                       set(values.keys()) != set(self._last_values.keys()))
+
+        data = {}
+        for key in values:
+            if is_keyframe:
+                data[key] = self._compress(array.array("d", values[key]).tobytes())
+            else:
+                prev = self._last_values[key]
+                changed = [i for i, (new_val, old_val) in enumerate(zip(values[key], prev)) if new_val != old_val]
+                data[key] = self._compress(array.array("I", changed).tobytes() +
+                                           array.array("d", [values[key][i] for i in changed]).tobytes())
+
+        self._entry_idx_for_timestep[t] = len(self._entries)
+        self._entries.append((t, len(self._stages) - 1, is_keyframe, data))
+        self._entries_since_keyframe = 0 if is_keyframe else self._entries_since_keyframe + 1
+        self._last_values = values
+
+    def run_and_record(self, max_steps=None):
+        """runs the simulation (see Simulator.run), recording its initial state and every step after it"""
+        if len(self._entries) == 0:
+            self.record()
+        for _ in self.simulation.run(max_steps=max_steps):
+            self.record()
+
+    def _compress(self, data):
+        return zlib.compress(data, self.compression)
+
+    def get_timesteps(self):
+        return [entry[0] for entry in self._entries]
+
+    def get_compressed_size(self):
+        """:return: number of bytes of compressed data being stored"""
+        return sum(len(d) for entry in self._entries for d in entry[3].values())
+
+    def _apply_entry(self, entry, values):
+        """updates values (layer_key -> flat list) in place with the entry's keyframe or delta"""
+        if entry[2]:
+            values.clear()
+        for key, data in entry[3].items():
+            raw = zlib.decompress(data)
+            if entry[2]:
+                values[key] = array.array("d", raw).tolist()
+            else:
+                n_changed = len(raw) // (array.array("I").itemsize + array.array("d").itemsize)
+                idx_bytes = n_changed * array.array("I").itemsize
+                indices = array.array("I", raw[0:idx_bytes])
+                new_vals = array.array("d", raw[idx_bytes:])
+                layer_vals = values[key]
+                for i, val in zip(indices, new_vals):
+                    layer_vals[i] = val
+
+    def get_layers(self, t):
+        """:return: layer_key -> column-major list of the layer's values at timestep t"""
+        if t not in self._entry_idx_for_timestep:
+            raise ValueError("timestep {} wasn't recorded".format(t))
+
+        end_idx = self._entry_idx_for_timestep[t]
+        start_idx = end_idx
+        while not self._entries[start_idx][2]:
+            start_idx -= 1
+
+        values = {}
+        for entry in self._entries[start_idx:end_idx + 1]:
+            self._apply_entry(entry, values)
+        return values
+
+    def _make_simulator(self, stage_idx, values):
+        res = copy.copy(self._stages[stage_idx])
+        res._static_layers = {}
+        res._dynamic_layers = {}
+        res._published_frame = None
+        for key, vals in values.items():
+            layer = sim._ParticleLayer(res.w, res.h, **self._layer_settings[stage_idx][key])
+            layer.set_flat_values_not_threadsafe(vals)
+            res._dynamic_layers[key] = layer
+        res._reduction_vals = {name: res._dynamic_layers[layer_key].reduce(kind)
+                               for name, (layer_key, kind, _) in res._reductions.items() if layer_key in values}
+        return res
+
+    def get_simulator_at(self, t):
+        """:return: a copy of the simulator that was running at timestep t, holding its reconstructed layers. Meant
+            for rendering & inspecting, not for simulating further."""
+        return self._make_simulator(self._entries[self._entry_idx_for_timestep[t]][1], self.get_layers(t))
+
+    def render(self, t, size=None, color_funct=None):
+        """
+        :param size: (w, h) to scale the image to (nearest neighbor), or None for the simulation's size
+        :param color_funct: lambda simulator, xy -> color, or None to use the simulator's get_color_for_render
+        :return: row-major RGB bytes, see sim.Frame.get_rgb
+        """
+        return self._render(self.get_simulator_at(t), size, color_funct)
+
+    def render_all(self, size=None, color_funct=None):
+        """generator of (timestep, RGB bytes) for every recorded timestep, reconstructing them in order"""
+        values = {}
+        for entry in self._entries:
+            self._apply_entry(entry, values)
+            yield entry[0], self._render(self._make_simulator(entry[1], values), size, color_funct)
+
+    def _render(self, simulator, size, color_funct):
+        sim_w, sim_h = simulator.get_size()
+        out_w, out_h = (sim_w, sim_h) if size is None else size
+
+        colors_at = {}
+
+        def get_color(xy):
+            if xy not in colors_at:
+                if color_funct is None:
+                    colors_at[xy] = bytes(simulator.get_color_for_render(xy)[0:3])
+                else:
+                    colors_at[xy] = bytes(color_funct(simulator, xy)[0:3])
+            return colors_at[xy]
+
+        sim_xs = [x * sim_w // out_w for x in range(0, out_w)]
+        rows = []
+        for y in range(0, out_h):
+            sim_y = y * sim_h // out_h
+            rows.append(b"".join(get_color((sim_x, sim_y)) for sim_x in sim_xs))
+        return b"".join(rows)
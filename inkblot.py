@@ -1,20 +1,34 @@
-import random
 import math
 
 import sim
-import visualizer
 import colors
 
 # layers
 STATIC_PRESSURE = "static_pressure"
 INK = "ink"
 DRIED_INK = "dried_ink"
+WET_INK_KEPT = "wet_ink_kept"  # scratch, how much of each cell's ink stayed wet (and didn't flow away) last step
+INK_FLOWED = "ink_flowed"  # scratch, how much ink flowed out of each cell last step
+
+# reductions
+TOTAL_WET_INK = "total_wet_ink"
+TOTAL_INK_FLOWED = "total_ink_flowed"
+TOTAL_DRIED_INK = "total_dried_ink"
 
 
 class InkblotSimulator(sim.ParticleSimulator):
 
-    def __init__(self, w, h, wet_ink_func=None):
-        sim.ParticleSimulator.__init__(self, w, h)
+    def __init__(self, w, h, wet_ink_func=None, layer_storage=None, symmetric=False, flat_wet_ink_func=None,
+                 rand_seed=None):
+        """
+        :param wet_ink_func: lambda xy -> initial amount of ink, e.g. get_droplet_func
+        :param flat_wet_ink_func: faster alternative to wet_ink_func, lambda w, h -> column-major list of the initial
+            amounts of ink, e.g. get_flat_droplet_func
+        :param symmetric: if True, only the left half of a left/right mirrored image is simulated. w is the width of
+            the half, the right edge acts as a mirror, and get_size & rendering cover the full (2 * w) image.
+        """
+        sim.ParticleSimulator.__init__(self, w, h, rand_seed=rand_seed, layer_storage=layer_storage)
+        self.symmetric = symmetric
 
         self.flow_rate = 0.25
         self.dried_ink_pressure_pcnt = 0.5
@@ -26,11 +40,61 @@ class InkblotSimulator(sim.ParticleSimulator):
         self.pcnt_to_dry_base = 0.00
         self.pcnt_to_dry_inc_per_step = 0.01
 
-        self._total_wet_ink = 1
+        self.start_time = 0  # added to the timestep when drying, for simulations continuing another one (see prolong)
+
+        self._done_at_flow_pcnt = None  # see done_at_flow_pcnt
 
-        self.add_layer(INK, min_val=0, initializer_funct=wet_ink_func)
+        self.add_layer(INK, min_val=0, initializer_funct=wet_ink_func, flat_initializer_funct=flat_wet_ink_func)
         self.add_layer(DRIED_INK, min_val=0, default_val=0)
-        self.add_layer(STATIC_PRESSURE, is_static=True, initializer_funct=lambda xy: random.random())
+        self.add_layer(STATIC_PRESSURE, is_static=True,
+                       flat_initializer_funct=lambda w, h: [self.rand.random() for _ in range(0, w * h)])
+        self.add_layer(WET_INK_KEPT, is_scratch=True)
+
+        self.add_reduction(TOTAL_WET_INK, WET_INK_KEPT, "sum")
+        self.add_reduction(TOTAL_DRIED_INK, DRIED_INK, "sum")
+
+    @property
+    def done_at_flow_pcnt(self):
+        """
+        If set, the simulation counts as done once less than this fraction of its ink flows in a step. For handing off
+            to a finer simulation once the large scale spreading is over, see prolong. Keeping track of the flow takes
+            an extra layer (INK_FLOWED) written every step, so that's only added once this is first set, which should be
+            before the first step.
+        """
+        return self._done_at_flow_pcnt
+
+    @done_at_flow_pcnt.setter
+    def done_at_flow_pcnt(self, val):
+        if val is not None and self.get_layer(INK_FLOWED) is None:
+            self.add_layer(INK_FLOWED, is_scratch=True)
+            self.add_reduction(TOTAL_INK_FLOWED, INK_FLOWED, "sum")
+        self._done_at_flow_pcnt = val
+
+    def get_size(self):
+        if self.symmetric:
+            return 2 * self.w, self.h
+        else:
+            return self.w, self.h
+
+    def _reflect(self, xy):
+        """maps a point in the mirrored (right) half of a symmetric simulation to its twin in the simulated half"""
+        if self.symmetric and xy[0] >= self.w:
+            return 2 * self.w - 1 - xy[0], xy[1]
+        else:
+            return xy
+
+    def _get_flow_neighbors(self, xy):
+        """:return: list of ((x, y), is_ortho) for the cells ink can flow to from xy"""
+        res = []
+        ink_layer = self.get_layer(INK)
+        for n in ink_layer.get_neighbors(xy, valid_only=not self.symmetric, include_ortho=True, include_diagonals=True):
+            is_ortho = abs(n[0] - xy[0]) + abs(n[1] - xy[1]) <= 1
+            if self.symmetric:
+                n = self._reflect(n)
+                if not ink_layer.is_valid(n):
+                    continue
+            res.append((n, is_ortho))
+        return res
 
     def _pressure_at(self, xy, t):
         res = (self.get_value(INK, xy) +
@@ -42,11 +106,20 @@ class InkblotSimulator(sim.ParticleSimulator):
 
         return res
 
-    def is_done(self):
-        return self._total_wet_ink <= 0
+    def get_flow_pcnt(self):
+        """:return: the fraction of all the ink (wet or dried) that flowed somewhere last step"""
+        if self.get_layer(INK_FLOWED) is None:
+            raise ValueError("the flow isn't being kept track of, see done_at_flow_pcnt")
+        flowed = self.get_reduction(TOTAL_INK_FLOWED)
+        total = flowed + self.get_reduction(TOTAL_WET_INK) + self.get_reduction(TOTAL_DRIED_INK)
+        return flowed / total if total > 0 else 0.0
 
-    def pre_update(self, t):
-        self._total_wet_ink = 0
+    def is_done(self):
+        if self.get_timestep() == 0:
+            return False
+        elif self.done_at_flow_pcnt is not None and self.get_flow_pcnt() < self.done_at_flow_pcnt:
+            return True
+        return self.get_reduction(TOTAL_WET_INK) <= 0
 
     def update_layers(self, xy, t, write_buffers):
         ink_val = self.get_value(INK, xy)
@@ -55,9 +128,8 @@ class InkblotSimulator(sim.ParticleSimulator):
 
             # spread the ink
             low_pressure_neighbors = []  # list of ((x, y), pressure, flow_rate_mult)
-            for n in self.get_layer(INK).get_neighbors(xy, valid_only=True, include_ortho=True, include_diagonals=True):
+            for n, is_ortho in self._get_flow_neighbors(xy):
                 pressure = self._pressure_at(n, t)
-                is_ortho = abs(n[0] - xy[0]) + abs(n[1] - xy[1]) <= 1
                 weight = 1 if is_ortho else 1 / 1.4142  # "care less" about diagonal neighbors
                 if pressure < orig_pressure:
                     low_pressure_neighbors.append((n, pressure, weight))
@@ -86,7 +158,8 @@ class InkblotSimulator(sim.ParticleSimulator):
             ink_remaining = ink_val - amount_flowed
 
             if ink_remaining > 0.1:
-                pcnt_to_dry = min(1, random.random() * (self.pcnt_to_dry_base + t * self.pcnt_to_dry_inc_per_step))
+                pcnt_to_dry = min(1, self.rand.random() * (self.pcnt_to_dry_base +
+                                                           (self.start_time + t) * self.pcnt_to_dry_inc_per_step))
                 amount_to_dry = pcnt_to_dry * ink_remaining
             else:
                 amount_to_dry = ink_remaining
@@ -94,24 +167,87 @@ class InkblotSimulator(sim.ParticleSimulator):
             write_buffers[INK].add_value(xy, -amount_to_dry)
             write_buffers[DRIED_INK].add_value(xy, amount_to_dry)
 
-            self._total_wet_ink += ink_remaining - amount_to_dry
+            write_buffers[WET_INK_KEPT].set_value_not_threadsafe(xy, ink_remaining - amount_to_dry)
+            if INK_FLOWED in write_buffers:
+                write_buffers[INK_FLOWED].set_value_not_threadsafe(xy, amount_flowed)
 
     def get_color_for_render(self, xy):
-        ink_val = self.get_value(INK, xy)
-        dried_val = self.get_value(DRIED_INK, xy)
+        xy = self._reflect(xy)
+        return get_ink_color(self.get_value(INK, xy), self.get_value(DRIED_INK, xy), self.max_val_for_render)
+
+
+def _prolong_values(vals, src_w, src_h, w, h):
+    """
+    :return: column-major vals (src_w by src_h) resampled to w by h with bilinear interpolation, except that values
+        aren't blended with empty (0) cells, so the edges of the ink stay sharp instead of smearing it around thinly.
+    """
+    def lerp(a, b, t):
+        if a == 0 or b == 0:
+            return a if t < 0.5 else b
+        return a * (1 - t) + b * t
+
+    def get_taps(src_len, dest_len):
+        res = []
+        for i in range(0, dest_len):
+            u = min(src_len - 1, max(0, (i + 0.5) * src_len / dest_len - 0.5))  # pixel centers line up
+            i0 = min(src_len - 2, int(u)) if src_len > 1 else 0
+            res.append((i0, min(src_len - 1, i0 + 1), u - i0))
+        return res
 
-        base_color = colors.WHITE
-        wet_base_color = colors.BLACK
-        dry_base_color = colors.BLACK
+    taps_y = get_taps(src_h, h)
+    cols = []
+    for x in range(0, src_w):
+        col = vals[x * src_h:(x + 1) * src_h]
+        cols.append([lerp(col[y0], col[y1], t) for y0, y1, t in taps_y])
 
-        if ink_val + dried_val > 0:
-            ink_color = colors.lerp(base_color, wet_base_color, ink_val / self.max_val_for_render)
-            dried_color = colors.lerp(base_color, dry_base_color, dried_val / self.max_val_for_render)
+    res = []
+    for x0, x1, t in get_taps(src_w, w):
+        res.extend([lerp(a, b, t) for a, b in zip(cols[x0], cols[x1])])
+    return res
 
-            pcnt_dried = dried_val / (ink_val + dried_val)
-            return colors.lerp(ink_color, dried_color, pcnt_dried)
-        else:
-            return base_color
+
+def prolong(coarse_sim, w, h, static_detail=0.5):
+    """
+    Continues a (coarse) simulation at a finer resolution, for coarse-to-fine schedules: the large scale spreading of
+        the ink is smooth, so it can be done on a smaller grid, and only the rest at full size.
+    :param w, h: size of the new simulation (of its simulated half, for symmetric ones)
+    :param static_detail: how much fresh, full resolution noise is mixed into the (smooth, interpolated) static
+        pressure, to give the ink's edges their texture back.
+    :return: a new InkblotSimulator with the coarse one's settings, and its ink, dried ink & static pressure layers
+        interpolated up to w by h.
+    """
+    with sim.skipping_initializers():
+        res = InkblotSimulator(w, h, layer_storage=coarse_sim._layer_storage, symmetric=coarse_sim.symmetric)
+
+    for attr in ("flow_rate", "dried_ink_pressure_pcnt", "max_static_pressure", "boundary_pressure",
+                 "max_val_for_render", "pcnt_to_dry_base", "pcnt_to_dry_inc_per_step"):
+        setattr(res, attr, getattr(coarse_sim, attr))
+    res.start_time = coarse_sim.start_time + coarse_sim.get_timestep()
+    res.set_parallel(coarse_sim._parallel)
+
+    for key in (INK, DRIED_INK, STATIC_PRESSURE):
+        vals = _prolong_values(coarse_sim.get_layer(key).get_flat_values(), coarse_sim.w, coarse_sim.h, w, h)
+        if key == STATIC_PRESSURE:
+            vals = [val * (1 - static_detail) + res.rand.random() * static_detail for val in vals]
+        res.get_layer(key).set_flat_values_not_threadsafe(vals)
+
+    res.refresh_reductions()
+    return res
+
+
+def get_ink_color(ink_val, dried_val, max_val_for_render):
+    base_color = colors.WHITE
+    wet_base_color = colors.BLACK
+    dry_base_color = colors.BLACK
+
+    if ink_val + dried_val > 0:
+        ink_color = colors.lerp(base_color, wet_base_color, ink_val / max_val_for_render)
+        dried_color = colors.lerp(base_color, dry_base_color, dried_val / max_val_for_render)
+
+        pcnt_dried = dried_val / (ink_val + dried_val)
+        return colors.lerp(ink_color, dried_color, pcnt_dried)
+    else:
+        return base_color
 
 
 def get_droplet_func(center, radius, height):
@@ -133,6 +269,32 @@ def get_droplet_square_func(center, length, height):
     return _func
 
 
+def get_flat_droplet_func(center, radius, height):
+    """flat initializer version of get_droplet_func, which only visits the cells near the droplet"""
+    def _func(w, h):
+        res = [0] * (w * h)
+        for x in range(max(0, math.floor(center[0] - radius)), min(w, math.ceil(center[0] + radius) + 1)):
+            for y in range(max(0, math.floor(center[1] - radius)), min(h, math.ceil(center[1] + radius) + 1)):
+                dist = math.sqrt((center[0] - x)**2 + (center[1] - y)**2)
+                if dist <= radius:
+                    res[x * h + y] = height * math.sqrt(1 - dist / radius)
+        return res
+    return _func
+
+
+def get_flat_droplet_square_func(center, length, height):
+    """flat initializer version of get_droplet_square_func"""
+    def _func(w, h):
+        res = [0] * (w * h)
+        for x in range(max(0, math.floor(center[0] - length / 2)), min(w, math.ceil(center[0] + length / 2) + 1)):
+            if abs(center[0] - x) <= length / 2:
+                for y in range(max(0, math.floor(center[1] - length / 2)), min(h, math.ceil(center[1] + length / 2) + 1)):
+                    if abs(center[1] - y) <= length / 2:
+                        res[x * h + y] = height
+        return res
+    return _func
+
+
 def get_simulator():
     w = 64
     h = int(w * 48 / 64)
@@ -140,11 +302,11 @@ def get_simulator():
     ink_height = 3
     ink_radius = w // 5
 
-    # drop_func = get_droplet_func((w // 2, h // 2), ink_radius, ink_height)
+    # drop_func = get_flat_droplet_func((w // 2, h // 2), ink_radius, ink_height)
 
-    drop_func = get_droplet_square_func((w // 2, h // 2), ink_radius, ink_height)
+    drop_func = get_flat_droplet_square_func((w // 2, h // 2), ink_radius, ink_height)
 
-    res = InkblotSimulator(w, h, wet_ink_func=drop_func)
+    res = InkblotSimulator(w, h, flat_wet_ink_func=drop_func)
 
     res.max_static_pressure = 0.5
     res.boundary_pressure = 0.65
@@ -153,5 +315,6 @@ def get_simulator():
 
 
 if __name__ == "__main__":
+    import visualizer
     display = visualizer.SimulationDisplay(get_simulator, name="Inkblot")
     display.start()
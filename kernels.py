@@ -0,0 +1,692 @@
+"""
+Compiled whole-step kernels for the built-in simulators. These need numba (and numpy), which are optional. Without
+    them use_jit does nothing and simulators keep running their regular per-cell update_layers.
+
+Compiled kernels are cached on disk (in __pycache__), so only the first process to use one pays for compiling it.
+    They follow the same rules as the python versions, but draw their random numbers from numba's generator
+    (seeded from the simulator's rand every step), so runs aren't identical to the python ones.
+
+use_jit also moves the simulation's layers into numpy arrays (see ArrayLayerStorage), which the kernels read and
+    write in place, so a step doesn't convert the layers to and from python lists.
+"""
+import functools
+import threading
+
+try:
+    import numba
+    import numpy
+except ImportError:
+    numba = None
+    numpy = None
+
+import ants
+import blobs
+import conway
+import inkblot
+import sim
+
+
+def _jit(func):
+    return numba.njit(cache=True)(func) if numba is not None else func
+
+
+def is_available():
+    return numba is not None
+
+
+def use_jit(simulation):
+    """
+    Makes the simulation use a compiled kernel, if numba is installed and there's a kernel for its class.
+    :return: whether the simulation is now using a compiled kernel.
+    """
+    kernel = _KERNELS.get(type(simulation))
+    if numba is None:
+        print("INFO: numba isn't installed, {} will use the python update".format(type(simulation).__name__))
+        return False
+    elif kernel is None:
+        print("INFO: no compiled kernel for {}, it will use the python update".format(type(simulation).__name__))
+        return False
+    else:
+        simulation.set_kernel(kernel)
+        if simulation._layer_storage is None or isinstance(simulation._layer_storage, ArrayLayerStorage):
+            _use_array_layers(simulation, kernel.dtypes)
+        return True
+
+
+class ArrayLayerStorage:
+    """
+    Keeps a ParticleSimulator's layers in numpy arrays (pass it as layer_storage), which the compiled kernels use
+        directly. use_jit switches simulations with regular in-memory layers over to it.
+    """
+
+    def __init__(self, dtype="float64"):
+        self.dtype = dtype
+
+    def new_layer(self, w, h, default_val=0, min_val=None, max_val=None, out_of_bounds_val=0):
+        return _ArrayLayer(numpy.full((w, h), default_val, dtype=self.dtype), default_val=default_val,
+                           min_val=min_val, max_val=max_val, out_of_bounds_val=out_of_bounds_val)
+
+
+def _use_array_layers(simulation, dtypes):
+    """
+    :param dtypes: layer_key -> dtype for layers that shouldn't be float64
+    """
+    with simulation._color_lock:
+        for layers in (simulation._static_layers, simulation._dynamic_layers, simulation._scratch_layers):
+            for key, layer in layers.items():
+                dtype = dtypes.get(key, "float64")
+                if not isinstance(layer, _ArrayLayer) or layer.array.dtype != dtype:
+                    layers[key] = _ArrayLayer.from_layer(layer, dtype)
+        simulation._layer_storage = ArrayLayerStorage()
+        simulation._published_frame = None
+
+
+# kind -> function of an array, see sim.ParticleSimulator.add_reduction
+_ARRAY_REDUCTIONS = {
+    "sum": lambda a: a.sum(),
+    "count_nonzero": lambda a: numpy.count_nonzero(a),
+    "min": lambda a: a.min(),
+    "max": lambda a: a.max()
+}
+
+
+class _ArrayLayer(sim._ParticleLayer):
+    """a layer backed by a numpy array of shape (w, h)"""
+
+    def __init__(self, array, default_val=0, min_val=None, max_val=None, out_of_bounds_val=0):
+        # deliberately not calling super().__init__, which would allocate the layer as lists
+        self.w, self.h = array.shape
+        self._oob_val = out_of_bounds_val
+        self._default_val = default_val
+
+        self._max_val = max_val
+        self._min_val = min_val
+
+        self._write_lock = threading.Lock()
+
+        self.array = array
+
+    @staticmethod
+    def from_layer(layer, dtype):
+        array = numpy.array(layer.get_flat_values(clamp=False), dtype=dtype).reshape((layer.w, layer.h))
+        return _ArrayLayer(array, default_val=layer._default_val, min_val=layer._min_val, max_val=layer._max_val,
+                           out_of_bounds_val=layer._oob_val)
+
+    def get_memory_size(self):
+        return self.array.nbytes
+
+    def make_copy(self, leave_empty=False):
+        if leave_empty:
+            array = numpy.full((self.w, self.h), self._default_val, dtype=self.array.dtype)
+        else:
+            array = self.array.copy()
+        return _ArrayLayer(array, default_val=self._default_val, min_val=self._min_val, max_val=self._max_val,
+                           out_of_bounds_val=self._oob_val)
+
+    def get_clamped_array(self):
+        """:return: the values clamped to the layer's min & max, which is the array itself if it has neither"""
+        if self._min_val is None and self._max_val is None:
+            return self.array
+        return numpy.clip(self.array, self._min_val, self._max_val)
+
+    def set_value_not_threadsafe(self, xy, val):
+        if self.is_valid(xy):
+            self.array[xy[0], xy[1]] = val
+
+    def fill_not_threadsafe(self, val):
+        self.array.fill(val)  # in place, so an array that's a slice of a stack (see _Kernel.start_batch) stays one
+
+    def get_flat_values(self, clamp=True):
+        return (self.get_clamped_array() if clamp else self.array).ravel().tolist()
+
+    def reduce(self, kind, rect=None):
+        x, y, w, h = [0, 0, self.w, self.h] if rect is None else rect
+        vals = self.array[x:x + w, y:y + h]
+        if self._min_val is not None or self._max_val is not None:
+            vals = numpy.clip(vals, self._min_val, self._max_val)
+        return numpy.asarray(_ARRAY_REDUCTIONS[kind](vals)).item()
+
+    def set_flat_values_not_threadsafe(self, vals):
+        if len(vals) != self.w * self.h:
+            raise ValueError("expected {} values, got {}".format(self.w * self.h, len(vals)))
+        self.array = numpy.array(vals, dtype=self.array.dtype).reshape((self.w, self.h))
+
+    def add_value(self, xy, val):
+        if self.is_valid(xy):
+            with self._write_lock:
+                self.array[xy[0], xy[1]] += val
+
+    def get_value(self, xy):
+        if self.is_valid(xy):
+            val = self.array[xy[0], xy[1]].item()
+            if self._max_val is not None and val > self._max_val:
+                return self._max_val
+            elif self._min_val is not None and val < self._min_val:
+                return self._min_val
+            else:
+                return val
+        else:
+            return self._oob_val
+
+
+def _read(layer, dtype, clamp=True):
+    """:return: the layer as an array. For array layers with clamp=False (and a matching dtype) that's the layer's own
+        array, so writes to it go straight into the layer."""
+    if isinstance(layer, _ArrayLayer):
+        array = layer.get_clamped_array() if clamp else layer.array
+        return array if array.dtype == dtype else array.astype(dtype)
+    return numpy.array(layer.get_flat_values(clamp=clamp), dtype=dtype).reshape((layer.w, layer.h))
+
+
+def _write(layer, array):
+    if isinstance(layer, _ArrayLayer):
+        if array is not layer.array:
+            layer.array[...] = array
+    else:
+        layer.set_flat_values_not_threadsafe(array.ravel().tolist())
+
+
+def _stack_of(layers):
+    """:return: the (n, w, h) array whose slices are the n layers' arrays (in order), or None if there isn't one"""
+    if not all(isinstance(layer, _ArrayLayer) for layer in layers):
+        return None
+    stack = layers[0].array.base
+    if stack is None or stack.shape != (len(layers),) + layers[0].array.shape:
+        return None
+    for k, layer in enumerate(layers):
+        if layer.array.base is not stack or layer.array.ctypes.data != stack[k].ctypes.data:
+            return None
+    return stack
+
+
+def _read_stacked(layers, dtype, clamp=True):
+    """
+    :return: the layers (of simulations of the same class) as one (n, w, h) array, like _read. If they're already
+        slices of one array (see _Kernel.start_batch), that's used rather than stacking them, so with clamp=False
+        writes go straight into the layers.
+    """
+    stack = _stack_of(layers)
+    if stack is None or stack.dtype != dtype:
+        return numpy.stack([_read(layer, dtype, clamp=clamp) for layer in layers])
+    elif clamp and (layers[0]._min_val is not None or layers[0]._max_val is not None):
+        return numpy.clip(stack, layers[0]._min_val, layers[0]._max_val)
+    return stack
+
+
+def _write_stacked(layers, stack):
+    if _stack_of(layers) is stack:
+        return
+    for k, layer in enumerate(layers):
+        if isinstance(layer, _ArrayLayer) and layer.array.dtype == stack.dtype:
+            layer.array = stack[k]  # so the next step finds them stacked
+        else:
+            _write(layer, stack[k])
+
+
+def _counts_lookup(counts):
+    res = numpy.zeros(9, dtype=numpy.bool_)
+    for c in counts:
+        if 0 <= c < 9:
+            res[c] = True
+    return res
+
+
+_ORTHO_OFFSETS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+_DIAG_OFFSETS = ((-1, -1), (1, -1), (1, 1), (-1, 1))
+_ALL_OFFSETS = _ORTHO_OFFSETS + _DIAG_OFFSETS
+
+
+@_jit
+def _seed(seed):
+    numpy.random.seed(seed)
+
+
+class _Kernel:
+
+    dtypes = {}  # layer_key -> dtype of its array, for the layers that aren't float64
+
+    def simulate(self, simulation, write_buffers):
+        _seed(simulation.rand.getrandbits(32))
+        self._simulate(simulation, write_buffers)
+
+    def start_batch(self, simulations):
+        """
+        Starts a step of several simulations at once, see simulate_batch. Their array layers' write buffers are made
+            as slices of one (n, w, h) array per layer, so a kernel that steps them all in one call can use it as is.
+        :return: each simulation's write buffers
+        """
+        stacks = {}  # layer_key -> the array the simulations' write buffers are slices of
+
+        def copy_layer(k, layer_key, layer):
+            if not isinstance(layer, _ArrayLayer):
+                return layer.make_copy()
+            if layer_key not in stacks:
+                stacks[layer_key] = numpy.empty((len(simulations),) + layer.array.shape, dtype=layer.array.dtype)
+            stack = stacks[layer_key]
+            stack[k] = layer.array
+            return _ArrayLayer(stack[k], default_val=layer._default_val, min_val=layer._min_val,
+                               max_val=layer._max_val, out_of_bounds_val=layer._oob_val)
+
+        return [s._start_step(copy_layer=functools.partial(copy_layer, k)) for k, s in enumerate(simulations)]
+
+    def simulate_batch(self, simulations, all_write_buffers):
+        """steps several simulations (e.g. an ensemble's members) at once, see ParticleSimulator.set_kernel"""
+        for simulation, write_buffers in zip(simulations, all_write_buffers):
+            self.simulate(simulation, write_buffers)
+
+    def _simulate(self, simulation, write_buffers):
+        raise NotImplementedError()
+
+    def get_step_memory_size(self, simulation):
+        """:return: an estimate of the bytes of the temporary arrays a step makes, on top of the layers themselves"""
+        res = 0
+        for layers in (simulation._static_layers, simulation._dynamic_layers, simulation._scratch_layers):
+            for layer in layers.values():
+                if not isinstance(layer, _ArrayLayer):
+                    res += layer.w * layer.h * 8    # read into an array, see _read
+                elif layer._min_val is not None or layer._max_val is not None:
+                    res += layer.array.nbytes       # the clamped copy
+        return res
+
+
+@_jit
+def _conway_step(blob, out, die_total, spawn_total, die_diag, spawn_diag, die_ortho, spawn_ortho):
+    w, h = blob.shape
+    for x in range(w):
+        for y in range(h):
+            ortho_count = 0
+            diag_count = 0
+            for i in range(8):
+                nx = x + _ALL_OFFSETS[i][0]
+                ny = y + _ALL_OFFSETS[i][1]
+                if 0 <= nx < w and 0 <= ny < h:
+                    if i < 4:
+                        ortho_count += blob[nx, ny]
+                    else:
+                        diag_count += blob[nx, ny]
+            total_count = ortho_count + diag_count
+
+            if blob[x, y] > 0:
+                if die_total[total_count] or die_ortho[ortho_count] or die_diag[diag_count]:
+                    out[x, y] -= 1
+            else:
+                if spawn_total[total_count] or spawn_ortho[ortho_count] or spawn_diag[diag_count]:
+                    out[x, y] += 1
+
+
+class _ConwayKernel(_Kernel):
+
+    dtypes = {conway.ConwaySimulator.BLOB_LAYER: "int64"}
+
+    def _simulate(self, simulation, write_buffers):
+        key = conway.ConwaySimulator.BLOB_LAYER
+        out = _read(write_buffers[key], numpy.int64, clamp=False)
+        _conway_step(_read(simulation.get_layer(key), numpy.int64), out,
+                     _counts_lookup(simulation.die_counts_total), _counts_lookup(simulation.spawn_counts_total),
+                     _counts_lookup(simulation.die_counts_diagonal), _counts_lookup(simulation.spawn_counts_diagonal),
+                     _counts_lookup(simulation.die_counts_ortho), _counts_lookup(simulation.spawn_counts_ortho))
+        _write(write_buffers[key], out)
+
+
+@_jit
+def _ants_step(ant, trail, dead, out_ant, out_trail, out_dead, split_chance, trail_strength):
+    w, h = ant.shape
+    neighbors = numpy.empty((8, 2), dtype=numpy.int64)
+    for y in range(h):
+        for x in range(w):
+            if ant[x, y] > 0:
+                for _ in range(ant[x, y]):
+                    n_neighbors = 0
+                    for i in range(8):
+                        nx = x + _ALL_OFFSETS[i][0]
+                        ny = y + _ALL_OFFSETS[i][1]
+                        if 0 <= nx < w and 0 <= ny < h:
+                            neighbors[n_neighbors, 0] = nx
+                            neighbors[n_neighbors, 1] = ny
+                            n_neighbors += 1
+
+                    # shuffle, then keep the ones without trails or dead ants
+                    for i in range(n_neighbors - 1, 0, -1):
+                        j = numpy.random.randint(0, i + 1)
+                        for k in range(2):
+                            temp = neighbors[i, k]
+                            neighbors[i, k] = neighbors[j, k]
+                            neighbors[j, k] = temp
+                    n_open = 0
+                    for i in range(n_neighbors):
+                        if trail[neighbors[i, 0], neighbors[i, 1]] == 0 and dead[neighbors[i, 0], neighbors[i, 1]] == 0:
+                            neighbors[n_open, 0] = neighbors[i, 0]
+                            neighbors[n_open, 1] = neighbors[i, 1]
+                            n_open += 1
+
+                    if n_open >= 2 and numpy.random.random() < split_chance:
+                        out_ant[neighbors[0, 0], neighbors[0, 1]] += 1
+                        out_ant[neighbors[1, 0], neighbors[1, 1]] += 1
+                        out_ant[x, y] -= 1
+                        out_trail[x, y] += trail_strength
+                    elif n_open > 0:
+                        out_ant[neighbors[0, 0], neighbors[0, 1]] += 1
+                        out_ant[x, y] -= 1
+                        out_trail[x, y] += trail_strength
+                    else:
+                        out_ant[x, y] -= 1
+                        out_dead[x, y] += 1
+            else:
+                out_trail[x, y] -= 1
+
+
+class _AntsKernel(_Kernel):
+
+    dtypes = {key: "int64" for key in (ants.AntSimulator.ANT_LAYER, ants.AntSimulator.TRAIL_LAYER,
+                                       ants.AntSimulator.DEAD_ANT_LAYER)}
+
+    def _simulate(self, simulation, write_buffers):
+        keys = (ants.AntSimulator.ANT_LAYER, ants.AntSimulator.TRAIL_LAYER, ants.AntSimulator.DEAD_ANT_LAYER)
+        outs = [_read(write_buffers[key], numpy.int64, clamp=False) for key in keys]
+        _ants_step(*[_read(simulation.get_layer(key), numpy.int64) for key in keys], *outs,
+                   simulation.split_chance, simulation.trail_strength)
+        for key, out in zip(keys, outs):
+            _write(write_buffers[key], out)
+
+
+@_jit
+def _blob_fitness(blob, scent, x, y, ortho_weight, diag_weight):
+    w, h = blob.shape
+    fitness = 0.0
+    for i in range(8):
+        nx = x + _ALL_OFFSETS[i][0]
+        ny = y + _ALL_OFFSETS[i][1]
+        if 0 <= nx < w and 0 <= ny < h:
+            fitness += (ortho_weight if i < 4 else diag_weight) * blob[nx, ny]
+
+    if fitness > 0:
+        fitness = numpy.sqrt(fitness)
+
+    if blob[x, y] == 0:
+        fitness += scent[x, y]
+    else:
+        fitness += scent[x, y] / 4
+    return fitness
+
+
+@_jit
+def _blobs_step(blob, scent, fitness, out_blob, out_scent, moves, diffusion_rate, blob_scent_weight,
+                ortho_weight, diag_weight):
+    """fitness is the memo (-1 = not computed yet), and is filled in as it goes. returns the number of moved cells."""
+    w, h = blob.shape
+    n_moves = 0
+
+    candidates = numpy.empty((8, 2), dtype=numpy.int64)
+    candidate_weights = numpy.empty(8, dtype=numpy.float64)
+    available = numpy.empty((8, 2), dtype=numpy.int64)
+
+    for y in range(h):
+        for x in range(w):
+            my_scent = scent[x, y]
+            out_scent[x, y] -= my_scent
+            if my_scent > 0.001 and diffusion_rate > 0:
+                for i in range(8):
+                    nx = x + _ALL_OFFSETS[i][0]
+                    ny = y + _ALL_OFFSETS[i][1]
+                    if 0 <= nx < w and 0 <= ny < h:
+                        out_scent[nx, ny] += diffusion_rate * my_scent / 8
+
+            if diffusion_rate > 0 and blob[x, y] > 0:
+                out_scent[x, y] += diffusion_rate * blob_scent_weight
+
+            if blob[x, y] == 0:
+                continue
+
+            if fitness[x, y] == -1:
+                fitness[x, y] = _blob_fitness(blob, scent, x, y, ortho_weight, diag_weight)
+            my_fitness = fitness[x, y]
+
+            n_candidates = 0
+            n_available = 0
+            for i in range(8):
+                nx = x + _ALL_OFFSETS[i][0]
+                ny = y + _ALL_OFFSETS[i][1]
+                if not (0 <= nx < w and 0 <= ny < h):
+                    continue
+
+                if blob[nx, ny] > 0:
+                    n_fitness = -2.0
+                else:
+                    if fitness[nx, ny] == -1:
+                        fitness[nx, ny] = _blob_fitness(blob, scent, nx, ny, ortho_weight, diag_weight)
+                    n_fitness = fitness[nx, ny]
+                n_fitness -= ortho_weight if i < 4 else diag_weight
+
+                if n_fitness != -2:
+                    available[n_available, 0] = nx
+                    available[n_available, 1] = ny
+                    n_available += 1
+                if n_fitness > my_fitness and n_fitness > 0:
+                    candidates[n_candidates, 0] = nx
+                    candidates[n_candidates, 1] = ny
+                    candidate_weights[n_candidates] = n_fitness
+                    n_candidates += 1
+
+            new_x = -1
+            new_y = -1
+            if n_candidates > 0:
+                total = 0.0
+                for i in range(n_candidates):
+                    total += candidate_weights[i]
+                r = numpy.random.random() * total
+                chosen = n_candidates - 1
+                for i in range(n_candidates):
+                    r -= candidate_weights[i]
+                    if r < 0:
+                        chosen = i
+                        break
+                new_x = candidates[chosen, 0]
+                new_y = candidates[chosen, 1]
+            elif my_fitness == 0 and n_available > 0:
+                chosen = numpy.random.randint(0, n_available)
+                new_x = available[chosen, 0]
+                new_y = available[chosen, 1]
+
+            if new_x >= 0:
+                out_blob[x, y] -= 1
+                out_blob[new_x, new_y] += 1
+                moves[n_moves, 0] = x
+                moves[n_moves, 1] = y
+                moves[n_moves + 1, 0] = new_x
+                moves[n_moves + 1, 1] = new_y
+                n_moves += 2
+
+    return n_moves
+
+
+@_jit
+def _blobs_step_batch(blob, scent, fitness, out_blob, out_scent, moves, n_moves, seeds, diffusion_rates,
+                      blob_scent_weights, ortho_weights, diag_weights):
+    """_blobs_step for several simulations, whose arrays are stacked along the first axis"""
+    for k in range(blob.shape[0]):
+        numpy.random.seed(seeds[k])
+        n_moves[k] = _blobs_step(blob[k], scent[k], fitness[k], out_blob[k], out_scent[k], moves[k],
+                                 diffusion_rates[k], blob_scent_weights[k], ortho_weights[k], diag_weights[k])
+
+
+class _BlobsKernel(_Kernel):
+
+    dtypes = {blobs.BlobSimulator.BLOB_LAYER: "int64"}
+
+    def _simulate(self, simulation, write_buffers):
+        blob_key = blobs.BlobSimulator.BLOB_LAYER
+        scent_key = blobs.BlobSimulator.SCENT_LAYER
+        fitness_key = blobs.BlobSimulator.FITNESS_CALC_LAYER
+
+        out_blob = _read(write_buffers[blob_key], numpy.int64, clamp=False)
+        out_scent = _read(write_buffers[scent_key], numpy.float64, clamp=False)
+        fitness = _read(write_buffers[fitness_key], numpy.float64)
+        moves = numpy.empty((2 * simulation.w * simulation.h, 2), dtype=numpy.int64)
+
+        n_moves = _blobs_step(_read(simulation.get_layer(blob_key), numpy.int64),
+                              _read(simulation.get_layer(scent_key), numpy.float64),
+                              fitness, out_blob, out_scent, moves,
+                              simulation._diffusion_rate, simulation.blob_scent_weight,
+                              simulation.ortho_weight, simulation.diag_weight)
+
+        _write(write_buffers[blob_key], out_blob)
+        _write(write_buffers[scent_key], out_scent)
+        _write(write_buffers[fitness_key], fitness)
+        self._record_moves(simulation, moves, n_moves)
+
+    def simulate_batch(self, simulations, all_write_buffers):
+        # one compiled call for the whole batch, instead of one per simulation. The layers are already stacked (see
+        # start_batch), or get stacked on the first step, after which they stay that way
+        blob_key = blobs.BlobSimulator.BLOB_LAYER
+        scent_key = blobs.BlobSimulator.SCENT_LAYER
+        fitness_key = blobs.BlobSimulator.FITNESS_CALC_LAYER
+
+        out_blob_layers = [wb[blob_key] for wb in all_write_buffers]
+        out_scent_layers = [wb[scent_key] for wb in all_write_buffers]
+        fitness_layers = [wb[fitness_key] for wb in all_write_buffers]
+        out_blob = _read_stacked(out_blob_layers, numpy.int64, clamp=False)
+        out_scent = _read_stacked(out_scent_layers, numpy.float64, clamp=False)
+        fitness = _read_stacked(fitness_layers, numpy.float64)
+        w, h = simulations[0].w, simulations[0].h
+        moves = numpy.empty((len(simulations), 2 * w * h, 2), dtype=numpy.int64)
+        n_moves = numpy.zeros(len(simulations), dtype=numpy.int64)
+
+        _blobs_step_batch(_read_stacked([s.get_layer(blob_key) for s in simulations], numpy.int64),
+                          _read_stacked([s.get_layer(scent_key) for s in simulations], numpy.float64),
+                          fitness, out_blob, out_scent, moves, n_moves,
+                          numpy.array([s.rand.getrandbits(32) for s in simulations], dtype=numpy.int64),
+                          numpy.array([s._diffusion_rate for s in simulations], dtype=numpy.float64),
+                          numpy.array([s.blob_scent_weight for s in simulations], dtype=numpy.float64),
+                          numpy.array([s.ortho_weight for s in simulations], dtype=numpy.float64),
+                          numpy.array([s.diag_weight for s in simulations], dtype=numpy.float64))
+
+        _write_stacked(out_blob_layers, out_blob)
+        _write_stacked(out_scent_layers, out_scent)
+        _write_stacked(fitness_layers, fitness)
+        for k, simulation in enumerate(simulations):
+            self._record_moves(simulation, moves[k], n_moves[k])
+
+    def get_step_memory_size(self, simulation):
+        return _Kernel.get_step_memory_size(self, simulation) + 2 * simulation.w * simulation.h * 2 * 8  # the moves
+
+    @staticmethod
+    def _record_moves(simulation, moves, n_moves):
+        if simulation.incremental_fitness:
+            simulation._moved_cells.extend(tuple(xy) for xy in moves[0:n_moves].tolist())
+
+
+@_jit
+def _inkblot_pressure(ink, dried, static, x, y, max_static_pressure, dried_ink_pressure_pcnt, boundary_pressure):
+    res = ink[x, y] + max_static_pressure * static[x, y] + dried_ink_pressure_pcnt * dried[x, y]
+    if ink[x, y] == 0 and dried[x, y] == 0:
+        res += boundary_pressure
+    return res
+
+
+@_jit
+def _inkblot_step(ink, dried, static, out_ink, out_dried, out_wet_kept, out_flowed, track_flow, t, symmetric, flow_rate,
+                  max_static_pressure, dried_ink_pressure_pcnt, boundary_pressure, pcnt_to_dry_base,
+                  pcnt_to_dry_inc_per_step):
+    w, h = ink.shape
+
+    lpn_xy = numpy.empty((8, 2), dtype=numpy.int64)
+    lpn_pressure = numpy.empty(8, dtype=numpy.float64)
+    lpn_key = numpy.empty(8, dtype=numpy.float64)
+
+    for y in range(h):
+        for x in range(w):
+            ink_val = ink[x, y]
+            if ink_val < 0:
+                continue
+
+            orig_pressure = _inkblot_pressure(ink, dried, static, x, y,
+                                              max_static_pressure, dried_ink_pressure_pcnt, boundary_pressure)
+
+            n_lpn = 0
+            for i in range(8):
+                nx = x + _ALL_OFFSETS[i][0]
+                ny = y + _ALL_OFFSETS[i][1]
+                if symmetric and nx >= w:
+                    nx = 2 * w - 1 - nx
+                if not (0 <= nx < w and 0 <= ny < h):
+                    continue
+
+                pressure = _inkblot_pressure(ink, dried, static, nx, ny,
+                                             max_static_pressure, dried_ink_pressure_pcnt, boundary_pressure)
+                weight = 1.0 if i < 4 else 1 / 1.4142
+                if pressure < orig_pressure:
+                    # insertion sort, biggest key first (and stable, like list.sort)
+                    key = weight * abs(orig_pressure - pressure)
+                    j = n_lpn
+                    while j > 0 and lpn_key[j - 1] < key:
+                        lpn_xy[j, 0] = lpn_xy[j - 1, 0]
+                        lpn_xy[j, 1] = lpn_xy[j - 1, 1]
+                        lpn_pressure[j] = lpn_pressure[j - 1]
+                        lpn_key[j] = lpn_key[j - 1]
+                        j -= 1
+                    lpn_xy[j, 0] = nx
+                    lpn_xy[j, 1] = ny
+                    lpn_pressure[j] = pressure
+                    lpn_key[j] = key
+                    n_lpn += 1
+
+            max_amount_to_flow = flow_rate * ink_val
+            amount_flowed = 0.0
+            for i in range(n_lpn):
+                my_pressure = orig_pressure - amount_flowed
+                amount_to_give = min(max_amount_to_flow - amount_flowed, (my_pressure - lpn_pressure[i]) / 2)
+                if amount_to_give <= 0:
+                    break
+                out_ink[lpn_xy[i, 0], lpn_xy[i, 1]] += amount_to_give
+                out_ink[x, y] -= amount_to_give
+                amount_flowed += amount_to_give
+
+            ink_remaining = ink_val - amount_flowed
+            if ink_remaining > 0.1:
+                pcnt_to_dry = min(1.0, numpy.random.random() * (pcnt_to_dry_base + t * pcnt_to_dry_inc_per_step))
+                amount_to_dry = pcnt_to_dry * ink_remaining
+            else:
+                amount_to_dry = ink_remaining
+
+            out_ink[x, y] -= amount_to_dry
+            out_dried[x, y] += amount_to_dry
+            out_wet_kept[x, y] = ink_remaining - amount_to_dry
+            if track_flow:
+                out_flowed[x, y] = amount_flowed
+
+
+class _InkblotKernel(_Kernel):
+
+    def _simulate(self, simulation, write_buffers):
+        out_ink = _read(write_buffers[inkblot.INK], numpy.float64, clamp=False)
+        out_dried = _read(write_buffers[inkblot.DRIED_INK], numpy.float64, clamp=False)
+        out_wet_kept = _read(write_buffers[inkblot.WET_INK_KEPT], numpy.float64, clamp=False)
+        # only there when the simulation keeps track of the flow, see InkblotSimulator.done_at_flow_pcnt
+        track_flow = inkblot.INK_FLOWED in write_buffers
+        if track_flow:
+            out_flowed = _read(write_buffers[inkblot.INK_FLOWED], numpy.float64, clamp=False)
+        else:
+            out_flowed = numpy.empty((0, 0), dtype=numpy.float64)
+
+        _inkblot_step(
+            _read(simulation.get_layer(inkblot.INK), numpy.float64),
+            _read(simulation.get_layer(inkblot.DRIED_INK), numpy.float64),
+            _read(simulation.get_layer(inkblot.STATIC_PRESSURE), numpy.float64),
+            out_ink, out_dried, out_wet_kept, out_flowed, track_flow, simulation.start_time + simulation.get_timestep(),
+            simulation.symmetric, simulation.flow_rate, simulation.max_static_pressure,
+            simulation.dried_ink_pressure_pcnt, simulation.boundary_pressure, simulation.pcnt_to_dry_base,
+            simulation.pcnt_to_dry_inc_per_step)
+
+        _write(write_buffers[inkblot.INK], out_ink)
+        _write(write_buffers[inkblot.DRIED_INK], out_dried)
+        _write(write_buffers[inkblot.WET_INK_KEPT], out_wet_kept)
+        if track_flow:
+            _write(write_buffers[inkblot.INK_FLOWED], out_flowed)
+
+
+_KERNELS = {
+    conway.ConwaySimulator: _ConwayKernel(),
+    ants.AntSimulator: _AntsKernel(),
+    blobs.BlobSimulator: _BlobsKernel(),
+    inkblot.InkblotSimulator: _InkblotKernel(),
+}
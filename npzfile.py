@@ -0,0 +1,40 @@
+"""
+Writes layers as NumPy .npz files (a zip of .npy arrays), without needing numpy. numpy.load gives back one float64
+    array of shape (w, h) per layer, indexed [x, y] like the layers are.
+"""
+import array
+import sys
+import zipfile
+
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"  # format version 1.0
+
+
+def encode_npy(w, h, vals):
+    """
+    :param vals: column-major list of w * h values (see sim._ParticleLayer.get_flat_values)
+    :return: the bytes of a .npy file holding them as float64s
+    """
+    if len(vals) != w * h:
+        raise ValueError("expected {} values, got {}".format(w * h, len(vals)))
+
+    data = array.array("d", vals)
+    if sys.byteorder != "little":
+        data.byteswap()
+
+    header = "{{'descr': '<f8', 'fortran_order': False, 'shape': ({}, {}), }}".format(w, h).encode("latin1")
+    # the header is padded with spaces (and ends with a newline) so the data starts at a multiple of 64 bytes
+    header_len = len(_NPY_MAGIC) + 2 + len(header) + 1
+    header += b" " * (-header_len % 64) + b"\n"
+
+    return _NPY_MAGIC + len(header).to_bytes(2, "little") + header + data.tobytes()
+
+
+def write_layers(filepath, layers, compression=6):
+    """
+    :param layers: name -> layer (anything with w, h and get_flat_values, e.g. from sim.Frame.get_layer)
+    :param compression: zlib compression level, 0-9. 0 writes the arrays uncompressed.
+    """
+    method = zipfile.ZIP_DEFLATED if compression > 0 else zipfile.ZIP_STORED
+    with zipfile.ZipFile(str(filepath), "w", compression=method, compresslevel=compression) as f:
+        for name, layer in layers.items():
+            f.writestr(name + ".npy", encode_npy(layer.w, layer.h, layer.get_flat_values(clamp=False)))
@@ -1,65 +1,180 @@
 
+import concurrent.futures as futures
+import copy
+import os
+import pickle
 import sim
 import threading
 
 
+def _step_branch(branch):
+    """takes one step of a branch. Runs in a worker process, so the branch is sent there and back."""
+    branch.do_simulation()
+    return branch
+
+
 class SimulationPipeline(sim.Simulator):
 
     def __init__(self, first_simulation, n_steps=None):
+        sim.Simulator.__init__(self)
         self._active_sim = first_simulation
+        self._active_sim.add_progress_listener(self._on_active_sim_progress)
         self._step_limit = n_steps
 
         self._past_timesteps = 0
 
-        self._sim_provider_queue = []  # list of (provider, n_steps)
+        self._sim_provider_queue = []  # list of (provider, n_steps), or (list of providers, None) for branches
 
-        self._simul_lock = threading.Lock()
-        self._is_simulating = False
+        self._branches = None  # once the pipeline has fanned out, the simulators it's running side by side
+        self._branch_n_workers = None
+        self._branch_executor = None  # runs the branches' steps in other processes, see add_branches
+
+        self._simul_swap_lock = threading.Lock()
 
+    def __getstate__(self):
+        # like ParticleSimulator's: the locks, listeners & worker processes stay behind
+        state = dict(self.__dict__)
+        for key in ("_simul_lock", "_simul_swap_lock", "_progress_listeners", "_step_waiters"):
+            state.pop(key, None)
+        state["_is_simulating"] = False
+        state["_branch_executor"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._simul_lock = threading.Lock()
         self._simul_swap_lock = threading.Lock()
+        self._progress_listeners = []
+        self._step_waiters = []
+        for s in (self._branches if self._branches is not None else [self._active_sim]):
+            s.add_progress_listener(self._on_active_sim_progress)
 
     def add_simulation(self, provider, n_steps=None):
         """
         :param provider: Simulator -> Simulator
         :param n_steps:
         """
+        self._check_can_add()
         self._sim_provider_queue.append((provider, n_steps))
 
+    def add_branches(self, providers, n_workers=None):
+        """
+        Fans the pipeline out: when the last stage finishes, each provider makes a simulator from it, and those all
+            run side by side, each producing its own result. The pipeline's
+            display & frames follow one of them, see set_display_branch. Nothing can be added after this, but a
+            provider can return a SimulationPipeline to continue its branch.
+        Each step, the branches are sent to worker processes, stepped there at the same time, and sent back, so the
+            simulators get_branches returns are replaced after every step.
+        :param providers: list of Simulator -> Simulator. They mustn't modify the simulator they're given.
+        :param n_workers: how many processes to run the branches in (None = one per CPU). With fewer than 2, or if a
+            branch can't be pickled (e.g. its pipeline has a lambda as a provider), they're run one after another
+            in this process instead.
+        """
+        self._check_can_add()
+        self._sim_provider_queue.append((list(providers), None))
+        self._branch_n_workers = n_workers
+
+    def _check_can_add(self):
+        if self._branches is not None or any(isinstance(p, list) for p, _ in self._sim_provider_queue):
+            raise ValueError("can't add to a pipeline after its branches")
+
+    def get_branches(self):
+        """:return: the simulators of each branch, or an empty list if the pipeline hasn't fanned out (yet)"""
+        with self._simul_swap_lock:
+            return list(self._branches) if self._branches is not None else []
+
+    def get_active_simulator(self):
+        """:return: the simulator of the current stage (or the displayed branch), unwrapping nested pipelines"""
+        with self._simul_swap_lock:
+            active_sim = self._active_sim
+        return active_sim.get_active_simulator()
+
+    def set_display_branch(self, idx):
+        with self._simul_swap_lock:
+            if self._branches is None:
+                raise ValueError("the pipeline hasn't split into branches")
+            self._active_sim = self._branches[idx]
+
     def is_done(self):
+        if self._branches is not None:
+            return all(b.is_done() for b in self._branches)
         return self._active_sim.is_done() and len(self._sim_provider_queue) == 0
 
     def get_timestep(self):
         with self._simul_swap_lock:
             return self._past_timesteps + self._active_sim.get_timestep()
 
-    def request_simulation_async(self):
-        with self._simul_lock:
-            if self._is_simulating:
-                print("WARN: there's already a simulation happening, skipping request")
-                return None
-            else:
-                self._is_simulating = True
-
-        return super().request_simulation_async()
-
     def do_simulation(self):
         with self._simul_lock:
             self._is_simulating = True
 
-        self._active_sim.do_simulation()
+        try:
+            if self._branch_executor is not None:
+                self._step_branches_in_processes()
+            elif self._branches is not None:
+                # one after another: their steps are pure Python, so threads would only take turns holding the GIL
+                for b in self._branches:
+                    if not b.is_done():
+                        b.do_simulation()
+            else:
+                self._active_sim.do_simulation()
+
+            if len(self._sim_provider_queue) > 0:
+                if self._active_sim.is_done() or (self._step_limit is not None and self._active_sim.get_timestep() >= self._step_limit):
+                    with self._simul_swap_lock:
+                        print("INFO: moving to next simulation in pipeline")
+                        self._past_timesteps += self._active_sim.get_timestep()
+
+                        provider, n_steps = self._sim_provider_queue.pop(0)
+                        self._step_limit = n_steps
+                        self._active_sim.remove_progress_listener(self._on_active_sim_progress)
+                        if isinstance(provider, list):
+                            print("INFO: splitting pipeline into {} branches".format(len(provider)))
+                            self._branches = [p(self._active_sim) for p in provider]
+                            self._branch_executor = self._make_branch_executor(self._branches)
+                            for b in self._branches:
+                                b.add_progress_listener(self._on_active_sim_progress)
+                            self._active_sim = self._branches[0]
+                        else:
+                            self._active_sim = provider(self._active_sim)
+                            self._active_sim.add_progress_listener(self._on_active_sim_progress)
+        except BaseException:
+            self._abandon_step()
+            raise
+
+        self._end_step()
+
+    def _make_branch_executor(self, branches):
+        n_workers = min(len(branches), self._branch_n_workers or os.cpu_count() or 1)
+        if n_workers < 2:
+            return None
+        try:
+            for b in branches:
+                pickle.dumps(b)
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            print("WARN: running the branches one after another, they can't be sent to other processes: {}".format(e))
+            return None
+        return futures.ProcessPoolExecutor(max_workers=n_workers)
+
+    def _step_branches_in_processes(self):
+        to_step = [idx for idx, b in enumerate(self._branches) if not b.is_done()]
+        stepped = list(self._branch_executor.map(_step_branch, [self._branches[idx] for idx in to_step]))
 
-        if len(self._sim_provider_queue) > 0:
-            if self._active_sim.is_done() or (self._step_limit is not None and self._active_sim.get_timestep() >= self._step_limit):
-                with self._simul_swap_lock:
-                    print("INFO: moving to next simulation in pipeline")
-                    self._past_timesteps += self._active_sim.get_timestep()
+        with self._simul_swap_lock:
+            for idx, b in zip(to_step, stepped):
+                self._branches[idx].remove_progress_listener(self._on_active_sim_progress)
+                b.add_progress_listener(self._on_active_sim_progress)
+                if self._active_sim is self._branches[idx]:
+                    self._active_sim = b
+                self._branches[idx] = b
+        self._notify_progress()
 
-                    provider, n_steps = self._sim_provider_queue.pop(0)
-                    self._step_limit = n_steps
-                    self._active_sim = provider(self._active_sim)
+        if all(b.is_done() for b in self._branches):
+            self._branch_executor.shutdown()
+            self._branch_executor = None
 
-        with self._simul_lock:
-            self._is_simulating = False
+    def _on_active_sim_progress(self, active_sim, pcnt):
+        self._notify_progress()
 
     def is_simulating(self):
         with self._simul_lock:
@@ -67,10 +182,45 @@ class SimulationPipeline(sim.Simulator):
 
     def fetch_colors_safely(self, rect, color_funct, expected_total_size=None):
         with self._simul_swap_lock:
-            return self._active_sim.fetch_colors_safely(rect, color_funct, expected_total_size=expected_total_size)
+            active_sim = self._active_sim
+        return active_sim.fetch_colors_safely(rect, color_funct, expected_total_size=expected_total_size)
+
+    def get_frame(self):
+        with self._simul_swap_lock:
+            frame = self._active_sim.get_frame()
+            frame.timestep += self._past_timesteps
+            frame.simulation = self
+            return frame
+
+    def get_memory_report(self):
+        """only the active stage (or branches) count, the previous ones are dropped once it's made"""
+        with self._simul_swap_lock:
+            active_sim = self._active_sim
+            branches = self._branches
+
+        if branches is not None:
+            reports = [b.get_memory_report() for b in branches]
+            res = {"branches": reports}
+            for key in sim.MEMORY_REPORT_TOTALS:
+                res[key] = sum(report[key] for report in reports)
+            return res
+
+        res = active_sim.get_memory_report()
+        res["stage"] = type(active_sim).__name__
+        return res
+
+    def get_published_frame(self):
+        with self._simul_swap_lock:
+            frame = copy.copy(self._active_sim.get_published_frame())  # it's shared, so adjust a copy
+            frame.timestep += self._past_timesteps
+        frame.simulation = self
+        return frame
 
     def get_percent_completed(self):
-        return self._active_sim.get_percent_completed()
+        with self._simul_swap_lock:
+            if self._branches is not None:
+                return sum(b.get_percent_completed() for b in self._branches) / len(self._branches)
+            return self._active_sim.get_percent_completed()
 
     def get_color_for_render(self, xy):
         return self._active_sim.get_color_for_render(xy)
@@ -0,0 +1,122 @@
+import struct
+import sys
+import zlib
+
+_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# color types
+_GREYSCALE = 0
+_RGB = 2
+_PALETTE = 3
+
+_PALETTE_BLOCK_SIZE = 4096  # pixels looked at between checks for too many colors, see _to_palette
+
+
+def _chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+
+def _encode(w, h, color_type, bytes_per_pixel, pixels, compression=6, extra_chunks=b""):
+    row_size = w * bytes_per_pixel
+    if len(pixels) != row_size * h:
+        raise ValueError("expected {} bytes of pixel data, got {}".format(row_size * h, len(pixels)))
+
+    # every row starts with its filter type, 0 = none
+    raw = b"".join(b"\x00" + pixels[y * row_size:(y + 1) * row_size] for y in range(0, h))
+
+    return (_SIGNATURE +
+            _chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, color_type, 0, 0, 0)) +
+            extra_chunks +
+            _chunk(b"IDAT", zlib.compress(bytes(raw), compression)) +
+            _chunk(b"IEND", b""))
+
+
+def encode_rgb(w, h, rgb, compression=6):
+    """
+    :param rgb: row-major RGB bytes, 3 per pixel (e.g. from sim.Frame.get_rgb)
+    :param compression: zlib compression level, 0-9
+    :return: the bytes of a PNG file
+    """
+    return _encode(w, h, _RGB, 3, rgb, compression=compression)
+
+
+def write_rgb(filepath, w, h, rgb, compression=6):
+    with open(str(filepath), "wb") as f:
+        f.write(encode_rgb(w, h, rgb, compression=compression))
+
+
+def rgb_to_greyscale(rgb):
+    """:return: 1 byte per pixel of luma, for RGB bytes"""
+    rgb = bytes(rgb)
+    r, g, b = rgb[0::3], rgb[1::3], rgb[2::3]
+    if r == g == b:
+        return r  # already grey, which the inkblots are
+    return bytes((299 * r_val + 587 * g_val + 114 * b_val + 500) // 1000 for r_val, g_val, b_val in zip(r, g, b))
+
+
+def encode_greyscale(w, h, grey, compression=6):
+    """
+    :param grey: row-major bytes, 1 per pixel (see rgb_to_greyscale)
+    :return: the bytes of a PNG file
+    """
+    return _encode(w, h, _GREYSCALE, 1, grey, compression=compression)
+
+
+def write_greyscale(filepath, w, h, grey, compression=6):
+    with open(str(filepath), "wb") as f:
+        f.write(encode_greyscale(w, h, grey, compression=compression))
+
+
+def _to_palette(rgb):
+    """:return: (palette colors, palette index of each pixel), or None if there are more than 256 colors"""
+    rgb = bytes(rgb)
+    n_pixels = len(rgb) // 3
+
+    # padded to 4 bytes a pixel, each pixel is one 32 bit int, so the colors can be found & looked up without going
+    # over the pixels one at a time in python
+    padded = bytearray(n_pixels * 4)
+    for channel in range(0, 3):
+        padded[channel::4] = rgb[channel::3]
+    pixels = memoryview(padded).cast("I")
+
+    palette = {}  # color -> index, in the order they first appear
+    for start in range(0, len(pixels), _PALETTE_BLOCK_SIZE):
+        palette.update(dict.fromkeys(pixels[start:start + _PALETTE_BLOCK_SIZE]))
+        if len(palette) > 256:
+            return None
+    for idx, color in enumerate(palette):
+        palette[color] = idx
+
+    colors = [color.to_bytes(4, sys.byteorder)[0:3] for color in palette]
+    return colors, bytearray(map(palette.__getitem__, pixels))
+
+
+def encode_palette(w, h, rgb, compression=6):
+    """
+    Encodes the image as palette indices, which is a third the size of RGB before compression.
+    :param rgb: row-major RGB bytes, 3 per pixel, with at most 256 distinct colors
+    :return: the bytes of a PNG file
+    """
+    res = _to_palette(rgb)
+    if res is None:
+        raise ValueError("too many colors for a palette image (more than 256)")
+    palette, indices = res
+    return _encode(w, h, _PALETTE, 1, indices, compression=compression,
+                   extra_chunks=_chunk(b"PLTE", b"".join(palette)))
+
+
+def write_palette(filepath, w, h, rgb, compression=6):
+    """
+    Writes a palette image if the image has at most 256 colors, or an RGB one if it has more (so recording frames
+        doesn't stop partway through over one that's too colorful).
+    :return: whether it wrote a palette image
+    """
+    res = _to_palette(rgb)
+    with open(str(filepath), "wb") as f:
+        if res is None:
+            f.write(encode_rgb(w, h, rgb, compression=compression))
+        else:
+            palette, indices = res
+            f.write(_encode(w, h, _PALETTE, 1, indices, compression=compression,
+                            extra_chunks=_chunk(b"PLTE", b"".join(palette))))
+    return res is not None
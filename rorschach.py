@@ -2,8 +2,8 @@ import sim
 import blobs
 import pipeline
 import inkblot
-import visualizer
 
+import functools
 import os
 import pathlib
 import random
@@ -22,10 +22,18 @@ def _get_rand_param_val(name, min_val, max_val, is_percent=False, as_int=False):
     return res
 
 
-def get_blob_sim(w, h, cooling_time):
-    min_spawn_rate = 0.6
-    max_spawn_rate = 0.8
-    spawn_rate = _get_rand_param_val("initial blob density", min_spawn_rate, max_spawn_rate, is_percent=True)
+# ranges the random parameters are picked from
+SPAWN_RATE_RANGE = (0.6, 0.8)
+INK_HEIGHT_RANGE = (1.2, 1.35)
+X_OVERLAP_PCNT_RANGE = (0.10, 0.33)  # controls how much the mirrored blobs will overlap
+
+
+def get_blob_sim(w, h, cooling_time, spawn_rate=None):
+    """
+    :param spawn_rate: initial blob density, or None to pick one at random
+    """
+    if spawn_rate is None:
+        spawn_rate = _get_rand_param_val("initial blob density", *SPAWN_RATE_RANGE, is_percent=True)
 
     res = blobs.BlobSimulator(w, h, intial_spawn_rate=spawn_rate)
 
@@ -36,56 +44,91 @@ def get_blob_sim(w, h, cooling_time):
     return res
 
 
+def get_blob_sim_ensemble(w, h, cooling_time, n, jit=False):
+    """
+    :param jit: whether to use the compiled blob kernel, if available, which steps all the members in one call
+    :return: a ParticleSimulatorEnsemble of n blob simulations, each with its own random parameters. Use
+        extract_member to pull finished members out for the inkblot stage.
+    """
+    members = [get_blob_sim(w, h, cooling_time) for _ in range(0, n)]
+    if jit:
+        import kernels  # imported here since it loads numba, which headless workers that don't jit shouldn't pay for
+        for m in members:
+            kernels.use_jit(m)
+    return sim.ParticleSimulatorEnsemble(members)
+
+
 def get_blob_duplicator(blob_sim):
-    res = get_blob_sim(blob_sim.w, blob_sim.h, blob_sim.cooling_time)
-    new_blob_layer = res.get_layer(blobs.BlobSimulator.BLOB_LAYER)
-    for xy in res.all_points():
-        val = blob_sim.get_value(blobs.BlobSimulator.BLOB_LAYER, xy)
-        new_blob_layer.set_value_not_threadsafe(xy, val)
+    with sim.skipping_initializers():
+        res = get_blob_sim(blob_sim.w, blob_sim.h, blob_sim.cooling_time, spawn_rate=0)
+    res.adopt_layer(blobs.BlobSimulator.BLOB_LAYER, blob_sim, share=True)
 
     return res
 
 
-def get_blob_to_inkblot_mapper(blob_sim):
-    ink_height = _get_rand_param_val("ink height", 1.2, 1.35)
+def get_blob_to_inkblot_mapper(blob_sim, scale=None, symmetric=False, ink_height=None, x_overlap_pcnt=None):
+    """
+    :param scale: how much larger the inkblot simulation should be than the blob simulation, or None to use the
+        global upscale.
+    :param symmetric: if True, only half of the (mirrored) inkblot is simulated, see InkblotSimulator.
+    :param ink_height: how much ink each blob becomes, or None to pick it at random
+    :param x_overlap_pcnt: how much the mirrored copies of the blobs overlap, or None to pick it at random
+    """
+    if ink_height is None:
+        ink_height = _get_rand_param_val("ink height", *INK_HEIGHT_RANGE)
     basic_inkify = False
 
-    size = (blob_sim.w * upscale, blob_sim.h * upscale)
+    if scale is None:
+        scale = upscale
+    size = (blob_sim.w * scale, blob_sim.h * scale)
 
-    res = inkblot.InkblotSimulator(size[0], size[1])
+    if symmetric and not basic_inkify:
+        res = inkblot.InkblotSimulator(size[0] // 2, size[1], symmetric=True)
+        size = res.get_size()
+    else:
+        res = inkblot.InkblotSimulator(size[0], size[1])
 
     blob_layer = blob_sim.get_layer(blobs.BlobSimulator.BLOB_LAYER)
     ink_layer = res.get_layer(inkblot.INK)
 
     if basic_inkify:
-        xfer_func = get_rect_mapping_function((0, 0), size, (0, 0), blob_sim.get_size())
-        xfer_layer_to_layer(blob_layer, ink_layer,
-                            l2_xy_to_l1_xy_func=xfer_func,
-                            value_xform=lambda blob_val, ink_val: ink_val + (ink_height if blob_val > 0 else 0))
+        index_map = get_rect_index_map(blob_sim.get_size(), size, (0, 0), size, (0, 0), blob_sim.get_size())
+        xfer_layer_to_layer_indexed(blob_layer, ink_layer, [index_map],
+                                    l1_value_xform=lambda blob_val: ink_height if blob_val > 0 else 0)
 
     else:
-        min_x_overlap_pcnt = 0.10  # controls how much the mirrored blobs will overlap
-        max_x_overlap_pcnt = 0.33
-        x_overlap_pcnt = _get_rand_param_val("overlap percentage", min_x_overlap_pcnt, max_x_overlap_pcnt, is_percent=True)
+        if x_overlap_pcnt is None:
+            x_overlap_pcnt = _get_rand_param_val("overlap percentage", *X_OVERLAP_PCNT_RANGE, is_percent=True)
 
         x_offs = int(size[0] * x_overlap_pcnt)
 
         mid_x = size[0] // 2
         mid_y = size[1] // 2
 
-        xfer_func_left = get_rect_mapping_function((mid_x + x_offs, mid_y - size[0] // 2),
-                                                   (mid_x + x_offs - size[1], mid_y + size[0] // 2),
-                                                   (0, 0), blob_sim.get_size(), swap_x_and_y=True)
-        xfer_layer_to_layer(blob_layer, ink_layer,
-                            l2_xy_to_l1_xy_func=xfer_func_left,
-                            value_xform=lambda blob_val, ink_val: ink_val + (ink_height if blob_val > 0 else 0))
-
-        xfer_func_right = get_rect_mapping_function((mid_x - x_offs, mid_y - size[0] // 2),
-                                                    (mid_x - x_offs + size[1], mid_y + size[0] // 2),
-                                                    (0, 0), blob_sim.get_size(), swap_x_and_y=True)
-        xfer_layer_to_layer(blob_layer, ink_layer,
-                            l2_xy_to_l1_xy_func=xfer_func_right,
-                            value_xform=lambda blob_val, ink_val: ink_val + (ink_height if blob_val > 0 else 0))
+        index_map_left = get_rect_index_map(blob_sim.get_size(), size,
+                                            (mid_x + x_offs, mid_y - size[0] // 2),
+                                            (mid_x + x_offs - size[1], mid_y + size[0] // 2),
+                                            (0, 0), blob_sim.get_size(), swap_x_and_y=True)
+
+        if symmetric:
+            # the right half is the mirror image of the left, so the simulated half gets the left copy of the blobs
+            # plus the part of it that overlaps the mirror axis, reflected back.
+            col_h = size[1]
+            index_map_reflected = []
+            for x in range(0, res.w):
+                reflected_x = size[0] - 1 - x
+                index_map_reflected.extend(index_map_left[reflected_x * col_h:(reflected_x + 1) * col_h])
+
+            xfer_layer_to_layer_indexed(blob_layer, ink_layer, [index_map_left[0:res.w * col_h], index_map_reflected],
+                                        l1_value_xform=lambda blob_val: ink_height if blob_val > 0 else 0)
+        else:
+            index_map_right = get_rect_index_map(blob_sim.get_size(), size,
+                                                 (mid_x - x_offs, mid_y - size[0] // 2),
+                                                 (mid_x - x_offs + size[1], mid_y + size[0] // 2),
+                                                 (0, 0), blob_sim.get_size(), swap_x_and_y=True)
+
+            xfer_layer_to_layer_indexed(blob_layer, ink_layer, [index_map_left, index_map_right],
+                                        l1_value_xform=lambda blob_val: ink_height if blob_val > 0 else 0)
 
     res.max_static_pressure = 0.45
     res.boundary_pressure = 1.4  # 1.2
@@ -128,24 +171,146 @@ def xfer_layer_to_layer(l1, l2, l2_xy_to_l1_xy_func=lambda xy: xy, value_xform=l
             l2.set_value_not_threadsafe(l2_xy, new_l2_val)
 
 
+_INDEX_MAP_CACHE_SIZE = 8  # maps are w * h long, and the random overlap makes most of them one-offs
+
+
+def get_rect_index_map(l1_size, l2_size, r1_x1y1, r1_x2y2, r2_x1y1, r2_x2y2, swap_x_and_y=False):
+    """
+    Precomputes get_rect_mapping_function for every cell of a layer of size l2_size, as a flat list of
+        column-major indices into a layer of size l1_size (see _ParticleLayer.get_flat_values). Cells that
+        map outside of l1 get the index l1_w * l1_h. The most recent results are cached, so don't modify them.
+    """
+    return _get_rect_index_map(tuple(l1_size), tuple(l2_size), tuple(r1_x1y1), tuple(r1_x2y2),
+                               tuple(r2_x1y1), tuple(r2_x2y2), swap_x_and_y)
+
+
+@functools.lru_cache(maxsize=_INDEX_MAP_CACHE_SIZE)
+def _get_rect_index_map(l1_size, l2_size, r1_x1y1, r1_x2y2, r2_x1y1, r2_x2y2, swap_x_and_y):
+    l1_w, l1_h = l1_size
+    l2_w, l2_h = l2_size
+    map_func = get_rect_mapping_function(r1_x1y1, r1_x2y2, r2_x1y1, r2_x2y2, swap_x_and_y=swap_x_and_y)
+
+    # each mapped coordinate depends on only one of x or y, so the mapping can be evaluated per row & column
+    if swap_x_and_y:
+        l1_xs_per_y = [map_func((0, y))[0] for y in range(0, l2_h)]
+        l1_ys_per_x = [map_func((x, 0))[1] for x in range(0, l2_w)]
+    else:
+        l1_xs_per_x = [map_func((x, 0))[0] for x in range(0, l2_w)]
+        l1_ys_per_y = [map_func((0, y))[1] for y in range(0, l2_h)]
+
+    oob_idx = l1_w * l1_h
+    res = []
+    for x in range(0, l2_w):
+        if swap_x_and_y:
+            l1_xys = zip(l1_xs_per_y, [l1_ys_per_x[x]] * l2_h)
+        else:
+            l1_xys = zip([l1_xs_per_x[x]] * l2_h, l1_ys_per_y)
+        res.extend([l1_x * l1_h + l1_y if (0 <= l1_x < l1_w and 0 <= l1_y < l1_h) else oob_idx
+                    for l1_x, l1_y in l1_xys])
+    return res
+
+
+def xfer_layer_to_layer_indexed(l1, l2, index_maps, l1_value_xform=lambda l1_v: l1_v):
+    """
+    Bulk version of xfer_layer_to_layer for the additive case. For each index map (see get_rect_index_map),
+        l1_value_xform(l1_val) is added to every cell of l2, in the order the maps are given.
+    """
+    l1_vals = [l1_value_xform(v) for v in l1.get_flat_values()]
+    l1_vals.append(l1_value_xform(l1.get_value((-1, -1))))  # out of bounds
+
+    l2_vals = l2.get_flat_values()
+    if len(index_maps) == 2:
+        # the mirrored case, done in one pass
+        map_1, map_2 = index_maps
+        l2_vals = [v + l1_vals[i1] + l1_vals[i2] for v, i1, i2 in zip(l2_vals, map_1, map_2)]
+    else:
+        for index_map in index_maps:
+            l2_vals = [v + l1_vals[i] for v, i in zip(l2_vals, index_map)]
+
+    l2.set_flat_values_not_threadsafe(l2_vals)
+
+
 # global params
 w = 60
 h = int(w / (640 / 480))
 upscale = 3
 
 
-def get_pipeline():
+def get_pipeline(blob_size=None, scale=None, symmetric=False, jit=False, variants=None, coarse_scale=None,
+                 coarse_steps=None, coarse_flow_pcnt=0.025, n_workers=None):
+    """
+    :param blob_size: (w, h) of the blob simulation, or None to use the global w and h.
+    :param scale: see get_blob_to_inkblot_mapper
+    :param symmetric: see get_blob_to_inkblot_mapper
+    :param jit: whether to run the stages with compiled kernels, if available (see kernels.py)
+    :param variants: list of dicts of extra get_blob_to_inkblot_mapper args (e.g. {"ink_height": 1.3}, or {} for
+        random ones). If given, the blob stage fans out into one inkblot branch per dict, see
+        SimulationPipeline.add_branches.
+    :param coarse_scale: if given, the inkblot is first simulated at this (smaller) scale, and then continued at scale
+        (see inkblot.prolong) after coarse_steps steps, or once less than coarse_flow_pcnt of its ink is flowing
+        per step (see InkblotSimulator.done_at_flow_pcnt), whichever comes first. Either can be None.
+    :param n_workers: how many processes to run the variants' branches in, see SimulationPipeline.add_branches
+    """
+    blob_w, blob_h = (w, h) if blob_size is None else blob_size
+
     blob_cooling_time = 100
     blob_sim_time = int(blob_cooling_time * 0.95)
 
-    pipe = pipeline.SimulationPipeline(get_blob_sim(w, h, blob_cooling_time), n_steps=blob_sim_time)
+    blob_sim = get_blob_sim(blob_w, blob_h, blob_cooling_time)
+    if jit:
+        import kernels  # see get_blob_sim_ensemble
+        kernels.use_jit(blob_sim)
+
+    pipe = pipeline.SimulationPipeline(blob_sim, n_steps=blob_sim_time)
+
+    # module-level functions rather than closures, so the branches' pipelines can be sent to worker processes
+    make_inkblot_sim = functools.partial(_make_inkblot_sim, scale=scale, symmetric=symmetric, jit=jit)
+    make_coarse_inkblot_sim = functools.partial(_make_inkblot_sim, scale=coarse_scale, symmetric=symmetric, jit=jit,
+                                                done_at_flow_pcnt=coarse_flow_pcnt)
+    fine_scale = upscale if scale is None else scale
+    fine_w = blob_w * fine_scale // 2 if symmetric else blob_w * fine_scale  # same as get_blob_to_inkblot_mapper
+    make_fine_inkblot_sim = functools.partial(_make_fine_inkblot_sim, size=(fine_w, blob_h * fine_scale), jit=jit)
+
+    if variants is None:
+        if coarse_scale is None:
+            pipe.add_simulation(make_inkblot_sim)
+        else:
+            pipe.add_simulation(make_coarse_inkblot_sim, n_steps=coarse_steps)
+            pipe.add_simulation(make_fine_inkblot_sim)
+    else:
+        def _make_branch(prev_blob_sim, kwargs):
+            if coarse_scale is None:
+                return make_inkblot_sim(prev_blob_sim, **kwargs)
+            res = pipeline.SimulationPipeline(make_coarse_inkblot_sim(prev_blob_sim, **kwargs), n_steps=coarse_steps)
+            res.add_simulation(make_fine_inkblot_sim)
+            return res
 
-    pipe.add_simulation(get_blob_to_inkblot_mapper)
+        pipe.add_branches([lambda prev_blob_sim, kwargs=kwargs: _make_branch(prev_blob_sim, kwargs)
+                           for kwargs in variants], n_workers=n_workers)
 
     return pipe
 
 
+def _make_inkblot_sim(prev_blob_sim, scale, symmetric, jit, done_at_flow_pcnt=None, **kwargs):
+    res = get_blob_to_inkblot_mapper(prev_blob_sim, scale=scale, symmetric=symmetric, **kwargs)
+    if done_at_flow_pcnt is not None:
+        res.done_at_flow_pcnt = done_at_flow_pcnt
+    if jit:
+        import kernels
+        kernels.use_jit(res)
+    return res
+
+
+def _make_fine_inkblot_sim(coarse_sim, size, jit):
+    res = inkblot.prolong(coarse_sim, size[0], size[1])
+    if jit:
+        import kernels
+        kernels.use_jit(res)
+    return res
+
+
 if __name__ == "__main__":
+    import visualizer
     display = visualizer.SimulationDisplay(get_pipeline, name="Rorschach")
 
     output_base_dir = pathlib.Path("output/rorschach/")
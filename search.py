@@ -0,0 +1,159 @@
+import concurrent.futures as futures
+import random
+
+import blobs
+import inkblot
+import rorschach
+
+
+BLOB_STAGE_STEPS = 95   # same as rorschach.get_pipeline
+BLOB_COOLING_TIME = 100
+
+
+class Candidate:
+    """one set of parameters being tried, and the state of its run so far"""
+
+    def __init__(self, idx, spawn_rate, ink_height, x_overlap_pcnt, seed):
+        self.idx = idx
+        self.spawn_rate = spawn_rate
+        self.ink_height = ink_height
+        self.x_overlap_pcnt = x_overlap_pcnt
+        self.seed = seed
+
+        self.simulation = None  # the current stage's simulator
+        self.steps_taken = 0
+        self.score = None
+        self.metrics = {}
+
+    def __repr__(self):
+        return "Candidate(idx={}, spawn_rate={:.3f}, ink_height={:.3f}, x_overlap_pcnt={:.3f}, score={})".format(
+            self.idx, self.spawn_rate, self.ink_height, self.x_overlap_pcnt, self.score)
+
+
+def _largest_component_size(cells):
+    """:param cells: set of (x, y). :return: (number of 8-connected components, size of the largest one)"""
+    remaining = set(cells)
+    n_components = 0
+    largest = 0
+    while len(remaining) > 0:
+        n_components += 1
+        stack = [remaining.pop()]
+        size = 0
+        while len(stack) > 0:
+            x, y = stack.pop()
+            size += 1
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    n = (x + dx, y + dy)
+                    if n in remaining:
+                        remaining.remove(n)
+                        stack.append(n)
+        largest = max(largest, size)
+    return n_components, largest
+
+
+def get_metrics(simulation):
+    """:return: dict of cheap measurements of a blob or inkblot simulation's current state"""
+    if isinstance(simulation, blobs.BlobSimulator):
+        blob_vals = simulation.get_layer(blobs.BlobSimulator.BLOB_LAYER).get_flat_values()
+        cells = set(divmod(i, simulation.h) for i, v in enumerate(blob_vals) if v > 0)
+        n_components, largest = _largest_component_size(cells)
+        return {
+            "blob_count": simulation.count_blobs(),
+            "components": n_components,
+            "connectivity": largest / len(cells) if len(cells) > 0 else 0.0,
+        }
+    else:
+        ink_vals = simulation.get_layer(inkblot.INK).get_flat_values()
+        dried_vals = simulation.get_layer(inkblot.DRIED_INK).get_flat_values()
+        cells = set(divmod(i, simulation.h) for i, (a, b) in enumerate(zip(ink_vals, dried_vals)) if a + b > 0.05)
+        n_components, largest = _largest_component_size(cells)
+        return {
+            "coverage": len(cells) / (simulation.w * simulation.h),
+            "components": n_components,
+            "connectivity": largest / len(cells) if len(cells) > 0 else 0.0,
+        }
+
+
+def default_score(metrics, target_coverage=0.3):
+    """higher is better. Prefers one big connected shape, and (for inkblots) roughly target_coverage of the page inked"""
+    if "coverage" in metrics:
+        coverage_score = max(0.0, 1 - abs(metrics["coverage"] - target_coverage) / target_coverage)
+        return coverage_score * metrics["connectivity"]
+    else:
+        return metrics["connectivity"] / metrics["components"] ** 0.5 if metrics["components"] > 0 else 0.0
+
+
+def _advance(candidate, target_steps, blob_size, scale):
+    """runs a candidate until it has taken target_steps steps in total (None = until done). Runs in a worker process."""
+    random.seed(candidate.seed + candidate.steps_taken)
+
+    if candidate.simulation is None:
+        candidate.simulation = rorschach.get_blob_sim(blob_size[0], blob_size[1], BLOB_COOLING_TIME,
+                                                      spawn_rate=candidate.spawn_rate)
+
+    while target_steps is None or candidate.steps_taken < target_steps:
+        if isinstance(candidate.simulation, blobs.BlobSimulator) and candidate.steps_taken >= BLOB_STAGE_STEPS:
+            candidate.simulation = rorschach.get_blob_to_inkblot_mapper(candidate.simulation, scale=scale,
+                                                                        ink_height=candidate.ink_height,
+                                                                        x_overlap_pcnt=candidate.x_overlap_pcnt)
+        elif candidate.simulation.is_done():
+            break
+
+        candidate.simulation.do_simulation()
+        candidate.steps_taken += 1
+
+    candidate.metrics = get_metrics(candidate.simulation)
+    return candidate
+
+
+def search(n_candidates=16, checkpoints=(40, BLOB_STAGE_STEPS, BLOB_STAGE_STEPS + 10, None), keep_pcnt=0.5,
+           blob_size=None, scale=None, score_funct=default_score, n_workers=None):
+    """
+    Tries n_candidates random parameter sets in parallel, successive-halving style: every candidate is run to the
+        first checkpoint, scored, and only the best keep_pcnt of them are run on to the next checkpoint, and so on.
+        So most of the compute goes to promising candidates, and bad ones are dropped before the expensive part.
+    :param checkpoints: total step counts to score candidates at. None means run until done.
+    :param keep_pcnt: fraction of the candidates kept at each checkpoint, between 0 and 1 (exclusive). The reciprocal
+        of successive halving's eta.
+    :param score_funct: lambda metrics -> float, higher is better. See get_metrics.
+    :return: the surviving candidates, best first. Their simulation holds their final state.
+    """
+    if n_candidates < 1:
+        raise ValueError("need at least 1 candidate, got {}".format(n_candidates))
+    if not 0 < keep_pcnt < 1:
+        raise ValueError("keep_pcnt must be between 0 and 1 (exclusive), got {}".format(keep_pcnt))
+
+    blob_size = (rorschach.w, rorschach.h) if blob_size is None else blob_size
+
+    candidates = []
+    for i in range(0, n_candidates):
+        candidates.append(Candidate(i,
+                                    random.uniform(*rorschach.SPAWN_RATE_RANGE),
+                                    random.uniform(*rorschach.INK_HEIGHT_RANGE),
+                                    random.uniform(*rorschach.X_OVERLAP_PCNT_RANGE),
+                                    random.getrandbits(32)))
+
+    with futures.ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for checkpoint_idx, checkpoint in enumerate(checkpoints):
+            candidates = list(executor.map(_advance, candidates,
+                                           [checkpoint] * len(candidates),
+                                           [blob_size] * len(candidates),
+                                           [scale] * len(candidates)))
+            for c in candidates:
+                c.score = score_funct(c.metrics)
+            candidates.sort(key=lambda c: c.score, reverse=True)
+
+            print("INFO: checkpoint {} (step {}): best score {:.3f}, worst {:.3f}".format(
+                checkpoint_idx, checkpoint, candidates[0].score, candidates[-1].score))
+
+            if checkpoint_idx < len(checkpoints) - 1:
+                n_to_keep = max(1, int(len(candidates) * keep_pcnt))
+                candidates = candidates[0:n_to_keep]
+
+    return candidates
+
+
+if __name__ == "__main__":
+    for res in search():
+        print(res)
@@ -0,0 +1,268 @@
+import collections
+import concurrent.futures as futures
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+import pngfile
+import rorschach
+
+
+DEFAULT_PROFILES = {
+    "default": {"blob_size": (rorschach.w, rorschach.h), "scale": rorschach.upscale},
+    "small": {"blob_size": (32, 24), "scale": 2},
+}
+
+
+def generate_png(profile, seed):
+    """
+    Runs a whole rorschach pipeline for the given profile. Meant to be run in a worker process.
+    :return: (bytes of the final image as a PNG, seconds it took to generate)
+    """
+    start_time = time.time()
+    random.seed(seed)
+
+    pipe = rorschach.get_pipeline(blob_size=profile["blob_size"], scale=profile["scale"])
+    frame = None
+    for frame in pipe.run():
+        pass
+    if frame is None:
+        frame = pipe.get_frame()
+
+    w, h = frame.size
+    return pngfile.encode_rgb(w, h, frame.get_rgb()), time.time() - start_time
+
+
+class _ProfileStats:
+
+    FILL_RATE_WINDOW = 60  # seconds
+
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0       # requests answered straight from the reservoir
+        self.misses = 0     # requests that had to wait for an image to be generated
+        self.timeouts = 0
+        self.failures = 0   # generations that raised an error
+
+        self.total_latency = 0
+        self.max_latency = 0
+
+        self.generated = 0
+        self.total_generation_time = 0
+        self._fill_times = collections.deque()
+
+        self._start_time = time.time()
+
+    def record_request(self, latency, hit, timed_out):
+        self.requests += 1
+        if timed_out:
+            self.timeouts += 1
+        elif hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def record_fill(self, generation_time):
+        self.generated += 1
+        self.total_generation_time += generation_time
+        self._fill_times.append(time.time())
+
+    def get_fill_rate(self):
+        """:return: images generated per second, over the last FILL_RATE_WINDOW seconds"""
+        now = time.time()
+        while len(self._fill_times) > 0 and now - self._fill_times[0] > _ProfileStats.FILL_RATE_WINDOW:
+            self._fill_times.popleft()
+        window = min(_ProfileStats.FILL_RATE_WINDOW, now - self._start_time)
+        return len(self._fill_times) / window if window > 0 else 0.0
+
+    def to_json(self):
+        return {
+            "requests": self.requests,
+            "hits": self.hits,
+            "misses": self.misses,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "mean_latency_ms": 1000 * self.total_latency / self.requests if self.requests > 0 else 0.0,
+            "max_latency_ms": 1000 * self.max_latency,
+            "generated": self.generated,
+            "mean_generation_time_s": self.total_generation_time / self.generated if self.generated > 0 else 0.0,
+            "fill_rate_per_s": self.get_fill_rate(),
+        }
+
+
+class ImageReservoir:
+    """
+    Keeps up to capacity finished images per profile, generated ahead of time by a pool of worker processes.
+        Taking an image kicks off the generation of its replacement. After a failed generation, the profile's next
+        one waits RETRY_DELAY seconds, doubling with each further failure in a row (up to MAX_RETRY_DELAY).
+    """
+
+    RETRY_DELAY = 1.0
+    MAX_RETRY_DELAY = 60.0
+
+    def __init__(self, profiles=None, capacity=4, n_workers=None):
+        """
+        :param profiles: name -> {"blob_size": (w, h), "scale": int}, see rorschach.get_pipeline
+        :param capacity: max number of finished images to keep per profile
+        :param n_workers: number of worker processes, None to use one per CPU
+        """
+        self.profiles = dict(DEFAULT_PROFILES if profiles is None else profiles)
+        self.capacity = capacity
+
+        self._executor = futures.ProcessPoolExecutor(max_workers=n_workers)
+        self._cond = threading.Condition()
+
+        # all of these must only be accessed while holding _cond
+        self._images = {name: collections.deque() for name in self.profiles}
+        self._pending = {name: 0 for name in self.profiles}
+        self._stats = {name: _ProfileStats() for name in self.profiles}
+        self._failures_in_a_row = {name: 0 for name in self.profiles}
+        self._retry_timers = {}  # name -> threading.Timer, for profiles waiting to retry after a failure
+        self._shut_down = False
+
+    def start(self):
+        with self._cond:
+            for name in self.profiles:
+                self._refill(name)
+
+    def shutdown(self):
+        with self._cond:
+            self._shut_down = True
+            for timer in self._retry_timers.values():
+                timer.cancel()
+            self._cond.notify_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _refill(self, name):
+        # checked every time round, since a future that's already done runs _on_generated from add_done_callback
+        while (not self._shut_down and name not in self._retry_timers and
+               len(self._images[name]) + self._pending[name] < self.capacity):
+            self._pending[name] += 1
+            future = self._executor.submit(generate_png, self.profiles[name], random.getrandbits(64))
+            future.add_done_callback(lambda f, name=name: self._on_generated(name, f))
+
+    def _on_generated(self, name, future):
+        with self._cond:
+            self._pending[name] -= 1
+            if future.cancelled():
+                return
+            elif future.exception() is not None:
+                self._stats[name].failures += 1
+                self._failures_in_a_row[name] += 1
+                if name not in self._retry_timers and not self._shut_down:
+                    delay = min(self.MAX_RETRY_DELAY, self.RETRY_DELAY * 2 ** (self._failures_in_a_row[name] - 1))
+                    print("WARN: failed to generate image for profile {}, retrying in {:.1f}s: {}".format(
+                        name, delay, future.exception()))
+                    timer = threading.Timer(delay, self._retry, args=(name,))
+                    timer.daemon = True
+                    self._retry_timers[name] = timer
+                    timer.start()
+                return
+            else:
+                png, generation_time = future.result()
+                self._images[name].append(png)
+                self._stats[name].record_fill(generation_time)
+                self._failures_in_a_row[name] = 0
+                self._cond.notify_all()
+
+            self._refill(name)
+
+    def _retry(self, name):
+        with self._cond:
+            del self._retry_timers[name]
+            self._refill(name)
+
+    def get_image(self, name, timeout=None):
+        """
+        :return: the bytes of a PNG, waiting up to timeout seconds (None = forever) if the reservoir is empty.
+            Returns None if the wait timed out.
+        """
+        if name not in self.profiles:
+            raise ValueError("unrecognized profile: {}".format(name))
+
+        start_time = time.time()
+        with self._cond:
+            hit = len(self._images[name]) > 0
+            self._cond.wait_for(lambda: len(self._images[name]) > 0 or self._shut_down, timeout=timeout)
+
+            res = self._images[name].popleft() if len(self._images[name]) > 0 else None
+            self._stats[name].record_request(time.time() - start_time, hit, res is None)
+            self._refill(name)
+
+            return res
+
+    def get_stats(self):
+        with self._cond:
+            res = {}
+            for name in self.profiles:
+                res[name] = self._stats[name].to_json()
+                res[name]["queue_depth"] = len(self._images[name])
+                res[name]["pending"] = self._pending[name]
+                res[name]["capacity"] = self.capacity
+            return res
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        reservoir = self.server.reservoir
+
+        if url.path == "/stats":
+            self._respond(200, "application/json", json.dumps(reservoir.get_stats()).encode("utf-8"))
+
+        elif url.path == "/image":
+            query = urllib.parse.parse_qs(url.query)
+            profile = query.get("profile", ["default"])[0]
+            if profile not in reservoir.profiles:
+                self._respond(404, "text/plain", "unrecognized profile: {}".format(profile).encode("utf-8"))
+            else:
+                png = reservoir.get_image(profile, timeout=self.server.wait_timeout)
+                if png is None:
+                    self._respond(503, "text/plain", b"no image available yet, try again later")
+                else:
+                    self._respond(200, "image/png", png)
+        else:
+            self._respond(404, "text/plain", b"not found")
+
+    def _respond(self, code, content_type, body):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(reservoir, host="127.0.0.1", port=8080, wait_timeout=30):
+    """
+    :param wait_timeout: how many seconds an /image request may wait for an empty reservoir before getting a 503
+    :return: an http server (not yet serving) with the endpoints:
+        /image?profile=<name>   a PNG from the reservoir
+        /stats                  JSON with each profile's queue depth, fill rate and latency counters
+    """
+    server = http.server.ThreadingHTTPServer((host, port), _RequestHandler)
+    server.reservoir = reservoir
+    server.wait_timeout = wait_timeout
+    return server
+
+
+def serve(host="127.0.0.1", port=8080, profiles=None, capacity=4, n_workers=None):
+    reservoir = ImageReservoir(profiles=profiles, capacity=capacity, n_workers=n_workers)
+    reservoir.start()
+
+    server = make_server(reservoir, host=host, port=port)
+    print("INFO: serving images on http://{}:{}/image".format(host, port))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        reservoir.shutdown()
+
+
+if __name__ == "__main__":
+    serve()
@@ -1,11 +1,56 @@
 
+import collections
+import contextlib
+import copy
+import math
+import os
 import random
+import sys
 import threading
+import time
 import concurrent.futures as futures
 
 
+# kind -> (reduces a list of values, merges the partial results of several reductions), see add_reduction
+_REDUCTIONS = {
+    "sum": (sum, sum),
+    "count_nonzero": (lambda vals: len(vals) - vals.count(0), sum),
+    "min": (min, min),
+    "max": (max, max)
+}
+
+_thread_state = threading.local()
+
+_MEMORY_SAMPLE_COLS = 8  # how many of a layer's columns _ParticleLayer.get_memory_size looks at
+
+# the entries of Simulator.get_memory_report that are totals, so they can be added up across several simulators
+MEMORY_REPORT_TOTALS = ("resident_bytes", "write_buffer_bytes", "kernel_bytes", "published_frame_bytes",
+                        "estimated_peak_bytes")
+
+
+@contextlib.contextmanager
+def skipping_initializers():
+    """
+    ParticleSimulators constructed (on this thread) within this block don't run their layers' initializers, so their
+        layers just hold default values. For simulators whose layers are about to be replaced, see adopt_layer.
+    """
+    prev = getattr(_thread_state, "skip_initializers", False)
+    _thread_state.skip_initializers = True
+    try:
+        yield
+    finally:
+        _thread_state.skip_initializers = prev
+
+
 class Simulator:
 
+    def __init__(self):
+        self._progress_listeners = []
+
+        self._simul_lock = threading.Lock()
+        self._is_simulating = False  # must only be accessed while simul_lock is held
+        self._step_waiters = []  # (event loop, future) of the steps waiting for this one to end, see step()
+
     def get_size(self):
         raise NotImplementedError()
 
@@ -22,20 +67,164 @@ class Simulator:
                 yield x, y
 
     def request_simulation_async(self):
-        x = threading.Thread(target=self.do_simulation, args=())
+        if not self._claim_step():
+            print("WARN: there's already a simulation happening, skipping request")
+            return None
+
+        x = threading.Thread(target=self._run_claimed_step, args=())
         x.start()
 
         return x
 
+    def _claim_step(self):
+        """:return: whether no step was in progress, in which case the caller may now run one (see _run_claimed_step)"""
+        with self._simul_lock:
+            if self._is_simulating:
+                return False
+            self._is_simulating = True
+            return True
+
+    def _run_claimed_step(self):
+        # do_simulation marks the step as finished when it's done, but if it fails that's left to here
+        try:
+            self.do_simulation()
+        except BaseException:
+            self._abandon_step()
+            raise
+
+    def _end_step(self):
+        """marks the step as finished, and wakes up the steps waiting for it"""
+        with self._simul_lock:
+            self._is_simulating = False
+            waiters = self._step_waiters
+            self._step_waiters = []
+
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake_waiter, waiter)
+            except RuntimeError:
+                pass  # its event loop has closed, so there's no one left to wake
+
+    def _abandon_step(self):
+        self._end_step()
+
     def do_simulation(self):
         raise NotImplementedError()
 
+    def get_active_simulator(self):
+        """:return: the simulator whose state this one is currently showing, see pipeline.SimulationPipeline"""
+        return self
+
+    def run(self, max_steps=None, render=False):
+        """
+        Generator that steps the simulation until it's done (or max_steps have been taken), yielding a Frame after
+            each step. Frames are views of the simulation's current state rather than copies, so they're only valid
+            until the generator is resumed. Use Frame.copy() to keep one around.
+        :param render: whether to render each frame's RGB data up front, see Frame.get_rgb
+        """
+        n_steps = 0
+        while not self.is_done() and (max_steps is None or n_steps < max_steps):
+            self.do_simulation()
+            n_steps += 1
+
+            frame = self.get_frame()
+            if render:
+                frame.get_rgb()
+            yield frame
+
+    def get_frame(self):
+        """:return: a Frame viewing the simulation's current state"""
+        raise NotImplementedError()
+
+    def get_published_frame(self):
+        """
+        :return: a Frame of the latest completed timestep, which never goes stale and can be rendered at any time
+            without holding up the simulation (or being held up by it). Its timestep identifies the version.
+        """
+        raise NotImplementedError()
+
+    async def step(self, executor=None, on_progress=None):
+        """
+        Awaitable version of do_simulation. The work is done in executor (None for the event loop's default one)
+            so the event loop isn't blocked. If a step is already in progress (from another call, on any event loop,
+            or from request_simulation_async), this waits for it to finish first.
+        :param on_progress: lambda percent_completed -> None, called on the event loop as the step progresses
+        """
+        import asyncio  # imported here since it's slow to import, and most callers never need it
+
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._simul_lock:
+                if not self._is_simulating:
+                    self._is_simulating = True
+                    break
+                waiter = loop.create_future()
+                self._step_waiters.append((loop, waiter))
+            await waiter  # resolved by _end_step
+
+        if on_progress is None:
+            await loop.run_in_executor(executor, self._run_claimed_step)
+        else:
+            def listener(_, pcnt):
+                loop.call_soon_threadsafe(on_progress, pcnt)
+
+            self.add_progress_listener(listener)
+            try:
+                await loop.run_in_executor(executor, self._run_claimed_step)
+            finally:
+                self.remove_progress_listener(listener)
+
+    async def frames(self, max_steps=None, executor=None, on_progress=None):
+        """
+        Async version of run: steps the simulation until it's done (or max_steps have been taken), yielding the
+            published Frame after each step (see get_published_frame), so it stays valid while the next step runs.
+        """
+        n_steps = 0
+        while not self.is_done() and (max_steps is None or n_steps < max_steps):
+            await self.step(executor=executor, on_progress=on_progress)
+            n_steps += 1
+            yield self.get_published_frame()
+
+    async def run_until_done(self, max_steps=None, executor=None, on_progress=None):
+        async for _ in self.frames(max_steps=max_steps, executor=executor, on_progress=on_progress):
+            pass
+
+    def add_progress_listener(self, listener):
+        """
+        :param listener: lambda simulator, percent_completed -> None. It's called from whichever thread is
+            simulating, so it should be quick.
+        """
+        self._progress_listeners.append(listener)
+
+    def remove_progress_listener(self, listener):
+        if listener in self._progress_listeners:
+            self._progress_listeners.remove(listener)
+
+    def _notify_progress(self):
+        if len(self._progress_listeners) > 0:
+            pcnt = self.get_percent_completed()
+            for listener in list(self._progress_listeners):
+                listener(self, pcnt)
+
     def is_simulating(self):
         raise NotImplementedError()
 
     def get_percent_completed(self):
         raise NotImplementedError()
 
+    def get_memory_report(self):
+        """
+        :return: dict of how much memory the simulation's layers use, in bytes:
+            "layers": layer_key -> {"kind": "static", "dynamic" or "scratch", "bytes": n} (not for ensembles),
+            "resident_bytes": the current layers,
+            "write_buffer_bytes": the (at most) extra needed during a step, for the copies of the dynamic layers,
+            "kernel_bytes": the temporary arrays a step makes with a kernel (see ParticleSimulator.set_kernel),
+            "published_frame_bytes": what the published frame holds on top of the layers (see get_published_frame),
+            "estimated_peak_bytes": the sum of the above. Only an estimate, since Python itself and the values
+                (which can be shared between cells) aren't counted exactly.
+        """
+        raise NotImplementedError()
+
     def get_color_for_render(self, xy):
         raise NotImplementedError()
 
@@ -56,61 +245,221 @@ class Simulator:
 class ParticleSimulator(Simulator):
 
     CHUNK_SIZE = (64, 64)
+    MIN_CHUNK_LENGTH = 8    # chunks aren't split thinner than this
+    CHUNKS_PER_WORKER = 4   # how finely the measured cost of a step is divided up, see _plan_chunks
 
-    def __init__(self, w, h, rand_seed=None):
+    def __init__(self, w, h, rand_seed=None, layer_storage=None):
+        """
+        :param layer_storage: where to keep the layers, e.g. a tiled.TiledLayerStorage for grids too large to fit
+            in memory. None means regular in-memory layers. Storage with a tile_size is stepped tile by tile.
+        """
         Simulator.__init__(self)
         self.w = w
         self.h = h
 
+        self._layer_storage = layer_storage
+        self._chunk_size = getattr(layer_storage, "tile_size", ParticleSimulator.CHUNK_SIZE)
+
         self.t = 0
+        self._t_before_step = None  # while a step is running, the timestep to go back to if it fails
 
         self._static_layers = {}  # static = not updated
 
         self._dynamic_layers = {}
 
-        if rand_seed is not None:
-            random.seed(rand_seed)
+        self._scratch_layers = {}  # scratch = updated in place, not double-buffered, see add_layer
+
+        self._reductions = {}  # name -> (layer_key, kind, cell_local)
+        self._reduction_vals = {}  # name -> value, as of the end of the last step
+        self._step_partials = {}  # name -> each chunk's partial result this step, see _start_reductions
+
+        # the simulator's own random number generator, so simulators stepped side by side (e.g. in an ensemble)
+        # each get their own stream. When it isn't seeded it's seeded from the random module, so random.seed still
+        # makes runs repeatable.
+        self.rand = random.Random(rand_seed if rand_seed is not None else random.getrandbits(64))
 
         self._color_lock = threading.Lock()
 
         # status stuff
-        self._simul_lock = threading.Lock()
-        self._is_simulating = False  # must only be accessed while simul_lock is held
-
         self._pixels_done_count = AtomicInteger(value=0)
 
         self._parallel = True
+        self._kernel = None
+
+        self._published_frame = None  # see get_published_frame
+
+        # if True, parallel steps split up the chunks that took the longest last step, see _plan_chunks
+        self.adaptive_chunks = True
+        self._chunk_costs = {}  # base chunk rect -> seconds it took to simulate last step
 
     def get_size(self):
         return self.w, self.h
 
+    def __getstate__(self):
+        # locks & listeners can't be pickled (or sent to other processes), so they're left behind
+        state = dict(self.__dict__)
+        for key in ("_color_lock", "_simul_lock", "_pixels_done_count", "_progress_listeners", "_step_waiters"):
+            state.pop(key, None)
+        state["_is_simulating"] = False
+        state["_published_frame"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._color_lock = threading.Lock()
+        self._simul_lock = threading.Lock()
+        self._pixels_done_count = AtomicInteger(value=0)
+        self._progress_listeners = []
+        self._step_waiters = []
+
     def is_done(self):
         return False
 
-    def add_layer(self, key, min_val=None, max_val=None, is_static=False, initializer_funct=None, default_val=0, out_of_bounds_val=0):
+    def add_layer(self, key, min_val=None, max_val=None, is_static=False, initializer_funct=None, default_val=0,
+                  out_of_bounds_val=0, is_scratch=False, flat_initializer_funct=None):
+        """
+        :param initializer_funct: lambda xy -> the cell's initial value
+        :param flat_initializer_funct: lambda w, h -> column-major list of all the initial values (see
+            _ParticleLayer.get_flat_values). Much faster than initializer_funct for big layers, as it's one call for
+            the whole layer instead of one per cell.
+        :param is_scratch: if True, the layer is working memory for the simulator rather than part of its state. It's
+            passed to update_layers as-is in the write buffers (instead of being copied & swapped each step), and it's
+            left out of frames. Resetting it (e.g. with fill_not_threadsafe in pre_update) is up to the simulator.
+        """
         if self.get_layer(key) is not None:
             raise ValueError("key already in use: {}".format(key))
+        if initializer_funct is not None and flat_initializer_funct is not None:
+            raise ValueError("can't use both initializer_funct and flat_initializer_funct")
 
-        new_layer = _ParticleLayer(self.w, self.h, default_val=default_val, min_val=min_val, max_val=max_val,
-                                   out_of_bounds_val=out_of_bounds_val)
-        if initializer_funct is not None:
+        if self._layer_storage is not None:
+            new_layer = self._layer_storage.new_layer(self.w, self.h, default_val=default_val, min_val=min_val,
+                                                      max_val=max_val, out_of_bounds_val=out_of_bounds_val)
+        else:
+            new_layer = _ParticleLayer(self.w, self.h, default_val=default_val, min_val=min_val, max_val=max_val,
+                                       out_of_bounds_val=out_of_bounds_val)
+        skip_initializers = getattr(_thread_state, "skip_initializers", False)
+        if initializer_funct is not None and not skip_initializers:
             for x in range(0, self.w):
                 for y in range(0, self.h):
                     new_layer.set_value_not_threadsafe((x, y), initializer_funct((x, y)))
+        elif flat_initializer_funct is not None and not skip_initializers:
+            new_layer.set_flat_values_not_threadsafe(flat_initializer_funct(self.w, self.h))
 
         if is_static:
             self._static_layers[key] = new_layer
+        elif is_scratch:
+            self._scratch_layers[key] = new_layer
         else:
             self._dynamic_layers[key] = new_layer
 
+    def adopt_layer(self, key, other, other_key=None, share=False):
+        """
+        Replaces one of this simulator's layers with another simulator's layer, without copying it.
+        :param other_key: the layer's key in other, or None if it's the same as key
+        :param share: if False, ownership is transferred: the layer is removed from other, which shouldn't be used
+            after that. If True both simulators keep using it. That's safe as long as neither edits it directly,
+            since stepping never writes to a simulator's current layers (it writes to copies, which are swapped in).
+        """
+        other_key = key if other_key is None else other_key
+        layer = other.get_layer(other_key)
+        if layer is None:
+            raise ValueError("no such layer: {}".format(other_key))
+        if (layer.w, layer.h) != (self.w, self.h):
+            raise ValueError("layer is {}x{}, expected {}x{}".format(layer.w, layer.h, self.w, self.h))
+        if share and other_key in other._scratch_layers:
+            raise ValueError("scratch layers are written in place, so they can't be shared: {}".format(other_key))
+
+        with self._color_lock:
+            for layers in (self._static_layers, self._dynamic_layers, self._scratch_layers):
+                if key in layers:
+                    layers[key] = layer
+                    break
+            else:
+                raise ValueError("no such layer: {}".format(key))
+
+            self._published_frame = None
+
+        if not share:
+            with other._color_lock:
+                for layers in (other._static_layers, other._dynamic_layers, other._scratch_layers):
+                    layers.pop(other_key, None)
+                other._published_frame = None
+
+        self.refresh_reductions()
+
+    def add_reduction(self, name, layer_key, kind, cell_local=True):
+        """
+        Makes the simulator keep track of a summary of a layer (as of the end of the latest step), so it can be looked
+            up with get_reduction without going over the layer. It's computed as part of each step: when the step is
+            done in chunks, each chunk reduces its own cells of the layer's write buffer as soon as it's finished,
+            and the step merges those partial results.
+        :param kind: "sum", "count_nonzero", "min" or "max". Values are clamped like get_value clamps them.
+        :param cell_local: whether update_layers only ever writes the layer at the cell it's updating. A chunk's
+            partial result would miss writes that other chunks make to its cells afterwards, so if the layer is also
+            written at other cells (e.g. when something moves to a neighbor), pass False, and it's reduced in one go
+            once all the chunks are done instead.
+        """
+        if kind not in _REDUCTIONS:
+            raise ValueError("unknown reduction: {}".format(kind))
+        if self.get_layer(layer_key) is None:
+            raise ValueError("no such layer: {}".format(layer_key))
+        self._reductions[name] = (layer_key, kind, cell_local)
+        self.refresh_reductions()
+
+    def get_reduction(self, name):
+        with self._color_lock:
+            return self._reduction_vals[name]
+
+    def refresh_reductions(self):
+        """recomputes the reductions. Needed after editing layers directly (outside of a step)."""
+        reduction_vals = {name: self.get_layer(layer_key).reduce(kind)
+                          for name, (layer_key, kind, _) in self._reductions.items()}
+        with self._color_lock:
+            self._reduction_vals = reduction_vals
+
+    def _start_reductions(self):
+        # static layers don't change, so their reductions are carried over from the last step
+        self._step_partials = {name: [] for name, (layer_key, _, cell_local) in self._reductions.items()
+                               if cell_local and layer_key not in self._static_layers}
+
+    def _add_reduction_partials(self, write_buffers, rect):
+        """called once each chunk of the step is done, see _start_reductions"""
+        for name, partials in self._step_partials.items():
+            layer_key, kind, _ = self._reductions[name]
+            partials.append(write_buffers[layer_key].reduce(kind, rect))
+
+    def _finish_reductions(self, write_buffers):
+        res = {}
+        for name, (layer_key, kind, _) in self._reductions.items():
+            partials = self._step_partials.get(name)
+            if layer_key in self._static_layers:
+                res[name] = self._reduction_vals[name]
+            elif partials:
+                res[name] = _REDUCTIONS[kind][1](partials)
+            else:
+                # the step wasn't done in chunks (or the layer isn't cell_local)
+                res[name] = write_buffers[layer_key].reduce(kind)
+        return res
+
     def set_parallel(self, val):
         self._parallel = val
 
+    def set_kernel(self, kernel):
+        """
+        :param kernel: object with a simulate(simulation, write_buffers) method that does a whole timestep at once,
+            instead of calling update_layers per cell (see kernels.py), and start_batch(simulations) & simulate_batch(
+            simulations, all_write_buffers) methods that start and do it for several simulators that use it at
+            once (see ParticleSimulatorEnsemble). None to go back to update_layers.
+        """
+        self._kernel = kernel
+
     def get_layer(self, key):
         if key in self._static_layers:
             return self._static_layers[key]
         elif key in self._dynamic_layers:
             return self._dynamic_layers[key]
+        elif key in self._scratch_layers:
+            return self._scratch_layers[key]
         else:
             return None
 
@@ -122,7 +471,7 @@ class ParticleSimulator(Simulator):
 
     def _make_chunks(self, t, write_buffers, progress_count):
         res = []
-        chunk_w, chunk_h = ParticleSimulator.CHUNK_SIZE
+        chunk_w, chunk_h = self._chunk_size
         for x in range(0, self.w, chunk_w):
             for y in range(0, self.h, chunk_h):
                 rect = [x,
@@ -132,53 +481,142 @@ class ParticleSimulator(Simulator):
                 res.append(SimulChunk(self, rect, t, write_buffers, progress_count))
         return res
 
-    def request_simulation_async(self):
-        with self._simul_lock:
-            if self._is_simulating:
-                print("WARN: there's already a simulation happening, skipping request")
-                return None
-            else:
-                self._is_simulating = True
-
-        return super().request_simulation_async()
+    def _plan_chunks(self, t, write_buffers, progress_count):
+        """
+        :return: the chunks for a parallel step. The fixed-size chunks from _make_chunks are split into strips in
+            proportion to how long they took last step (so no one chunk holds up the step), and each chunk's
+            expected_cost is set, so the costliest can be started first.
+        """
+        res = self._make_chunks(t, write_buffers, progress_count)
+        total_cost = sum(self._chunk_costs.values())
+        if not self.adaptive_chunks or total_cost <= 0:
+            return res
+
+        target_cost = total_cost / ((os.cpu_count() or 1) * ParticleSimulator.CHUNKS_PER_WORKER)
+
+        split_res = []
+        for chunk in res:
+            cost = self._chunk_costs.get(tuple(chunk.rect), 0)
+            x, y, w, h = chunk.rect
+            vertical = w >= h  # cut across the longer side
+            n_pieces = max(1, min(math.ceil(cost / target_cost),
+                                  (w if vertical else h) // ParticleSimulator.MIN_CHUNK_LENGTH))
+            for i in range(0, n_pieces):
+                if vertical:
+                    x1, x2 = x + w * i // n_pieces, x + w * (i + 1) // n_pieces
+                    piece_rect = [x1, y, x2 - x1, h]
+                else:
+                    y1, y2 = y + h * i // n_pieces, y + h * (i + 1) // n_pieces
+                    piece_rect = [x, y1, w, y2 - y1]
+                piece = SimulChunk(self, piece_rect, t, write_buffers, progress_count, base_rect=chunk.rect)
+                piece.expected_cost = cost / n_pieces
+                split_res.append(piece)
+
+        return split_res
+
+    def _record_chunk_costs(self, chunks):
+        costs = {}
+        for chunk in chunks:
+            key = tuple(chunk.base_rect)
+            costs[key] = costs.get(key, 0) + chunk.elapsed
+        self._chunk_costs = costs
 
     def do_simulation(self):
-        with self._simul_lock:
-            if self.is_done():
-                print("WARN: simulation has finished")
-                self._is_simulating = False
+        try:
+            write_buffers = self._start_step()
+            if write_buffers is None:
                 return
+
+            if self._parallel and self._kernel is None:
+                chunks = self._plan_chunks(self.t, write_buffers, self._pixels_done_count)
+                _simulate_chunks(chunks)
+                self._record_chunk_costs(chunks)
             else:
+                self._simulate_serially(write_buffers)
+
+            self._finish_step(write_buffers)
+        except BaseException:
+            self._abandon_step()
+            raise
+
+    def _start_step(self, copy_layer=None):
+        """
+        :param copy_layer: lambda layer_key, layer -> the layer's write buffer for the step, a copy of it. None means
+            layer.make_copy().
+        :return: the write buffers for the new timestep, or None if the simulation has already finished.
+        """
+        with self._simul_lock:
+            is_done = self.is_done()
+            if not is_done:
                 self._is_simulating = True  # should already be set but just in case...
+        if is_done:
+            print("WARN: simulation has finished")
+            self._end_step()
+            return None
 
+        self._t_before_step = self.t
         self.t += 1
         self._pixels_done_count.set(0)
+        self._start_reductions()
 
         self.pre_update(self.t)
 
         write_buffers = {}
-        for layer_key in self._dynamic_layers:
-            write_buffers[layer_key] = self._dynamic_layers[layer_key].make_copy()
+        for layer_key, layer in self._dynamic_layers.items():
+            write_buffers[layer_key] = layer.make_copy() if copy_layer is None else copy_layer(layer_key, layer)
+        write_buffers.update(self._scratch_layers)
+
+        return write_buffers
+
+    def _abandon_step(self):
+        # the step's write buffers were never swapped in, so the layers are still at the timestep before it
+        if self._t_before_step is not None:
+            self.t = self._t_before_step
+            self._t_before_step = None
+        Simulator._abandon_step(self)
+
+    def _simulate_serially(self, write_buffers):
+        if self._kernel is not None:
+            self._kernel.simulate(self, write_buffers)
+            self._pixels_done_count.set(self.w * self.h)
+            self._notify_progress()
+            return
 
-        if self._parallel:
-            chunks = self._make_chunks(self.t, write_buffers, self._pixels_done_count)
+        if getattr(self._layer_storage, "tile_size", None) is not None:
+            # go tile by tile, so only the current tile and its neighbors need to be resident
+            for chunk in self._make_chunks(self.t, write_buffers, self._pixels_done_count):
+                chunk.simulate()
+            return
 
-            with futures.ThreadPoolExecutor() as executor:
-                executor.map(lambda chunk: chunk.simulate(), chunks)
-        else:
-            for y in range(0, self.h):
-                for x in range(0, self.w):
-                    self.update_layers((x, y), self.t, write_buffers)
+        for y in range(0, self.h):
+            for x in range(0, self.w):
+                self.update_layers((x, y), self.t, write_buffers)
+
+            self._pixels_done_count.inc(amount=self.w)
+            self._notify_progress()
 
-                self._pixels_done_count.inc(amount=self.w)
+    def _finish_step(self, write_buffers):
+        reduction_vals = self._finish_reductions(write_buffers)
+
+        for layer_key in self._scratch_layers:
+            del write_buffers[layer_key]
 
         with self._color_lock:
             self._dynamic_layers = write_buffers
+            self._reduction_vals = reduction_vals
+        self._t_before_step = None
 
         self.post_update(self.t)
 
-        with self._simul_lock:
-            self._is_simulating = False
+        # published after post_update, so the frame's renderer sees anything it changed. Until then readers keep
+        # getting the last step's frame, which stays valid.
+        layers = dict(self._static_layers)
+        layers.update(write_buffers)
+        published_frame = self._make_published_frame(layers)
+        with self._color_lock:
+            self._published_frame = published_frame
+
+        self._end_step()
 
         self._pixels_done_count.set(0)
 
@@ -207,12 +645,367 @@ class ParticleSimulator(Simulator):
 
     def fetch_colors_safely(self, rect, color_funct, expected_total_size=None):
         """
+        Draws the latest published timestep (see get_published_frame), so a step can finish while this is drawing.
         :param rect: [x, y, w, h]
         :param color_funct: lambda xy, color -> None
         :param expected_total_size: if the simulations size differs from this, nothing will be drawn
         """
+        renderer = self.get_published_frame()._renderer
+        Simulator.fetch_colors_safely(renderer, rect, color_funct, expected_total_size=expected_total_size)
+
+    def get_frame(self):
+        with self._color_lock:
+            layers = dict(self._static_layers)
+            layers.update(self._dynamic_layers)
+        return Frame(self, self.t, self.get_size(), layers)
+
+    def get_published_frame(self):
+        # published when each step finishes, and the swapped-in layers are never written to again (the next step
+        # writes to copies), so readers only need a reference to it
+        frame = self._published_frame
+        if frame is None:
+            with self._color_lock:
+                if self._published_frame is None:
+                    layers = dict(self._static_layers)
+                    layers.update(self._dynamic_layers)
+                    self._published_frame = self._make_published_frame(layers)
+                frame = self._published_frame
+        return frame
+
+    def _make_published_frame(self, layers):
+        return Frame(self, self.t, self.get_size(), layers, renderer=self._make_renderer(layers))
+
+    def _make_renderer(self, layers):
+        """:return: a copy of the simulator that sees only these layers, so its get_color_for_render renders them"""
+        renderer = copy.copy(self)
+        renderer._static_layers = {key: layers[key] for key in self._static_layers}
+        renderer._dynamic_layers = {key: layers[key] for key in layers if key not in self._static_layers}
+        return renderer
+
+    def get_memory_report(self):
         with self._color_lock:
-            super().fetch_colors_safely(rect, color_funct, expected_total_size=expected_total_size)
+            all_layers = [("static", self._static_layers), ("dynamic", self._dynamic_layers),
+                          ("scratch", self._scratch_layers)]
+            layers = {key: {"kind": kind, "bytes": layer.get_memory_size()}
+                      for kind, kind_layers in all_layers for key, layer in kind_layers.items()}
+
+            frame = self._published_frame
+
+        resident = sum(info["bytes"] for info in layers.values())
+        write_buffers = sum(info["bytes"] for info in layers.values() if info["kind"] == "dynamic")
+        kernel_bytes = self._kernel.get_step_memory_size(self) if self._kernel is not None else 0
+        frame_bytes = frame.get_memory_size() if frame is not None else 0
+        return {
+            "layers": layers,
+            "resident_bytes": resident,
+            "write_buffer_bytes": write_buffers,
+            "kernel_bytes": kernel_bytes,
+            "published_frame_bytes": frame_bytes,
+            "estimated_peak_bytes": resident + write_buffers + kernel_bytes + frame_bytes
+        }
+
+
+def estimate_memory(simulator_class, w, h, *args, **kwargs):
+    """
+    Predicts the peak memory use (estimated_peak_bytes, see Simulator.get_memory_report) of a ParticleSimulator before
+        making it, assuming in-memory layers where every cell holds its own float (the worst case, and typical once a
+        simulation gets going), no kernel, and no rendered frames.
+    :param args, kwargs: the rest of simulator_class's constructor arguments, needed to know which layers it adds
+    :return: the estimated number of bytes
+    """
+    with skipping_initializers():
+        sample = simulator_class(1, 1, *args, **kwargs)
+
+    resident = 0
+    write_buffers = 0
+    for layer_key in list(sample._static_layers) + list(sample._dynamic_layers) + list(sample._scratch_layers):
+        n_bytes = _ParticleLayer.estimate_memory_size(w, h)
+        resident += n_bytes
+        if layer_key in sample._dynamic_layers:
+            write_buffers += n_bytes
+    return resident + write_buffers
+
+
+def get_flat_random_initializer(chance, val=1, rand=random):
+    """
+    :param rand: the random number generator to use, e.g. the simulator's rand
+    :return: a flat initializer (see ParticleSimulator.add_layer) that sets each cell to val with the given chance
+    """
+    return lambda w, h: [val if rand.random() < chance else 0 for _ in range(0, w * h)]
+
+
+class ParticleSimulatorEnsemble(Simulator):
+    """
+    Steps several independent, same-sized ParticleSimulators together. Each member keeps its own parameters, random
+        number generator and is_done, but a timestep of the ensemble advances every unfinished member in one pass,
+        instead of each member paying for its own step. Members using the same kernel are stepped in one
+        simulate_batch call (for the compiled blob kernel, that's one call on their layers stacked into arrays), and
+        the rest share a single thread pool when parallel.
+    """
+
+    def __init__(self, members):
+        Simulator.__init__(self)
+        if len(members) == 0:
+            raise ValueError("ensemble must have at least one member")
+
+        size = members[0].get_size()
+        for m in members:
+            if m.get_size() != size:
+                raise ValueError("ensemble members must all be the same size: {} != {}".format(m.get_size(), size))
+
+        self._members = list(members)
+        for m in self._members:
+            m.add_progress_listener(self._on_member_progress)
+        self._size = size
+        self.t = 0
+        self._t_before_step = None  # see ParticleSimulator
+
+        # which member to render
+        self.display_idx = 0
+
+        self._parallel = all(m._parallel for m in self._members)
+
+    def __len__(self):
+        return len(self._members)
+
+    def get_size(self):
+        return self._size
+
+    def get_member(self, idx):
+        return self._members[idx]
+
+    def get_displayed_member(self):
+        if len(self._members) == 0:
+            raise ValueError("the ensemble has no members left")
+        return self._members[self.display_idx]
+
+    def extract_member(self, idx):
+        """
+        Removes a member from the ensemble, so it can be used as a normal simulator. The same member stays on
+            display, unless it's the one removed.
+        """
+        idx = range(0, len(self._members))[idx]  # so negative indices (and bad ones) work like they do for lists
+        res = self._members.pop(idx)
+        res.remove_progress_listener(self._on_member_progress)
+        if idx < self.display_idx or self.display_idx >= len(self._members):
+            self.display_idx = max(0, self.display_idx - 1)
+        return res
+
+    def _on_member_progress(self, member, pcnt):
+        self._notify_progress()
+
+    def get_layer(self, key):
+        """:return: the given layer of every member, indexed by member."""
+        return [m.get_layer(key) for m in self._members]
+
+    def set_parallel(self, val):
+        self._parallel = val
+
+    def is_done(self):
+        return all(m.is_done() for m in self._members)
+
+    def get_timestep(self):
+        return self.t
+
+    def do_simulation(self):
+        with self._simul_lock:
+            self._is_simulating = True
+
+        try:
+            active = [m for m in self._members if not m.is_done()]
+            if len(active) > 0:
+                self._t_before_step = self.t
+                self.t += 1
+
+            batches = {}  # kernel -> members that use it
+            for m in active:
+                if m._kernel is not None:
+                    batches.setdefault(m._kernel, []).append(m)
+
+            # the kernels make their batch's write buffers, so they can lay them out for simulate_batch
+            write_buffers_by_member = {}
+            for kernel, batch in batches.items():
+                write_buffers_by_member.update(zip(batch, kernel.start_batch(batch)))
+            all_write_buffers = [write_buffers_by_member[m] if m._kernel is not None else m._start_step()
+                                 for m in active]
+
+            chunks = []
+            for m, write_buffers in zip(active, all_write_buffers):
+                if m._kernel is not None:
+                    continue
+                elif self._parallel:
+                    chunks.extend(m._plan_chunks(m.t, write_buffers, m._pixels_done_count))
+                else:
+                    m._simulate_serially(write_buffers)
+
+            for kernel, batch in batches.items():
+                kernel.simulate_batch(batch, [write_buffers_by_member[m] for m in batch])
+                for m in batch:
+                    m._pixels_done_count.set(m.w * m.h)
+                    m._notify_progress()
+
+            if len(chunks) > 0:
+                _simulate_chunks(chunks)
+                for m in active:
+                    m._record_chunk_costs([chunk for chunk in chunks if chunk.simulation is m])
+
+            for m, write_buffers in zip(active, all_write_buffers):
+                m._finish_step(write_buffers)
+            self._t_before_step = None
+        except BaseException:
+            self._abandon_step()
+            raise
+
+        self._end_step()
+
+    def is_simulating(self):
+        with self._simul_lock:
+            return self._is_simulating
+
+    def _abandon_step(self):
+        for m in self._members:
+            m._abandon_step()
+        if self._t_before_step is not None:
+            self.t = self._t_before_step
+            self._t_before_step = None
+        Simulator._abandon_step(self)
+
+    def get_percent_completed(self):
+        if not self.is_simulating() or len(self._members) == 0:
+            return 0.0
+        else:
+            return sum(m.get_percent_completed() for m in self._members) / len(self._members)
+
+    def get_color_for_render(self, xy):
+        return self.get_displayed_member().get_color_for_render(xy)
+
+    def fetch_colors_safely(self, rect, color_funct, expected_total_size=None):
+        self.get_displayed_member().fetch_colors_safely(rect, color_funct, expected_total_size=expected_total_size)
+
+    def get_frame(self):
+        return self.get_displayed_member().get_frame()
+
+    def get_published_frame(self):
+        return self.get_displayed_member().get_published_frame()
+
+    def get_memory_report(self):
+        reports = [m.get_memory_report() for m in self._members]
+        res = {"members": reports}
+        for key in MEMORY_REPORT_TOTALS:
+            res[key] = sum(report[key] for report in reports)
+        return res
+
+
+def _wake_waiter(waiter):
+    if not waiter.done():  # it's cancelled if the step waiting on it was
+        waiter.set_result(None)
+
+
+class Frame:
+    """
+    The state of a simulation after a timestep. By default it only views the simulation's layers (it doesn't copy
+        them), so it goes stale once the simulation takes another step. See copy() and
+        Simulator.get_published_frame.
+    """
+
+    def __init__(self, simulation, timestep, size, layers, rgb=None, renderer=None):
+        """
+        :param renderer: a Simulator whose get_color_for_render reads exactly these layers, or None to render with
+            the simulation (which is only right until it steps again)
+        """
+        self.simulation = simulation
+        self.timestep = timestep
+        self.size = size
+
+        self._source = simulation  # the ParticleSimulator the layers are from (simulation may be e.g. its pipeline)
+        self._layers = {key: _LayerView(layers[key]) for key in layers}
+        self._rgb = rgb
+        self._renderer = renderer
+        self._is_copy = False
+
+    def is_stale(self):
+        """:return: whether the simulation has moved on, making this frame's views invalid"""
+        return not self._is_copy and self._renderer is None and self.simulation.get_timestep() != self.timestep
+
+    def get_layer_keys(self):
+        return list(self._layers.keys())
+
+    def get_layer(self, key):
+        """:return: a read-only view of the layer, or None if there's no such layer"""
+        return self._layers.get(key)
+
+    def get_value(self, key, xy):
+        return self._layers[key].get_value(xy)
+
+    def get_rgb(self):
+        """
+        :return: the frame rendered as row-major RGB bytes (3 bytes per pixel). Rendering happens on first call,
+            which must be before the frame goes stale.
+        """
+        if self._rgb is None:
+            if self.is_stale():
+                raise ValueError("can't render frame {}, the simulation is already at timestep {}".format(
+                    self.timestep, self.simulation.get_timestep()))
+
+            w, h = self.size
+            rgb = bytearray(w * h * 3)
+
+            def set_pixel(xy, color):
+                idx = (xy[1] * w + xy[0]) * 3
+                rgb[idx:idx + 3] = bytes(color[0:3])
+
+            if self._renderer is not None:
+                Simulator.fetch_colors_safely(self._renderer, [0, 0, w, h], set_pixel)
+            else:
+                self.simulation.fetch_colors_safely([0, 0, w, h], set_pixel)
+            self._rgb = bytes(rgb)
+
+        return self._rgb
+
+    def copy(self):
+        """
+        :return: a frame that owns copies of this frame's layers (and RGB data, if rendered), so it never goes stale.
+            If it isn't rendered yet, the copy renders its own layers when asked to.
+        """
+        layers = {key: self._layers[key]._layer.make_copy() for key in self._layers}
+        renderer = self._source._make_renderer(layers) if self._rgb is None else None
+        res = Frame(self.simulation, self.timestep, self.size, layers, rgb=self._rgb, renderer=renderer)
+        res._source = self._source
+        res._is_copy = True
+        return res
+
+    def get_memory_size(self):
+        """:return: bytes of RGB data, plus the layers if this is a copy (otherwise they're the simulation's)"""
+        res = len(self._rgb) if self._rgb is not None else 0
+        if self._is_copy:
+            res += sum(view._layer.get_memory_size() for view in self._layers.values())
+        return res
+
+
+class _LayerView:
+    """read-only access to a layer"""
+
+    def __init__(self, layer):
+        self._layer = layer
+        self.w = layer.w
+        self.h = layer.h
+
+    def is_valid(self, xy):
+        return self._layer.is_valid(xy)
+
+    def get_value(self, xy):
+        return self._layer.get_value(xy)
+
+    def get_flat_values(self, clamp=True):
+        return self._layer.get_flat_values(clamp=clamp)
+
+    def get_neighbors(self, xy, valid_only=True, include_ortho=True, include_diagonals=False, shuffled=False):
+        return self._layer.get_neighbors(xy, valid_only=valid_only, include_ortho=include_ortho,
+                                         include_diagonals=include_diagonals, shuffled=shuffled)
+
+    def sum_neighbor_values(self, xy, func=lambda v: v, valid_only=True, include_ortho=True, include_diagonals=False):
+        return self._layer.sum_neighbor_values(xy, func=func, valid_only=valid_only, include_ortho=include_ortho,
+                                               include_diagonals=include_diagonals)
 
 
 class _ParticleLayer:
@@ -232,6 +1025,39 @@ class _ParticleLayer:
         for _ in range(0, self.w):
             self._array.append([default_val] * self.h)
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop("_write_lock", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._write_lock = threading.Lock()
+
+    def get_memory_size(self):
+        """
+        :return: an estimate of the bytes used by the layer's lists and the values in them. The values are only
+            looked at in a few columns (each distinct value counted once), and the rest assumed to be like them.
+        """
+        res = sys.getsizeof(self._array) + sum(sys.getsizeof(col) for col in self._array)
+
+        sample_cols = self._array[::max(1, self.w // _MEMORY_SAMPLE_COLS)]
+        seen_ids = set()
+        sample_bytes = 0
+        for col in sample_cols:
+            for val in col:
+                if id(val) not in seen_ids:
+                    seen_ids.add(id(val))
+                    sample_bytes += sys.getsizeof(val)
+        if len(sample_cols) > 0:
+            res += sample_bytes * self.w // len(sample_cols)
+        return res
+
+    @staticmethod
+    def estimate_memory_size(w, h):
+        """:return: bytes a w x h layer would use if every cell held its own float"""
+        return sys.getsizeof([None] * w) + w * sys.getsizeof([None] * h) + w * h * sys.getsizeof(0.0)
+
     def make_copy(self, leave_empty=False):
         res = _ParticleLayer(self.w, self.h,
                              default_val=self._default_val,
@@ -254,9 +1080,42 @@ class _ParticleLayer:
 
     def fill_not_threadsafe(self, val):
         """don't call this during update_layers, lest ye violate thread safety"""
-        for y in range(0, self.h):
-            for x in range(0, self.w):
-                self.set_value_not_threadsafe((x, y), val)
+        self._array = [[val] * self.h for _ in range(0, self.w)]
+
+    def get_flat_values(self, clamp=True):
+        """
+        :param clamp: whether to clamp the values to the layer's min & max, like get_value does
+        :return: all the layer's values as a column-major list (index = x * h + y)
+        """
+        res = [val for col in self._array for val in col]
+        if clamp and self._max_val is not None:
+            res = [min(val, self._max_val) for val in res]
+        if clamp and self._min_val is not None:
+            res = [max(val, self._min_val) for val in res]
+        return res
+
+    def reduce(self, kind, rect=None):
+        """
+        :param kind: see ParticleSimulator.add_reduction
+        :param rect: [x, y, w, h] to reduce, or None for the whole layer
+        """
+        x, y, w, h = [0, 0, self.w, self.h] if rect is None else rect
+        reduce_funct, merge_funct = _REDUCTIONS[kind]
+        partials = []
+        for col in self._array[x:x + w]:
+            vals = col[y:y + h]
+            if self._max_val is not None and max(vals) > self._max_val:
+                vals = [min(val, self._max_val) for val in vals]
+            if self._min_val is not None and min(vals) < self._min_val:
+                vals = [max(val, self._min_val) for val in vals]
+            partials.append(reduce_funct(vals))
+        return merge_funct(partials)
+
+    def set_flat_values_not_threadsafe(self, vals):
+        """:param vals: column-major list of length w * h, see get_flat_values"""
+        if len(vals) != self.w * self.h:
+            raise ValueError("expected {} values, got {}".format(self.w * self.h, len(vals)))
+        self._array = [list(vals[x * self.h:(x + 1) * self.h]) for x in range(0, self.w)]
 
     def add_value(self, xy, val):
         if self.is_valid(xy):
@@ -301,20 +1160,54 @@ class _ParticleLayer:
         return res
 
 
+def _simulate_chunks(chunks):
+    """
+    Simulates the chunks on a thread pool. Rather than handing each thread a fixed share, the chunks go in one queue
+        (costliest first) and whichever thread is free takes the next one, so the cheap ones fill in around the
+        expensive ones at the end of the step.
+    """
+    if len(chunks) == 0:
+        return  # e.g. a 0 x 0 simulation. The pool needs at least one worker.
+
+    queue = collections.deque(sorted(chunks, key=lambda chunk: chunk.expected_cost, reverse=True))
+
+    def work():
+        while True:
+            try:
+                chunk = queue.popleft()
+            except IndexError:
+                return
+            chunk.simulate()
+
+    n_workers = min(len(chunks), os.cpu_count() or 1)
+    with futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for f in [executor.submit(work) for _ in range(0, n_workers)]:
+            f.result()
+
+
 class SimulChunk:
 
-    def __init__(self, simulation, rect, t, write_buffers, progress_counter):
+    def __init__(self, simulation, rect, t, write_buffers, progress_counter, base_rect=None):
+        """:param base_rect: the chunk this one was split from, if any (see ParticleSimulator._plan_chunks)"""
         self.simulation = simulation
         self.rect = rect
+        self.base_rect = rect if base_rect is None else base_rect
         self.write_buffers = write_buffers
         self.t = t
         self.progress_counter = progress_counter
 
+        self.expected_cost = 0
+        self.elapsed = 0
+
     def simulate(self):
+        start_time = time.thread_time()  # not wall time, which would count waiting on other threads
         for y in range(self.rect[1], self.rect[1] + self.rect[3]):
             for x in range(self.rect[0], self.rect[0] + self.rect[2]):
                 self.simulation.update_layers((x, y), self.t, self.write_buffers)
             self.progress_counter.inc(amount=self.rect[2])
+            self.simulation._notify_progress()
+        self.simulation._add_reduction_partials(self.write_buffers, self.rect)
+        self.elapsed = time.thread_time() - start_time
 
 
 class AtomicInteger:
@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import pytest
+
+import conway
+
+
+class _TrackingSimulator(conway.ConwaySimulator):
+    """counts how many of its steps overlap"""
+
+    def __init__(self):
+        conway.ConwaySimulator.__init__(self, 8, 8, rand_seed=1)
+        self.n_active = 0
+        self.max_active = 0
+
+    def pre_update(self, t):
+        self.n_active += 1
+        self.max_active = max(self.max_active, self.n_active)
+        time.sleep(0.01)
+
+    def post_update(self, t):
+        self.n_active -= 1
+
+
+def test_concurrent_steps_run_one_at_a_time():
+    simulation = _TrackingSimulator()
+
+    async def main():
+        await asyncio.gather(*[simulation.step() for _ in range(3)])
+
+    asyncio.run(main())
+    assert simulation.get_timestep() == 3
+    assert simulation.max_active == 1
+
+
+def test_step_waits_for_a_threaded_step():
+    simulation = _TrackingSimulator()
+    thread = simulation.request_simulation_async()
+    assert simulation.request_simulation_async() is None  # already stepping
+
+    asyncio.run(simulation.step())
+    thread.join()
+    assert simulation.get_timestep() == 2
+    assert simulation.max_active == 1
+    assert simulation._step_waiters == []  # it waited on the threaded step rather than polling
+
+
+def test_step_works_on_several_event_loops():
+    simulation = _TrackingSimulator()
+    asyncio.run(simulation.step())
+    asyncio.run(simulation.step())
+    assert simulation.get_timestep() == 2
+
+
+def test_frames_yields_each_published_frame_and_reports_progress():
+    simulation = conway.ConwaySimulator(8, 8, rand_seed=1)
+    simulation.set_parallel(False)
+    progress = []
+
+    async def main():
+        return [frame async for frame in simulation.frames(max_steps=3, on_progress=progress.append)]
+
+    frames = asyncio.run(main())
+    assert [frame.timestep for frame in frames] == [1, 2, 3]
+    assert frames[-1] is simulation.get_published_frame()
+    assert len(frames[0].get_rgb()) == 8 * 8 * 3  # earlier frames stay readable
+    assert len(progress) > 0 and max(progress) <= 1
+
+
+def test_failed_step_releases_the_simulator():
+    simulation = _TrackingSimulator()
+
+    def fail(t):
+        raise RuntimeError("boom")
+    simulation.pre_update = fail
+
+    with pytest.raises(RuntimeError, match="boom"):
+        asyncio.run(simulation.step())
+    assert not simulation.is_simulating()
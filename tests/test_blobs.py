@@ -0,0 +1,45 @@
+import blobs
+
+
+def _make_sim(incremental):
+    res = blobs.BlobSimulator(24, 20, intial_spawn_rate=0.5, rand_seed=7)
+    res.set_parallel(False)
+    res.incremental_fitness = incremental
+    return res
+
+
+def _blobs(simulation):
+    return simulation.get_layer(blobs.BlobSimulator.BLOB_LAYER).get_flat_values()
+
+
+def test_incremental_fitness_matches_full_recompute():
+    full_sim, incremental_sim = _make_sim(False), _make_sim(True)
+    for _ in range(8):
+        full_sim.do_simulation()
+        incremental_sim.do_simulation()
+        assert _blobs(incremental_sim) == _blobs(full_sim)
+
+
+def test_toggling_incremental_fitness_forgets_what_it_kept():
+    full_sim, toggled_sim = _make_sim(False), _make_sim(True)
+    for step in range(9):
+        if step % 3 == 0:
+            toggled_sim.incremental_fitness = not toggled_sim.incremental_fitness
+        full_sim.do_simulation()
+        toggled_sim.do_simulation()
+        assert _blobs(toggled_sim) == _blobs(full_sim)
+
+
+def test_incremental_fitness_only_recomputes_around_moved_blobs():
+    simulation = _make_sim(True)
+    calls = []
+    calc_fitness_base = simulation._calc_fitness_base
+    simulation._calc_fitness_base = lambda xy: calls.append(xy) or calc_fitness_base(xy)
+
+    simulation.do_simulation()
+    first_step_calls = len(calls)
+    del calls[:]
+    simulation.do_simulation()
+
+    assert 0 < first_step_calls < simulation.w * simulation.h
+    assert len(calls) < first_step_calls
@@ -0,0 +1,26 @@
+import conway
+import sim
+
+
+def test_simulating_no_chunks_does_nothing():
+    sim._simulate_chunks([])
+
+
+def test_empty_simulation_steps_in_parallel():
+    simulation = conway.ConwaySimulator(0, 0, rand_seed=1)
+    simulation.set_parallel(True)
+    simulation.do_simulation()
+    assert simulation.get_timestep() == 1
+    assert not simulation.is_simulating()
+
+
+def test_parallel_step_matches_serial_step():
+    serial_sim = conway.ConwaySimulator(30, 20, rand_seed=6)
+    serial_sim.set_parallel(False)
+    parallel_sim = conway.ConwaySimulator(30, 20, rand_seed=6)
+    parallel_sim.set_parallel(True)
+    for _ in range(3):
+        serial_sim.do_simulation()
+        parallel_sim.do_simulation()
+        assert (parallel_sim.get_layer(conway.ConwaySimulator.BLOB_LAYER).get_flat_values() ==
+                serial_sim.get_layer(conway.ConwaySimulator.BLOB_LAYER).get_flat_values())
@@ -0,0 +1,108 @@
+import pytest
+
+import blobs
+import sim
+
+
+def _blob_values(simulation):
+    return simulation.get_layer(blobs.BlobSimulator.BLOB_LAYER).get_flat_values()
+
+
+def _make_blob_sims(seeds):
+    res = [blobs.BlobSimulator(16, 12, intial_spawn_rate=0.7, rand_seed=seed) for seed in seeds]
+    for simulation in res:
+        simulation.set_parallel(False)
+    return res
+
+
+def test_members_step_like_standalone_simulators():
+    ensemble = sim.ParticleSimulatorEnsemble(_make_blob_sims([1, 2, 3]))
+    ensemble.set_parallel(False)
+    standalone = _make_blob_sims([1, 2, 3])
+
+    for _ in range(4):
+        ensemble.do_simulation()
+        for simulation in standalone:
+            simulation.do_simulation()
+
+    # each member draws from its own generator, so stepping them together doesn't change any of them
+    for idx, simulation in enumerate(standalone):
+        assert _blob_values(ensemble.get_member(idx)) == _blob_values(simulation)
+    assert ensemble.get_timestep() == 4
+
+
+def test_extract_member_keeps_display_valid():
+    members = _make_blob_sims([1, 2, 3])
+    ensemble = sim.ParticleSimulatorEnsemble(members)
+    ensemble.display_idx = 2
+
+    assert ensemble.extract_member(0) is members[0]
+    assert ensemble.get_displayed_member() is members[2]
+
+    assert ensemble.extract_member(-1) is members[2]
+    assert ensemble.get_displayed_member() is members[1]
+
+    assert ensemble.extract_member(0) is members[1]
+    assert len(ensemble) == 0
+    assert ensemble.get_size() == (16, 12)
+    assert ensemble.is_done()
+    with pytest.raises(ValueError):
+        ensemble.get_displayed_member()
+
+
+def test_batched_kernel_matches_standalone_kernels():
+    pytest.importorskip("numba")
+    import kernels
+
+    members = _make_blob_sims([4, 5, 6])
+    standalone = _make_blob_sims([4, 5, 6])
+    for simulation in members + standalone:
+        assert kernels.use_jit(simulation)
+    ensemble = sim.ParticleSimulatorEnsemble(members)
+
+    for _ in range(3):
+        ensemble.do_simulation()
+        for simulation in standalone:
+            simulation.do_simulation()
+
+    for member, simulation in zip(members, standalone):
+        assert _blob_values(member) == _blob_values(simulation)
+
+
+def test_batched_kernel_keeps_the_members_layers_stacked(monkeypatch):
+    numpy = pytest.importorskip("numpy")
+    pytest.importorskip("numba")
+    import kernels
+
+    members = _make_blob_sims([4, 5, 6])
+    for simulation in members:
+        assert kernels.use_jit(simulation)
+    ensemble = sim.ParticleSimulatorEnsemble(members)
+    ensemble.do_simulation()
+
+    n_stacked = []
+    stack = numpy.stack
+    monkeypatch.setattr(numpy, "stack", lambda *args, **kwargs: n_stacked.append(1) or stack(*args, **kwargs))
+    for _ in range(2):
+        ensemble.do_simulation()
+
+    assert len(n_stacked) == 0
+    for key in (blobs.BlobSimulator.BLOB_LAYER, blobs.BlobSimulator.SCENT_LAYER):
+        assert kernels._stack_of([m.get_layer(key) for m in members]) is not None
+
+
+def test_failed_step_leaves_the_timesteps_as_they_were():
+    members = _make_blob_sims([1, 2])
+    ensemble = sim.ParticleSimulatorEnsemble(members)
+    ensemble.set_parallel(False)
+    ensemble.do_simulation()
+
+    def fail(t):
+        raise RuntimeError("boom")
+    members[1].pre_update = fail
+
+    with pytest.raises(RuntimeError, match="boom"):
+        ensemble.do_simulation()
+    assert ensemble.get_timestep() == 1
+    assert [m.get_timestep() for m in members] == [1, 1]
+    assert not ensemble.is_simulating()
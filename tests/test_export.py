@@ -0,0 +1,45 @@
+import pytest
+
+import export
+import inkblot
+
+
+def _make_sim(symmetric=False):
+    w = 8 if symmetric else 16
+    res = inkblot.InkblotSimulator(w, 12, symmetric=symmetric,
+                                   flat_wet_ink_func=inkblot.get_flat_droplet_func((8, 6), 4, 2), rand_seed=1)
+    res.set_parallel(False)
+    res.do_simulation()
+    return res
+
+
+def test_upsampling_keeps_flat_fields_flat_and_samples_in_place():
+    _, _, res = export.upsample([2.0] * 12, 4, 3, 3)
+    assert res == pytest.approx([2.0] * 108)
+
+    vals = [float(i % 5) for i in range(20)]
+    new_w, new_h, res = export.upsample(vals, 5, 4, 1)
+    assert (new_w, new_h) == (5, 4)
+    assert res == pytest.approx(vals)
+
+
+def test_contours_enclose_a_square():
+    vals = [1.0 if 2 <= x <= 4 and 2 <= y <= 4 else 0.0 for x in range(7) for y in range(7)]
+    contours = export.get_contours(vals, 7, 7, 0.5)
+    assert len(contours) == 1
+    xs = [p[0] for p in contours[0]]
+    ys = [p[1] for p in contours[0]]
+    assert (min(xs), max(xs), min(ys), max(ys)) == pytest.approx((1.5, 4.5, 1.5, 4.5))
+
+
+def test_symmetric_simulations_export_at_full_size():
+    w, h, ink_vals, _ = export.get_ink_fields(_make_sim(symmetric=True))
+    assert (w, h) == (16, 12)
+    assert ink_vals[0:12] == ink_vals[-12:]  # the first column mirrors the last
+
+
+def test_export_writes_png_and_svg(tmp_path):
+    export.export(_make_sim(), tmp_path, scale=2)
+    assert (tmp_path / "inkblot.png").read_bytes().startswith(b"\x89PNG")
+    svg = (tmp_path / "inkblot.svg").read_text()
+    assert svg.startswith("<svg") and "<path" in svg
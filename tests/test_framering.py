@@ -0,0 +1,58 @@
+import pytest
+
+import framering
+
+
+@pytest.fixture
+def ring():
+    res = framering.FrameRing.create((4, 3), n_slots=2)
+    yield res
+    res.close()
+
+
+def _rgb(val):
+    return bytes([val]) * (4 * 3 * 3)
+
+
+def test_readers_get_the_latest_frame(ring):
+    reader = framering.FrameRing.attach(ring.get_name())
+    try:
+        assert reader.read_latest() is None
+        for t in range(1, 4):  # laps the 2 slots
+            ring.publish((4, 3), t, _rgb(t))
+
+        frame = reader.read_latest()
+        assert (frame.number, frame.timestep, frame.size, frame.rgb) == (3, 3, (4, 3), _rgb(3))
+        assert reader.read_latest(after=3) is None
+        assert not reader.is_done()
+
+        ring.set_done()
+        assert reader.wait_for_frame(after=3, timeout=1) is None
+        assert reader.is_done()
+    finally:
+        reader.close()
+
+
+def test_publish_rejects_frames_that_dont_fit(ring):
+    with pytest.raises(ValueError):
+        ring.publish((5, 3), 1, bytes(5 * 3 * 3))
+    with pytest.raises(ValueError):
+        ring.publish((4, 3), 1, bytes(10))
+    with pytest.raises(ValueError):
+        framering.FrameRing.create((4, 3), n_slots=1)
+
+
+def _make_sim():
+    import conway
+    res = conway.ConwaySimulator(4, 3, rand_seed=1)
+    res.set_parallel(False)
+    return res
+
+
+def test_simulation_process_publishes_frames():
+    sim_process = framering.SimulationProcess(_make_sim, (4, 3)).start()
+    try:
+        frame = sim_process.ring.wait_for_frame(timeout=60)
+        assert frame is not None and frame.size == (4, 3)
+    finally:
+        sim_process.stop()
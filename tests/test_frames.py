@@ -0,0 +1,72 @@
+import pytest
+
+import conway
+
+
+def _make_sim():
+    res = conway.ConwaySimulator(12, 10, initial_spawn_rate=0.4, rand_seed=3)
+    res.set_parallel(False)
+    return res
+
+
+def test_run_yields_a_frame_per_step():
+    simulation = _make_sim()
+    timesteps = [frame.timestep for frame in simulation.run(max_steps=3)]
+    assert timesteps == [1, 2, 3]
+
+
+def test_copy_keeps_its_pixels_after_the_simulation_moves_on():
+    simulation = _make_sim()
+    frame = simulation.get_frame()
+    frame_copy = frame.copy()  # not rendered yet
+    expected = frame.get_rgb()
+
+    simulation.do_simulation()
+    assert simulation.get_frame().get_rgb() != expected
+    assert frame.is_stale()
+    assert not frame_copy.is_stale()
+    assert frame_copy.get_rgb() == expected
+
+
+def test_rendering_a_stale_frame_raises():
+    simulation = _make_sim()
+    frame = simulation.get_frame()
+    simulation.do_simulation()
+    with pytest.raises(ValueError):
+        frame.get_rgb()
+
+
+def test_published_frame_never_goes_stale():
+    simulation = _make_sim()
+    simulation.do_simulation()
+    published = simulation.get_published_frame()
+    expected = simulation.get_frame().get_rgb()
+
+    simulation.do_simulation()
+    assert published.timestep == 1
+    assert published.get_rgb() == expected
+    assert simulation.get_published_frame().timestep == 2
+
+
+class _RecoloringSimulator(conway.ConwaySimulator):
+    """changes how it renders in post_update"""
+
+    def __init__(self):
+        conway.ConwaySimulator.__init__(self, 6, 6, rand_seed=3)
+        self.set_parallel(False)
+        self.color = (0, 0, 0)
+
+    def post_update(self, t):
+        self.color = (t, t, t)
+
+    def get_color_for_render(self, xy):
+        return self.color
+
+
+def test_published_frame_sees_what_post_update_changed():
+    simulation = _RecoloringSimulator()
+    for t in range(1, 3):
+        simulation.do_simulation()
+        frame = simulation.get_published_frame()
+        assert frame.timestep == t
+        assert frame.get_rgb() == bytes([t, t, t]) * 36
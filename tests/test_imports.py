@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _check_not_imported(code, modules):
+    # in a fresh interpreter, since other tests may have imported them
+    code += "; import sys; sys.exit(1 if any(m in sys.modules for m in {!r}) else 0)".format(modules)
+    subprocess.run([sys.executable, "-c", code], cwd=_REPO_DIR, check=True)
+
+
+def test_simulation_modules_import_without_a_display():
+    _check_not_imported("import rorschach, pipeline, server, search, export, history, framering, worker",
+                        ["pygame", "visualizer"])
+
+
+def test_pipelines_without_jit_dont_load_the_kernels():
+    _check_not_imported("import rorschach; rorschach.get_pipeline(blob_size=(6, 4), scale=1)",
+                        ["kernels", "numba", "numpy"])
@@ -0,0 +1,82 @@
+import pytest
+
+import inkblot
+
+
+def _make_sim(w, h):
+    res = inkblot.InkblotSimulator(w, h, flat_wet_ink_func=inkblot.get_flat_droplet_func((w // 2, h // 2), w // 4, 4),
+                                   rand_seed=3)
+    res.set_parallel(False)
+    return res
+
+
+def _run_until_done(simulation):
+    """:return: how many cells were updated, over all the steps"""
+    n_steps = 0
+    while not simulation.is_done():
+        simulation.do_simulation()
+        n_steps += 1
+    return n_steps * simulation.w * simulation.h
+
+
+def test_flow_is_only_tracked_when_asked_for():
+    simulation = _make_sim(12, 8)
+    simulation.do_simulation()
+    assert simulation.get_layer(inkblot.INK_FLOWED) is None
+    with pytest.raises(ValueError):
+        simulation.get_flow_pcnt()
+
+    simulation = _make_sim(12, 8)
+    simulation.done_at_flow_pcnt = 0.01
+    simulation.do_simulation()
+    assert 0 < simulation.get_flow_pcnt() <= 1
+    assert simulation.get_reduction(inkblot.TOTAL_INK_FLOWED) == pytest.approx(
+        sum(simulation.get_layer(inkblot.INK_FLOWED).get_flat_values()))
+
+
+def test_prolonged_simulation_has_fresh_reductions():
+    coarse_sim = _make_sim(12, 8)
+    for _ in range(3):
+        coarse_sim.do_simulation()
+
+    fine_sim = inkblot.prolong(coarse_sim, 24, 16)
+    assert fine_sim.get_reduction(inkblot.TOTAL_DRIED_INK) == pytest.approx(
+        sum(fine_sim.get_layer(inkblot.DRIED_INK).get_flat_values()))
+    assert not fine_sim.is_done()
+
+
+def test_coarse_to_fine_updates_fewer_cells_for_about_the_same_inkblot():
+    direct_sim = _make_sim(24, 16)
+    direct_cost = _run_until_done(direct_sim)
+
+    coarse_sim = _make_sim(12, 8)
+    coarse_sim.done_at_flow_pcnt = 0.025
+    coarse_cost = _run_until_done(coarse_sim)
+    fine_sim = inkblot.prolong(coarse_sim, 24, 16)
+    fine_cost = _run_until_done(fine_sim)
+
+    assert coarse_sim.get_timestep() > 0
+    assert coarse_cost + fine_cost < direct_cost
+    assert fine_sim.get_reduction(inkblot.TOTAL_DRIED_INK) == pytest.approx(
+        direct_sim.get_reduction(inkblot.TOTAL_DRIED_INK), rel=0.05)
+
+
+def test_symmetric_simulation_renders_an_exact_mirror_and_keeps_its_ink():
+    simulation = inkblot.InkblotSimulator(12, 10, symmetric=True, rand_seed=1,
+                                          flat_wet_ink_func=inkblot.get_flat_droplet_func((11.5, 5), 4, 3))
+    simulation.set_parallel(False)
+    total_ink = sum(simulation.get_layer(inkblot.INK).get_flat_values())
+    assert simulation.get_size() == (24, 10)
+
+    for _ in range(8):
+        simulation.do_simulation()
+
+        # no ink is lost over (or gained from) the mirror axis
+        assert (sum(simulation.get_layer(inkblot.INK).get_flat_values()) +
+                sum(simulation.get_layer(inkblot.DRIED_INK).get_flat_values())) == pytest.approx(total_ink)
+
+        rgb = simulation.get_published_frame().get_rgb()
+        for y in range(0, 10):
+            for x in range(0, 12):
+                left, right = (y * 24 + x) * 3, (y * 24 + 23 - x) * 3
+                assert rgb[left:left + 3] == rgb[right:right + 3]
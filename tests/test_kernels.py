@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+pytest.importorskip("numba")
+
+import conway
+import inkblot
+import kernels
+
+
+def _make_pair(make_sim, seed):
+    random.seed(seed)
+    python_sim = make_sim()
+    python_sim.set_parallel(False)
+    random.seed(seed)
+    jit_sim = make_sim()
+    assert kernels.use_jit(jit_sim)
+    return python_sim, jit_sim
+
+
+def test_conway_kernel_step_matches_python_step():
+    python_sim, jit_sim = _make_pair(lambda: conway.ConwaySimulator(24, 16, initial_spawn_rate=0.3), 3)
+    for _ in range(3):
+        python_sim.do_simulation()
+        jit_sim.do_simulation()
+        assert (jit_sim.get_layer(conway.ConwaySimulator.BLOB_LAYER).get_flat_values() ==
+                python_sim.get_layer(conway.ConwaySimulator.BLOB_LAYER).get_flat_values())
+
+
+def test_inkblot_kernel_step_matches_python_step():
+    def make_sim():
+        res = inkblot.InkblotSimulator(20, 14, flat_wet_ink_func=inkblot.get_flat_droplet_func((10, 7), 5, 4))
+        res.pcnt_to_dry_inc_per_step = 0  # so drying doesn't draw random numbers
+        return res
+
+    python_sim, jit_sim = _make_pair(make_sim, 5)
+    python_sim.do_simulation()
+    jit_sim.do_simulation()
+    for key in (inkblot.INK, inkblot.DRIED_INK):
+        assert (jit_sim.get_layer(key).get_flat_values() ==
+                pytest.approx(python_sim.get_layer(key).get_flat_values()))
+    assert jit_sim.get_reduction(inkblot.TOTAL_WET_INK) == pytest.approx(
+        python_sim.get_reduction(inkblot.TOTAL_WET_INK))
+
+
+def test_layers_stay_arrays_across_steps():
+    jit_sim = _make_pair(lambda: conway.ConwaySimulator(16, 16), 1)[1]
+    for _ in range(2):
+        jit_sim.do_simulation()
+        layer = jit_sim.get_layer(conway.ConwaySimulator.BLOB_LAYER)
+        assert isinstance(layer, kernels._ArrayLayer)
+        assert layer.array.dtype == "int64"
+
+
+def test_inkblot_kernel_tracks_flow_only_when_asked_to():
+    def make_sim():
+        res = inkblot.InkblotSimulator(20, 14, flat_wet_ink_func=inkblot.get_flat_droplet_func((10, 7), 5, 4))
+        res.pcnt_to_dry_inc_per_step = 0
+        res.done_at_flow_pcnt = 0.001
+        return res
+
+    python_sim, jit_sim = _make_pair(make_sim, 5)
+    python_sim.do_simulation()
+    jit_sim.do_simulation()
+    assert jit_sim.get_flow_pcnt() == pytest.approx(python_sim.get_flow_pcnt())
+
+    untracked_sim = _make_pair(lambda: inkblot.InkblotSimulator(8, 8), 1)[1]
+    untracked_sim.do_simulation()
+    assert untracked_sim.get_layer(inkblot.INK_FLOWED) is None
@@ -0,0 +1,76 @@
+import pytest
+
+import conway
+import sim
+
+
+class _ScratchSimulator(sim.ParticleSimulator):
+    """counts up in a dynamic layer, and records each step's timestep in a scratch one"""
+
+    def __init__(self):
+        sim.ParticleSimulator.__init__(self, 4, 3, rand_seed=1)
+        self.set_parallel(False)
+        self.add_layer("count")
+        self.add_layer("scratch", is_scratch=True)
+
+    def update_layers(self, xy, t, write_buffers):
+        write_buffers["count"].add_value(xy, 1)
+        write_buffers["scratch"].set_value_not_threadsafe(xy, t)
+
+    def get_color_for_render(self, xy):
+        return (0, 0, 0)
+
+
+def test_scratch_layers_are_written_in_place_and_left_out_of_frames():
+    simulation = _ScratchSimulator()
+    scratch_layer = simulation.get_layer("scratch")
+    for _ in range(2):
+        simulation.do_simulation()
+
+    assert simulation.get_layer("scratch") is scratch_layer
+    assert scratch_layer.get_flat_values() == [2] * 12
+    assert simulation.get_layer("count").get_flat_values() == [2] * 12
+    assert simulation.get_frame().get_layer_keys() == ["count"]
+
+
+def test_flat_initializers_are_column_major():
+    simulation = _ScratchSimulator()
+    simulation.add_layer("flat", flat_initializer_funct=lambda w, h: list(range(w * h)))
+    simulation.add_layer("per_cell", initializer_funct=lambda xy: xy[0] * 3 + xy[1])
+    assert simulation.get_layer("flat").get_flat_values() == simulation.get_layer("per_cell").get_flat_values()
+    assert simulation.get_value("flat", (1, 2)) == 5
+
+    with pytest.raises(ValueError):
+        simulation.add_layer("both", initializer_funct=lambda xy: 0, flat_initializer_funct=lambda w, h: [0] * w * h)
+
+
+def test_skipping_initializers():
+    with sim.skipping_initializers():
+        simulation = conway.ConwaySimulator(6, 6, initial_spawn_rate=1.0, rand_seed=1)
+    assert sum(simulation.get_layer(conway.ConwaySimulator.BLOB_LAYER).get_flat_values()) == 0
+
+
+def test_adopted_layers_move_without_copying():
+    first_sim = _ScratchSimulator()
+    first_sim.do_simulation()
+    layer = first_sim.get_layer("count")
+
+    second_sim = _ScratchSimulator()
+    second_sim.adopt_layer("count", first_sim)
+    assert second_sim.get_layer("count") is layer
+    assert first_sim.get_layer("count") is None
+
+    second_sim.do_simulation()
+    assert second_sim.get_layer("count").get_flat_values() == [2] * 12
+    assert layer.get_flat_values() == [1] * 12  # steps write to copies
+
+
+def test_shared_layers_stay_in_both_but_scratch_ones_cant_be_shared():
+    first_sim, second_sim = _ScratchSimulator(), _ScratchSimulator()
+    second_sim.adopt_layer("count", first_sim, share=True)
+    assert second_sim.get_layer("count") is first_sim.get_layer("count")
+
+    with pytest.raises(ValueError):
+        second_sim.adopt_layer("scratch", first_sim, share=True)
+    with pytest.raises(ValueError):
+        second_sim.adopt_layer("count", conway.ConwaySimulator(5, 5), other_key=conway.ConwaySimulator.BLOB_LAYER)
@@ -0,0 +1,54 @@
+import sys
+
+import pytest
+
+import conway
+import sim
+
+
+def _exact_memory_size(layer):
+    res = sys.getsizeof(layer._array)
+    seen_ids = set()
+    for col in layer._array:
+        res += sys.getsizeof(col)
+        for val in col:
+            if id(val) not in seen_ids:
+                seen_ids.add(id(val))
+                res += sys.getsizeof(val)
+    return res
+
+
+def test_layer_memory_size_is_close_to_exact():
+    layer = sim._ParticleLayer(64, 48)
+    layer.set_flat_values_not_threadsafe([float(i) for i in range(64 * 48)])
+    assert layer.get_memory_size() == pytest.approx(_exact_memory_size(layer), rel=0.05)
+
+
+def test_memory_report_counts_published_frames():
+    simulation = conway.ConwaySimulator(16, 12, rand_seed=1)
+    simulation.set_parallel(False)
+    simulation.do_simulation()
+
+    report = simulation.get_memory_report()
+    assert report["published_frame_bytes"] == 0
+    assert report["kernel_bytes"] == 0
+    assert report["estimated_peak_bytes"] == report["resident_bytes"] + report["write_buffer_bytes"]
+
+    simulation.get_published_frame().get_rgb()
+    report = simulation.get_memory_report()
+    assert report["published_frame_bytes"] == 16 * 12 * 3
+    assert report["estimated_peak_bytes"] == (report["resident_bytes"] + report["write_buffer_bytes"] +
+                                              16 * 12 * 3)
+
+
+def test_memory_report_counts_kernel_buffers():
+    pytest.importorskip("numba")
+    import blobs
+    import kernels
+
+    simulation = blobs.BlobSimulator(16, 12, rand_seed=1)
+    kernels.use_jit(simulation)
+    simulation.do_simulation()
+    report = simulation.get_memory_report()
+    assert report["kernel_bytes"] >= 2 * 16 * 12 * 2 * 8
+    assert report["estimated_peak_bytes"] >= report["resident_bytes"] + report["kernel_bytes"]
@@ -0,0 +1,153 @@
+import pickle
+import random
+
+import conway
+import history
+import pipeline
+
+
+def _make_conway_sim(prev_sim=None, seed=1):
+    res = conway.ConwaySimulator(8, 8, rand_seed=seed)
+    res.set_parallel(False)
+    return res
+
+
+def test_active_simulator_unwraps_nested_pipelines():
+    first_sim = _make_conway_sim()
+    inner_sims = []
+
+    def make_branch(prev_sim):
+        inner_sims.append(_make_conway_sim(seed=2))
+        res = pipeline.SimulationPipeline(inner_sims[-1], n_steps=5)
+        res.add_simulation(_make_conway_sim)
+        return res
+
+    pipe = pipeline.SimulationPipeline(first_sim, n_steps=2)
+    pipe.add_branches([make_branch])
+    assert pipe.get_active_simulator() is first_sim
+    assert first_sim.get_active_simulator() is first_sim
+
+    for _ in range(3):
+        pipe.do_simulation()
+    assert pipe.get_active_simulator() is inner_sims[0]
+
+
+def test_history_records_the_active_stage():
+    pipe = pipeline.SimulationPipeline(_make_conway_sim(), n_steps=2)
+    pipe.add_simulation(lambda prev_sim: _make_conway_sim(seed=3))
+    run_history = history.RunHistory(pipe)
+
+    for _ in range(4):
+        pipe.do_simulation()
+        run_history.record()
+
+    assert run_history.get_simulator_at(4).get_size() == (8, 8)
+    assert (run_history.get_layers(4)[conway.ConwaySimulator.BLOB_LAYER] ==
+            [float(v) for v in pipe.get_active_simulator().get_layer(
+                conway.ConwaySimulator.BLOB_LAYER).get_flat_values()])
+
+
+def test_history_keeps_stages_that_handed_their_layers_on():
+    def take_over(prev_sim):
+        res = _make_conway_sim(seed=3)
+        res.adopt_layer(conway.ConwaySimulator.BLOB_LAYER, prev_sim)
+        return res
+
+    first_sim = _make_conway_sim()
+    pipe = pipeline.SimulationPipeline(first_sim, n_steps=2)
+    pipe.add_simulation(take_over)
+    run_history = history.RunHistory(pipe)
+    run_history.record()
+    recorded = [float(v) for v in first_sim.get_layer(conway.ConwaySimulator.BLOB_LAYER).get_flat_values()]
+    for _ in range(3):
+        pipe.do_simulation()
+        run_history.record()
+
+    assert first_sim.get_layer(conway.ConwaySimulator.BLOB_LAYER) is None  # handed on to the second stage
+    old_sim = run_history.get_simulator_at(0)
+    assert old_sim.get_layer(conway.ConwaySimulator.BLOB_LAYER).get_flat_values() == recorded
+    assert len(run_history.render(0)) == 8 * 8 * 3
+
+
+def test_nested_variant_branches_each_reach_their_fine_stage():
+    import inkblot
+    import rorschach
+
+    random.seed(5)
+    pipe = rorschach.get_pipeline(blob_size=(12, 10), scale=2, variants=[{}, {"ink_height": 1.3}], coarse_scale=1,
+                                  coarse_steps=2, n_workers=2)
+    while len(pipe.get_branches()) == 0:
+        pipe.do_simulation()
+
+    branches = pipe.get_branches()
+    assert len(branches) == 2
+    assert all(isinstance(b, pipeline.SimulationPipeline) for b in branches)
+    assert pipe._branch_executor is not None  # the branches could be sent to worker processes
+    coarse_sims = [b.get_active_simulator() for b in branches]
+    assert all(s.get_size() == (12, 10) for s in coarse_sims)
+
+    for _ in range(3):
+        pipe.do_simulation()
+    fine_sims = [b.get_active_simulator() for b in pipe.get_branches()]
+    for coarse_sim, fine_sim in zip(coarse_sims, fine_sims):
+        assert isinstance(fine_sim, inkblot.InkblotSimulator)
+        assert fine_sim is not coarse_sim
+        assert fine_sim.get_size() == (24, 20)
+
+    pipe.set_display_branch(1)
+    assert pipe.get_active_simulator() is fine_sims[1]
+
+
+def _make_branch_pipeline(prev_sim, seed):
+    res = pipeline.SimulationPipeline(_make_conway_sim(seed=seed), n_steps=2)
+    res.add_simulation(_make_conway_sim)
+    return res
+
+
+def _run_branches(n_workers, n_steps):
+    pipe = pipeline.SimulationPipeline(_make_conway_sim(), n_steps=1)
+    pipe.add_branches([lambda prev_sim, seed=seed: _make_branch_pipeline(prev_sim, seed) for seed in (2, 3)],
+                      n_workers=n_workers)
+    for _ in range(n_steps):
+        pipe.do_simulation()
+    return pipe
+
+
+def test_branches_in_processes_match_branches_run_in_turn():
+    pipe_in_turn, pipe_in_processes = _run_branches(1, 4), _run_branches(2, 4)
+    assert pipe_in_turn._branch_executor is None and pipe_in_processes._branch_executor is not None
+
+    for b_in_turn, b_in_processes in zip(pipe_in_turn.get_branches(), pipe_in_processes.get_branches()):
+        assert b_in_processes.get_timestep() == b_in_turn.get_timestep() == 3
+        assert (b_in_processes.get_active_simulator().get_layer(conway.ConwaySimulator.BLOB_LAYER).get_flat_values() ==
+                b_in_turn.get_active_simulator().get_layer(conway.ConwaySimulator.BLOB_LAYER).get_flat_values())
+    assert pipe_in_processes.get_published_frame().timestep == 4
+
+    progress = []
+    pipe_in_processes.add_progress_listener(lambda s, pcnt: progress.append(pcnt))
+    pipe_in_processes.do_simulation()
+    assert len(progress) > 0
+
+
+def test_unpicklable_branches_run_in_turn():
+    def make_unpicklable_branch(prev_sim):
+        res = pipeline.SimulationPipeline(_make_conway_sim(seed=3), n_steps=2)
+        res.add_simulation(lambda prev_sim: _make_conway_sim())
+        return res
+
+    pipe = pipeline.SimulationPipeline(_make_conway_sim(), n_steps=1)
+    pipe.add_branches([lambda prev_sim: _make_branch_pipeline(prev_sim, 2), make_unpicklable_branch], n_workers=2)
+    for _ in range(2):
+        pipe.do_simulation()
+    assert pipe._branch_executor is None
+    assert [b.get_timestep() for b in pipe.get_branches()] == [1, 1]
+
+
+def test_branch_pipelines_can_be_pickled():
+    branch = _make_branch_pipeline(None, 2)
+    branch.do_simulation()
+    copied = pickle.loads(pickle.dumps(branch))
+    assert copied.get_timestep() == 1
+    copied.do_simulation()
+    copied.do_simulation()
+    assert copied.get_timestep() == 3
@@ -0,0 +1,77 @@
+import struct
+import zlib
+
+import pytest
+
+import pngfile
+
+
+def _read_png(data):
+    """:return: (color type, the raw scanlines)"""
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    color_type = None
+    idat = b""
+    pos = 8
+    while pos < len(data):
+        length, tag = struct.unpack(">I4s", data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        if tag == b"IHDR":
+            color_type = body[9]
+        elif tag == b"IDAT":
+            idat += body
+        pos += 12 + length
+    return color_type, zlib.decompress(idat)
+
+
+def _colorful_rgb(n_colors):
+    return b"".join(bytes([i % 256, i // 256, 7]) for i in range(n_colors))
+
+
+def test_palette_image_with_few_colors(tmp_path):
+    filepath = tmp_path / "few.png"
+    assert pngfile.write_palette(filepath, 4, 2, _colorful_rgb(4) * 2)
+    color_type, scanlines = _read_png(filepath.read_bytes())
+    assert color_type == 3
+    assert scanlines == b"\x00" + bytes([0, 1, 2, 3]) + b"\x00" + bytes([0, 1, 2, 3])
+
+
+def test_palette_falls_back_to_rgb_with_too_many_colors(tmp_path):
+    filepath = tmp_path / "many.png"
+    rgb = _colorful_rgb(300)
+    assert not pngfile.write_palette(filepath, 300, 1, rgb)
+    color_type, scanlines = _read_png(filepath.read_bytes())
+    assert color_type == 2
+    assert scanlines == b"\x00" + rgb
+
+
+def test_encode_palette_still_rejects_too_many_colors():
+    with pytest.raises(ValueError):
+        pngfile.encode_palette(300, 1, _colorful_rgb(300))
+
+
+def test_recording_palette_frames_keeps_going_past_colorful_ones(tmp_path):
+    import framering
+
+    ring = framering.FrameRing.create((300, 1))
+    try:
+        ring.publish((300, 1), 1, _colorful_rgb(300))
+        ring.set_done()
+        framering.record_frames(ring.get_name(), tmp_path, output_format="palette")
+    finally:
+        ring.close()
+
+    color_type, _ = _read_png((tmp_path / "output_0001.png").read_bytes())
+    assert color_type == 2
+
+
+def test_palette_spans_blocks_in_order_of_first_appearance():
+    colors = [bytes([i, 255 - i, i // 2]) for i in range(0, 256)]
+    n_pixels = pngfile._PALETTE_BLOCK_SIZE * 3 + 5
+    pixel_colors = [(i * 7 // pngfile._PALETTE_BLOCK_SIZE + i) % 256 for i in range(0, n_pixels)]
+
+    palette, indices = pngfile._to_palette(b"".join(colors[c] for c in pixel_colors))
+    first_seen = list(dict.fromkeys(pixel_colors))
+    assert palette == [colors[c] for c in first_seen]
+    assert list(indices) == [first_seen.index(c) for c in pixel_colors]
+
+    assert pngfile._to_palette(b"".join(colors[c] for c in pixel_colors) + b"\x01\x02\x03") is None
@@ -0,0 +1,55 @@
+import pytest
+
+import blobs
+import conway
+import inkblot
+import sim
+
+
+def _make_inkblot_sim(parallel):
+    res = inkblot.InkblotSimulator(20, 14, flat_wet_ink_func=inkblot.get_flat_droplet_func((10, 7), 5, 4),
+                                   rand_seed=2)
+    res.pcnt_to_dry_inc_per_step = 0  # so drying doesn't draw random numbers
+    res.set_parallel(parallel)
+    return res
+
+
+def test_reductions_of_scratch_layers_merge_chunk_partials():
+    serial_sim, parallel_sim = _make_inkblot_sim(False), _make_inkblot_sim(True)
+    for _ in range(3):
+        serial_sim.do_simulation()
+        parallel_sim.do_simulation()
+        for s in (serial_sim, parallel_sim):
+            assert s.get_reduction(inkblot.TOTAL_WET_INK) == pytest.approx(
+                sum(s.get_layer(inkblot.WET_INK_KEPT).get_flat_values()))
+        assert parallel_sim.get_reduction(inkblot.TOTAL_WET_INK) == pytest.approx(
+            serial_sim.get_reduction(inkblot.TOTAL_WET_INK))
+
+
+def test_reductions_of_dynamic_layers_merge_chunk_partials(monkeypatch):
+    simulation = conway.ConwaySimulator(24, 20, rand_seed=4)
+    simulation.set_parallel(True)
+    simulation.add_reduction("alive", conway.ConwaySimulator.BLOB_LAYER, "count_nonzero")
+
+    reduced_rects = []
+    reduce = sim._ParticleLayer.reduce
+    monkeypatch.setattr(sim._ParticleLayer, "reduce",
+                        lambda layer, kind, rect=None: reduced_rects.append(rect) or reduce(layer, kind, rect))
+
+    for _ in range(3):
+        simulation.do_simulation()
+    assert len(reduced_rects) > 0 and None not in reduced_rects  # only ever each chunk's cells
+
+    del reduced_rects[:]
+    alive = simulation.get_reduction("alive")
+    assert len(reduced_rects) == 0
+    assert alive == len([v for v in simulation.get_layer(conway.ConwaySimulator.BLOB_LAYER).get_flat_values()
+                         if v != 0])
+
+
+def test_reductions_of_layers_written_at_other_cells_see_every_write():
+    simulation = blobs.BlobSimulator(24, 20, intial_spawn_rate=0.5, rand_seed=7)
+    simulation.set_parallel(True)
+    for _ in range(4):
+        simulation.do_simulation()
+        assert simulation.count_blobs() == sum(simulation.get_layer(blobs.BlobSimulator.BLOB_LAYER).get_flat_values())
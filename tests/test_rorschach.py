@@ -0,0 +1,52 @@
+import random
+
+import rorschach
+import sim
+
+
+def _make_layer(w, h, seed):
+    rand = random.Random(seed)
+    res = sim._ParticleLayer(w, h)
+    res.set_flat_values_not_threadsafe([rand.choice((0, 0, 1, 2)) for _ in range(w * h)])
+    return res
+
+
+def test_indexed_transfer_matches_per_cell_transfer():
+    blob_layer = _make_layer(10, 8, 1)
+    rects = [((20, -3), (4, 17), (0, 0), (10, 8)), ((6, -3), (22, 17), (0, 0), (10, 8))]
+
+    expected = sim._ParticleLayer(24, 14)
+    for rect in rects:
+        map_func = rorschach.get_rect_mapping_function(*rect, swap_x_and_y=True)
+        rorschach.xfer_layer_to_layer(blob_layer, expected, map_func,
+                                      value_xform=lambda blob_val, ink_val: ink_val + (1.5 if blob_val > 0 else 0))
+
+    actual = sim._ParticleLayer(24, 14)
+    index_maps = [rorschach.get_rect_index_map((10, 8), (24, 14), *rect, swap_x_and_y=True) for rect in rects]
+    rorschach.xfer_layer_to_layer_indexed(blob_layer, actual, index_maps,
+                                          l1_value_xform=lambda blob_val: 1.5 if blob_val > 0 else 0)
+
+    assert actual.get_flat_values() == expected.get_flat_values()
+    assert sum(actual.get_flat_values()) > 0
+
+
+def test_index_maps_are_cached():
+    args = ((10, 8), (24, 14), (0, 0), (24, 14), (0, 0), (10, 8))
+    assert rorschach.get_rect_index_map(*args) is rorschach.get_rect_index_map(*args)
+
+
+def test_symmetric_mapper_simulates_half_of_the_full_size():
+    random.seed(2)
+    blob_sim = rorschach.get_blob_sim(12, 10, 100)
+    full_sim = rorschach.get_blob_to_inkblot_mapper(blob_sim, scale=2, ink_height=1.0, x_overlap_pcnt=0.1)
+    half_sim = rorschach.get_blob_to_inkblot_mapper(blob_sim, scale=2, symmetric=True, ink_height=1.0,
+                                                    x_overlap_pcnt=0.1)
+    assert half_sim.get_size() == full_sim.get_size() == (24, 20)
+    assert half_sim.w == 12
+
+
+def test_index_map_cache_is_bounded():
+    for x_offs in range(0, 3 * rorschach._INDEX_MAP_CACHE_SIZE):
+        rorschach.get_rect_index_map((10, 8), (24, 14), (20 + x_offs, -3), (4 + x_offs, 17), (0, 0), (10, 8),
+                                     swap_x_and_y=True)
+    assert rorschach._get_rect_index_map.cache_info().currsize <= rorschach._INDEX_MAP_CACHE_SIZE
@@ -0,0 +1,36 @@
+import random
+
+import pytest
+
+import search
+
+
+def _make_candidate(seed=11):
+    return search.Candidate(0, 0.3, 1.0, 0.1, seed)
+
+
+def test_advancing_a_candidate_is_repeatable():
+    a = search._advance(_make_candidate(), 12, (10, 8), 1)
+    b = search._advance(_make_candidate(), 12, (10, 8), 1)
+    assert a.steps_taken == b.steps_taken == 12
+    assert a.metrics == b.metrics
+
+
+def test_advancing_past_the_blob_stage_switches_to_the_inkblot():
+    candidate = search._advance(_make_candidate(), search.BLOB_STAGE_STEPS + 2, (10, 8), 1)
+    assert "coverage" in candidate.metrics
+    assert candidate.simulation.get_size() == (10, 8)
+
+
+def test_search_culls_candidates_at_each_checkpoint():
+    random.seed(4)
+    res = search.search(n_candidates=4, checkpoints=(5, 10), keep_pcnt=0.5, blob_size=(10, 8), scale=1, n_workers=1)
+    assert len(res) == 2
+    assert all(c.steps_taken == 10 for c in res)
+    assert res[0].score >= res[1].score
+
+
+def test_search_rejects_bad_arguments():
+    for kwargs in ({"n_candidates": 0}, {"n_candidates": -2}, {"keep_pcnt": 1}, {"keep_pcnt": 0}, {"keep_pcnt": 1.5}):
+        with pytest.raises(ValueError):
+            search.search(blob_size=(10, 8), scale=1, n_workers=1, **kwargs)
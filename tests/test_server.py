@@ -0,0 +1,66 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import server
+
+_PROFILES = {"tiny": {"blob_size": (8, 6), "scale": 1}}
+
+
+@pytest.fixture
+def reservoir():
+    res = server.ImageReservoir(profiles=_PROFILES, capacity=1, n_workers=1)
+    res.start()
+    yield res
+    res.shutdown()
+
+
+def test_reservoir_serves_pngs_and_refills(reservoir):
+    png = reservoir.get_image("tiny", timeout=120)
+    assert png is not None and png.startswith(b"\x89PNG")
+
+    stats = reservoir.get_stats()["tiny"]
+    assert stats["requests"] == 1
+    assert stats["queue_depth"] + stats["pending"] == 1  # replacing the one that was taken
+
+    with pytest.raises(ValueError):
+        reservoir.get_image("nope")
+
+
+def test_http_endpoints(reservoir):
+    http_server = server.make_server(reservoir, port=0, wait_timeout=120)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    base_url = "http://127.0.0.1:{}".format(http_server.server_address[1])
+    try:
+        with urllib.request.urlopen(base_url + "/image?profile=tiny", timeout=120) as response:
+            assert response.headers["Content-Type"] == "image/png"
+            assert response.read().startswith(b"\x89PNG")
+
+        with urllib.request.urlopen(base_url + "/stats", timeout=10) as response:
+            assert json.loads(response.read().decode("utf-8"))["tiny"]["requests"] == 1
+
+        with pytest.raises(urllib.error.HTTPError) as e:
+            urllib.request.urlopen(base_url + "/image?profile=nope", timeout=10)
+        assert e.value.code == 404
+    finally:
+        http_server.shutdown()
+        http_server.server_close()
+
+
+def test_failing_profile_backs_off_instead_of_resubmitting():
+    res = server.ImageReservoir(profiles={"broken": {"blob_size": (8, 6)}}, capacity=1, n_workers=1)  # no scale
+    res.RETRY_DELAY = 0.1
+    res.start()
+    try:
+        time.sleep(2)
+        failures = res.get_stats()["broken"]["failures"]
+    finally:
+        res.shutdown()
+
+    # 0.1 + 0.2 + 0.4 + 0.8 seconds of waiting fit in the 2 seconds, plus the time the failures themselves take
+    assert 1 <= failures <= 5
@@ -0,0 +1,43 @@
+import random
+
+import conway
+import tiled
+
+
+def _run_conway(layer_storage, n_steps=4):
+    random.seed(7)
+    res = conway.ConwaySimulator(40, 30, initial_spawn_rate=0.4, layer_storage=layer_storage)
+    res.set_parallel(False)
+    for _ in range(n_steps):
+        res.do_simulation()
+    return res.get_layer(conway.ConwaySimulator.BLOB_LAYER).get_flat_values()
+
+
+def test_tiled_run_matches_in_memory_run():
+    expected = _run_conway(None)
+    # small tiles and a budget of a few of them, so tiles keep getting evicted and remapped
+    storage = tiled.TiledLayerStorage(tile_size=(8, 8), memory_budget=4 * 8 * 8 * 8)
+    assert _run_conway(storage) == expected
+    assert _run_conway(tiled.TiledLayerStorage(tile_size=(16, 16), threadsafe=False)) == expected
+
+
+def test_copies_share_tiles_until_written():
+    storage = tiled.TiledLayerStorage(tile_size=(4, 4))
+    layer = storage.new_layer(8, 8)
+    for x in range(0, 8):
+        for y in range(0, 8):
+            layer.set_value_not_threadsafe((x, y), x * 8 + y)
+
+    copy = layer.make_copy()
+    assert copy.get_memory_size() == 0  # nothing copied yet
+    assert copy.get_flat_values() == layer.get_flat_values()
+
+    copy.add_value((5, 1), 100)
+    assert copy.get_value((5, 1)) == 5 * 8 + 1 + 100
+    assert layer.get_value((5, 1)) == 5 * 8 + 1
+    assert len(copy._sources) == 3  # only the written tile was copied
+
+    # a copy of the copy shares tiles with whichever layer holds them
+    copy2 = copy.make_copy()
+    assert copy2.get_flat_values() == copy.get_flat_values()
+    assert copy2._sources[0] is layer
@@ -0,0 +1,59 @@
+import pytest
+
+import conway
+import framering
+import worker
+
+
+class _FailingSimulator(conway.ConwaySimulator):
+
+    def __init__(self, fail_at=2):
+        conway.ConwaySimulator.__init__(self, 6, 6, rand_seed=1)
+        self.set_parallel(False)
+        self.fail_at = fail_at
+
+    def update_layers(self, xy, t, write_buffers):
+        if t == self.fail_at:
+            raise RuntimeError("boom")
+        conway.ConwaySimulator.update_layers(self, xy, t, write_buffers)
+
+
+def _make_failing_sim():
+    return _FailingSimulator(fail_at=1)
+
+
+def test_worker_runs_queued_steps():
+    sim_worker = worker.SimulationWorker(conway.ConwaySimulator(6, 6, rand_seed=1), publish_every=2).start()
+    sim_worker.run_steps(5)
+    assert sim_worker.wait_until_idle(timeout=10)
+    assert sim_worker.simulation.get_timestep() == 5
+    assert sim_worker.get_latest_frame().timestep == 5
+    sim_worker.stop()
+
+
+def test_failed_step_is_raised_from_wait_until_idle():
+    sim_worker = worker.SimulationWorker(_FailingSimulator()).start()
+    sim_worker.run_steps(5)
+
+    with pytest.raises(RuntimeError, match="boom"):
+        sim_worker.wait_until_idle(timeout=10)
+    assert not sim_worker.is_busy()
+    assert not sim_worker.simulation.is_simulating()
+    assert sim_worker.simulation.get_timestep() == 1  # the failed step didn't count
+
+    # the worker is still usable afterwards
+    sim_worker.simulation.fail_at = -1
+    sim_worker.run_steps(1)
+    assert sim_worker.wait_until_idle(timeout=10)
+    assert sim_worker.simulation.get_timestep() == 2
+    sim_worker.stop()
+
+
+def test_failed_simulation_still_marks_the_ring_done():
+    ring = framering.FrameRing.create((6, 6))
+    try:
+        with pytest.raises(RuntimeError, match="boom"):
+            framering._run_simulation(_make_failing_sim, ring.get_name(), 1)
+        assert ring.is_done()
+    finally:
+        ring.close()
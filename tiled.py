@@ -0,0 +1,260 @@
+import array
+import collections
+import contextlib
+import mmap
+import tempfile
+import threading
+import weakref
+
+import sim
+
+
+class TiledLayerStorage:
+    """
+    Out-of-core storage for a ParticleSimulator's layers (pass it as layer_storage). Each layer lives in its own
+        temporary file, split into fixed-size tiles, and only the most recently used tiles are mapped into memory,
+        up to memory_budget bytes across all of this storage's layers. Values are stored as 64-bit floats.
+
+    Serial steps go tile by tile instead of row by row over the whole grid, so that only a tile and its neighbors
+        need to be mapped. Simulators that draw random numbers therefore draw them in a different order than with
+        in-memory layers, and a seeded run won't match the same run in memory (deterministic ones do match).
+    """
+
+    BYTES_PER_VALUE = 8
+
+    def __init__(self, tile_size=(64, 64), memory_budget=64 * 1024 * 1024, directory=None, threadsafe=True):
+        """
+        :param tile_size: (w, h) of each tile. Simulators using this storage step one tile at a time.
+        :param memory_budget: max number of bytes of tiles to keep mapped at once. At least one tile is always kept.
+        :param directory: where to put the layer files, or None for the system's temp directory.
+        :param threadsafe: whether the layers may be used from several threads at once, e.g. by a parallel step, or by
+            a display drawing while the simulation steps. If False, cell accesses skip locking.
+        """
+        self.tile_size = tile_size
+        self.directory = directory
+        self._memory_budget = memory_budget
+
+        tile_bytes = tile_size[0] * tile_size[1] * TiledLayerStorage.BYTES_PER_VALUE
+        granularity = mmap.ALLOCATIONGRANULARITY
+        self._slot_bytes = -(-tile_bytes // granularity) * granularity  # tiles must be mapped at aligned offsets
+
+        self._resident = collections.OrderedDict()  # (layer_uid, tile_idx) -> (mmap, memoryview), oldest first
+        self._layer_sizes = {}  # layer_uid -> size of its file in bytes
+        self._next_uid = 0
+        self._generation = 0  # bumped whenever tiles are unmapped, see _TiledParticleLayer._get_view
+
+        self._lock = threading.RLock() if threadsafe else contextlib.nullcontext()
+
+    def new_layer(self, w, h, default_val=0, min_val=None, max_val=None, out_of_bounds_val=0):
+        return _TiledParticleLayer(self, w, h, default_val=default_val, min_val=min_val, max_val=max_val,
+                                   out_of_bounds_val=out_of_bounds_val)
+
+    def set_memory_budget(self, n_bytes):
+        with self._lock:
+            self._memory_budget = n_bytes
+            self._evict_until_fits(0)
+
+    def get_memory_budget(self):
+        return self._memory_budget
+
+    def get_resident_size(self):
+        """:return: number of bytes of tiles currently mapped into memory"""
+        with self._lock:
+            return len(self._resident) * self._slot_bytes
+
+    def get_total_size(self):
+        """:return: number of bytes of all the (live) layers' files"""
+        with self._lock:
+            return sum(self._layer_sizes.values())
+
+    def _register_layer(self, n_bytes):
+        with self._lock:
+            uid = self._next_uid
+            self._next_uid += 1
+            self._layer_sizes[uid] = n_bytes
+            return uid
+
+    def _get_tile(self, layer, tile_idx):
+        """must be called with the lock held, and the result must not be used after releasing it"""
+        key = (layer._uid, tile_idx)
+        tile = self._resident.get(key)
+        if tile is not None:
+            self._resident.move_to_end(key)
+            return tile[1]
+
+        self._evict_until_fits(self._slot_bytes)
+        mm = mmap.mmap(layer._file.fileno(), self._slot_bytes, offset=tile_idx * self._slot_bytes)
+        view = memoryview(mm).cast("d")
+        self._resident[key] = (mm, view)
+        return view
+
+    def _evict_until_fits(self, extra_bytes):
+        while len(self._resident) > 0 and (len(self._resident) * self._slot_bytes + extra_bytes > self._memory_budget):
+            _, (mm, view) = self._resident.popitem(last=False)
+            self._generation += 1
+            view.release()
+            mm.close()
+
+    def _release_layer(self, uid):
+        with self._lock:
+            for key in [k for k in self._resident if k[0] == uid]:
+                mm, view = self._resident.pop(key)
+                self._generation += 1
+                view.release()
+                mm.close()
+            self._layer_sizes.pop(uid, None)
+
+
+class _TiledParticleLayer(sim._ParticleLayer):
+
+    def __init__(self, storage, w, h, default_val=0, min_val=None, max_val=None, out_of_bounds_val=0, _fill=True):
+        # deliberately not calling super().__init__, which would allocate the whole layer in memory
+        self.w = w
+        self.h = h
+        self._oob_val = out_of_bounds_val
+        self._default_val = default_val
+
+        self._max_val = max_val
+        self._min_val = min_val
+
+        self._storage = storage
+        self._tile_w, self._tile_h = storage.tile_size
+        self._n_tiles_y = -(-h // self._tile_h)
+        self._n_tiles = -(-w // self._tile_w) * self._n_tiles_y
+
+        self._file = tempfile.TemporaryFile(dir=storage.directory)
+        self._file_size = self._n_tiles * storage._slot_bytes
+        self._file.truncate(self._file_size)
+        self._uid = storage._register_layer(self._file_size)
+        weakref.finalize(self, storage._release_layer, self._uid)
+
+        # tile_idx -> the layer holding the tile's values, for tiles still shared with the layer this is a copy of
+        self._sources = {}
+        # (tile_idx, view, storage generation, whether the tile is this layer's own) of the last tile used
+        self._cached_tile = (-1, None, -1, False)
+
+        if _fill:
+            self.fill_not_threadsafe(default_val)
+
+    def _locate(self, xy):
+        tile_x, local_x = divmod(xy[0], self._tile_w)
+        tile_y, local_y = divmod(xy[1], self._tile_h)
+        return tile_x * self._n_tiles_y + tile_y, local_x * self._tile_h + local_y
+
+    def _get_view(self, tile_idx, writable=False):
+        """
+        must be called with the storage's lock held, and the result must not be used after releasing it
+        :param writable: whether the caller will write to the tile. Shared tiles are copied into this layer first.
+        """
+        cached_idx, view, generation, is_own = self._cached_tile
+        if cached_idx == tile_idx and generation == self._storage._generation and (is_own or not writable):
+            return view  # still mapped, so the lookup (and LRU bookkeeping) can be skipped
+
+        source = self._sources.get(tile_idx)
+        if source is not None and not writable:
+            view = source._get_view(tile_idx)
+            self._cached_tile = (tile_idx, view, self._storage._generation, False)
+            return view
+        elif source is not None:
+            values = bytes(source._get_view(tile_idx))
+            del self._sources[tile_idx]
+            view = self._storage._get_tile(self, tile_idx)
+            view.cast("B")[:] = values
+        else:
+            view = self._storage._get_tile(self, tile_idx)
+
+        self._cached_tile = (tile_idx, view, self._storage._generation, True)
+        return view
+
+    def get_memory_size(self):
+        """:return: bytes of this layer's tiles that are currently mapped into memory (see also get_total_size)"""
+        with self._storage._lock:
+            return sum(self._storage._slot_bytes for key in self._storage._resident if key[0] == self._uid)
+
+    def make_copy(self, leave_empty=False):
+        res = _TiledParticleLayer(self._storage, self.w, self.h,
+                                  default_val=self._default_val,
+                                  min_val=self._min_val,
+                                  max_val=self._max_val,
+                                  out_of_bounds_val=self._oob_val,
+                                  _fill=leave_empty)
+        if not leave_empty:
+            # copy on write: the copy reads this layer's tiles, and only copies a tile when it's first written to.
+            # So the original mustn't be edited afterwards, which stepping never does (it writes to the copies).
+            with self._storage._lock:
+                res._sources = {tile_idx: self._sources.get(tile_idx, self) for tile_idx in range(0, self._n_tiles)}
+        return res
+
+    def set_value_not_threadsafe(self, xy, val):
+        if self.is_valid(xy):
+            tile_idx, idx = self._locate(xy)
+            with self._storage._lock:
+                self._get_view(tile_idx, writable=True)[idx] = val
+
+    def fill_not_threadsafe(self, val):
+        storage = self._storage
+        storage._release_layer(self._uid)
+        with storage._lock:
+            self._sources = {}
+            storage._layer_sizes[self._uid] = self._file_size
+            self._file.seek(0)
+            self._file.truncate(0)
+            if val == 0:
+                self._file.truncate(self._file_size)
+            else:
+                tile_bytes = array.array("d", [val]).tobytes() * (storage._slot_bytes // TiledLayerStorage.BYTES_PER_VALUE)
+                for _ in range(0, self._file_size // storage._slot_bytes):
+                    self._file.write(tile_bytes)
+            self._file.flush()
+
+    def get_flat_values(self, clamp=True):
+        if clamp:
+            return [self.get_value((x, y)) for x in range(0, self.w) for y in range(0, self.h)]
+
+        res = []
+        with self._storage._lock:
+            for x in range(0, self.w):
+                for y in range(0, self.h):
+                    tile_idx, idx = self._locate((x, y))
+                    res.append(self._get_view(tile_idx)[idx])
+        return res
+
+    def reduce(self, kind, rect=None):
+        x, y, w, h = [0, 0, self.w, self.h] if rect is None else rect
+        reduce_funct, merge_funct = sim._REDUCTIONS[kind]
+        return merge_funct([reduce_funct([self.get_value((col_x, col_y)) for col_y in range(y, y + h)])
+                            for col_x in range(x, x + w)])
+
+    def set_flat_values_not_threadsafe(self, vals):
+        if len(vals) != self.w * self.h:
+            raise ValueError("expected {} values, got {}".format(self.w * self.h, len(vals)))
+        for x in range(0, self.w):
+            for y in range(0, self.h):
+                self.set_value_not_threadsafe((x, y), vals[x * self.h + y])
+
+    # add_value & get_value inline is_valid & _locate, since they're called for every cell, several times per step
+
+    def add_value(self, xy, val):
+        x, y = xy
+        if 0 <= x < self.w and 0 <= y < self.h:
+            tile_x, local_x = divmod(x, self._tile_w)
+            tile_y, local_y = divmod(y, self._tile_h)
+            tile_idx = tile_x * self._n_tiles_y + tile_y
+            with self._storage._lock:
+                self._get_view(tile_idx, writable=True)[local_x * self._tile_h + local_y] += val
+
+    def get_value(self, xy):
+        x, y = xy
+        if 0 <= x < self.w and 0 <= y < self.h:
+            tile_x, local_x = divmod(x, self._tile_w)
+            tile_y, local_y = divmod(y, self._tile_h)
+            with self._storage._lock:
+                val = self._get_view(tile_x * self._n_tiles_y + tile_y)[local_x * self._tile_h + local_y]
+            if self._max_val is not None and val > self._max_val:
+                return self._max_val
+            elif self._min_val is not None and val < self._min_val:
+                return self._min_val
+            else:
+                return val
+        else:
+            return self._oob_val
@@ -3,15 +3,28 @@ import colors
 import time
 import pathlib
 
+import framering
+import npzfile
+import pngfile
+import worker
+
 
 class SimulationDisplay:
 
     FPS = 20
 
-    def __init__(self, simulation_provider, name="Simulation", window_size=(640, 480)):
+    def __init__(self, simulation_provider, name="Simulation", window_size=(640, 480), continuous=False):
+        """
+        :param continuous: if True, a SimulationWorker steps the simulation back to back instead of once per
+            auto_play_delay, and the display just shows whichever timestep is latest (so when recording, skipped
+            timesteps aren't saved).
+        """
         self.simulation_provider = simulation_provider
         self.simulation = simulation_provider()
 
+        self.continuous = continuous
+        self._worker = None
+
         self.auto_play = True
         self.auto_play_delay = 200     # milliseconds
         self.min_auto_play_delay = 200
@@ -33,6 +46,8 @@ class SimulationDisplay:
         self._record_output = False
         self._output_dest = pathlib.Path("outputs/default/")
         self._output_size = (640, 480)
+        self._output_format = "png"
+        self._output_compression = 6
         self._last_timestep_saved = -1
 
         self.screen = None
@@ -45,6 +60,17 @@ class SimulationDisplay:
         self.auto_play = True
         self.simulation = self.simulation_provider()
         self.has_finished = False
+        self._start_worker_if_continuous()
+
+    def _start_worker_if_continuous(self):
+        if self._worker is not None:
+            self._worker.stop(wait=False)
+            self._worker = None
+
+        if self.continuous:
+            self._worker = worker.SimulationWorker(self.simulation).start()
+            if self.auto_play:
+                self._worker.run_until_done()
 
     def _draw_simulation(self, timestep):
         if self._simul_surface_dirty:
@@ -60,10 +86,23 @@ class SimulationDisplay:
 
             self._last_timestep_drawn = timestep
 
-    def record_output(self, output_dir=None, img_size=None):
+    def record_output(self, output_dir=None, img_size=None, output_format="png", compression=6):
+        """
+        :param output_format: what to write for each timestep:
+            "png" - full color RGBA images
+            "palette" - palette images, much smaller when there are only a few colors. Frames with more than 256
+                colors are written as RGB images instead.
+            "greyscale" - single channel images, for the inkblots
+            "layers" - the raw values of the simulation's layers, as a .npz file (see npzfile.py). img_size is ignored.
+        :param compression: zlib compression level, 0-9. Doesn't apply to "png".
+        """
+        if output_format not in ("png", "palette", "greyscale", "layers"):
+            raise ValueError("unknown output format: {}".format(output_format))
         self._record_output = True
         self._output_dest = pathlib.Path(output_dir) if output_dir is not None else self._output_dest
         self._output_size = img_size  # None means use the simulation's actual size
+        self._output_format = output_format
+        self._output_compression = compression
         self._last_timestep_saved = -1
         print("INFO: recording outputs to: {}".format(self._output_dest))
 
@@ -73,6 +112,15 @@ class SimulationDisplay:
             self._output_dest.mkdir(parents=True, exist_ok=True)
             simul_size = simul_surface.get_size()
 
+            if self._output_format == "layers":
+                frame = self.simulation.get_published_frame()
+                fname = "output_{}.npz".format(str(timestep).zfill(4))
+                filepath = pathlib.Path(self._output_dest, fname)
+                print("INFO: writing {}".format(filepath))
+                npzfile.write_layers(filepath, {key: frame.get_layer(key) for key in frame.get_layer_keys()},
+                                     compression=self._output_compression)
+                return
+
             if self._output_size is None or simul_size == self._output_size:
                 surface_to_save = simul_surface
             else:
@@ -83,7 +131,17 @@ class SimulationDisplay:
             filepath = pathlib.Path(self._output_dest, fname)
 
             print("INFO: writing {}".format(filepath))
-            pygame.image.save(surface_to_save, str(filepath))
+            if self._output_format == "png":
+                pygame.image.save(surface_to_save, str(filepath))
+            else:
+                w, h = surface_to_save.get_size()
+                rgb = pygame.image.tostring(surface_to_save, "RGB")
+                if self._output_format == "palette":
+                    if not pngfile.write_palette(filepath, w, h, rgb, compression=self._output_compression):
+                        print("WARN: {} has more than 256 colors, wrote it as RGB".format(filepath))
+                else:
+                    pngfile.write_greyscale(filepath, w, h, pngfile.rgb_to_greyscale(rgb),
+                                            compression=self._output_compression)
 
     def _draw_loading_bar(self):
         prog = self.simulation.get_percent_completed()
@@ -106,6 +164,8 @@ class SimulationDisplay:
         running = True
         clock = pygame.time.Clock()
 
+        self._start_worker_if_continuous()
+
         while running:
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
@@ -127,6 +187,11 @@ class SimulationDisplay:
                     elif event.key == pygame.K_RETURN:
                         self.auto_play = not self.auto_play
                         print("INFO: set auto_play={}".format(self.auto_play))
+                        if self._worker is not None:
+                            if self.auto_play:
+                                self._worker.run_until_done()
+                            else:
+                                self._worker.pause()
                     elif event.key == pygame.K_RIGHT:
                         self.auto_play_delay = min(self.min_auto_play_delay,
                                                    self.auto_play_delay - self.auto_play_increment)
@@ -157,7 +222,11 @@ class SimulationDisplay:
 
             cur_time = int(time.time() * 1000)
 
-            if self.simulation.is_simulating():
+            if self._worker is not None:
+                if not self.has_finished and self.simulation.is_done() and not self._worker.is_busy():
+                    print("INFO: simulation is done")
+                    self.has_finished = True
+            elif self.simulation.is_simulating():
                 if self.show_loading_bar and cur_time - self.last_step_time > 1000:
                     self._draw_loading_bar()
             elif not self.has_finished:
@@ -172,3 +241,66 @@ class SimulationDisplay:
             clock.tick(SimulationDisplay.FPS)
 
             pygame.display.flip()
+
+        if self._worker is not None:
+            self._worker.stop()
+
+
+class SharedFrameDisplay:
+    """
+    Shows a simulation running in another process (see framering.SimulationProcess), by blitting the latest frame
+        from its frame ring. Nothing is simulated or rendered in this process, so the UI loop can't slow the
+        simulation down, and several displays can watch the same one.
+    """
+
+    FPS = 20
+
+    def __init__(self, ring_name, name="Simulation", window_size=(640, 480)):
+        self.ring_name = ring_name
+        self._name = name
+        self._initial_window_size = window_size
+
+        self._ring = None
+        self._last_frame_number = 0
+        self.simulation_surface = None
+        self.has_finished = False
+
+        self.screen = None
+
+    def start(self):
+        self._ring = framering.FrameRing.attach(self.ring_name)
+
+        pygame.init()
+
+        pygame.display.set_caption(self._name)
+
+        self.screen = pygame.display.set_mode(self._initial_window_size, pygame.RESIZABLE | pygame.DOUBLEBUF)
+
+        running = True
+        clock = pygame.time.Clock()
+
+        while running:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                    running = False
+
+            done = self._ring.is_done()
+            frame = self._ring.read_latest(after=self._last_frame_number)
+            if frame is not None:
+                self._last_frame_number = frame.number
+                self.simulation_surface = pygame.image.frombuffer(frame.rgb, frame.size, "RGB")
+            elif done and not self.has_finished:
+                print("INFO: simulation is done")
+                self.has_finished = True
+
+            self.screen.fill(colors.WHITE)
+            if self.simulation_surface is not None:
+                pygame.transform.scale(self.simulation_surface, self.screen.get_size(), self.screen)
+
+            clock.tick(SharedFrameDisplay.FPS)
+
+            pygame.display.flip()
+
+        self._ring.close()
@@ -0,0 +1,140 @@
+import threading
+
+
+class SimulationWorker:
+    """
+    A long-lived thread that steps a simulation back to back, driven by commands (run_steps, run_until_done, pause),
+        instead of a new thread per step. Consumers don't get every step, only every publish_every-th frame (and the
+        last one of each batch), so stepping isn't held back by how often the results are looked at.
+    """
+
+    def __init__(self, simulation, publish_every=1, render=False):
+        """
+        :param publish_every: publish a frame after every k steps
+        :param render: whether to render published frames (see sim.Frame.get_rgb) before publishing them
+        """
+        self.simulation = simulation
+        self.publish_every = publish_every
+        self.render = render
+
+        self._cond = threading.Condition()
+
+        # these must only be accessed while holding _cond
+        self._steps_remaining = 0   # -1 means until the simulation is done
+        self._is_stepping = False
+        self._stopped = False
+        self._latest_frame = None
+        self._frame_listeners = []
+        self._error = None          # the exception that stopped the last batch, until wait_until_idle raises it
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def run_steps(self, n):
+        """queues up n more steps"""
+        with self._cond:
+            if self._steps_remaining >= 0:
+                self._steps_remaining += n
+            self._cond.notify_all()
+
+    def run_until_done(self):
+        with self._cond:
+            self._steps_remaining = -1
+            self._cond.notify_all()
+
+    def pause(self):
+        """drops any queued steps. The step in progress (if any) still finishes."""
+        with self._cond:
+            self._steps_remaining = 0
+            self._cond.notify_all()
+
+    def stop(self, wait=True):
+        with self._cond:
+            self._stopped = True
+            self._steps_remaining = 0
+            self._cond.notify_all()
+        if wait and self._thread.is_alive() and threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def is_busy(self):
+        """:return: whether there are steps queued up or in progress"""
+        with self._cond:
+            return self._is_stepping or self._steps_remaining != 0
+
+    def wait_until_idle(self, timeout=None):
+        """
+        :return: False if it timed out
+        :raises: the exception a step (or frame listener) raised since the last call, if any. The queued steps are
+            dropped when that happens.
+        """
+        with self._cond:
+            res = self._cond.wait_for(lambda: self._stopped or not (self._is_stepping or self._steps_remaining != 0),
+                                      timeout=timeout)
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+        return res
+
+    def get_latest_frame(self):
+        """:return: the most recently published sim.Frame (see Simulator.get_published_frame), or None"""
+        with self._cond:
+            return self._latest_frame
+
+    def add_frame_listener(self, listener):
+        """:param listener: lambda frame -> None, called on the worker thread whenever a frame is published"""
+        with self._cond:
+            self._frame_listeners.append(listener)
+
+    def remove_frame_listener(self, listener):
+        with self._cond:
+            if listener in self._frame_listeners:
+                self._frame_listeners.remove(listener)
+
+    def _publish(self):
+        frame = self.simulation.get_published_frame()
+        if self.render:
+            frame.get_rgb()
+
+        with self._cond:
+            self._latest_frame = frame
+            listeners = list(self._frame_listeners)
+
+        for listener in listeners:
+            listener(frame)
+
+    def _run(self):
+        steps_since_publish = 0
+        while True:
+            with self._cond:
+                self._is_stepping = False
+                self._cond.notify_all()
+                self._cond.wait_for(lambda: self._stopped or self._steps_remaining != 0)
+
+                if self._stopped:
+                    return
+
+                if self.simulation.is_done():
+                    self._steps_remaining = 0
+                    continue
+
+                if self._steps_remaining > 0:
+                    self._steps_remaining -= 1
+                self._is_stepping = True
+
+            try:
+                self.simulation.do_simulation()
+                steps_since_publish += 1
+
+                with self._cond:
+                    batch_finished = self._steps_remaining == 0
+                if steps_since_publish >= self.publish_every or batch_finished or self.simulation.is_done():
+                    self._publish()
+                    steps_since_publish = 0
+            except Exception as e:
+                print("WARN: simulation step failed: {}".format(e))
+                with self._cond:
+                    self._error = e
+                    self._steps_remaining = 0